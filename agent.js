@@ -47,12 +47,31 @@ setTimeout(() => {
     const NfcRKVnxuKZy04KWbdFu71Ou = androidappmusic.getExportByName("NfcRKVnxuKZy04KWbdFu71Ou");
     const decryptSample = new NativeFunction(NfcRKVnxuKZy04KWbdFu71Ou, 'ulong', ['pointer', 'uint', 'pointer', 'pointer', 'size_t']);
 
+    // First byte of a connection's key header that asks for key contexts to be set up ahead of the samples
+    const prewarmCommand = 0xff;
+    // Key contexts by key URI, least recently used first. Beyond the limit, the least recently used contexts
+    // that no connection is decrypting with are forgotten.
+    // They are not released natively: nothing off the device shows who owns the objects that getPersistentKey
+    // and decryptContext write to their out-params, or in which order they may be freed, and a wrong guess
+    // crashes the app. A forgotten context stays allocated, as every context did before this map had a limit
+    const kdContextLimit = 64;
     const kdContextMap = new Map();
 
+    function evictKdContexts(limit) {
+        for (const [uriStr, entry] of kdContextMap) {
+            if (kdContextMap.size <= limit) break;
+            if (entry.users > 0) continue;
+            kdContextMap.delete(uriStr);
+        }
+    }
+
     function getkdContext(adam, uri) {
         const uriStr = String.fromCharCode(...new Uint8Array(uri))
-        if (kdContextMap.has(uriStr)) {
-            return kdContextMap.get(uriStr);
+        const cached = kdContextMap.get(uriStr);
+        if (cached) {
+            kdContextMap.delete(uriStr);
+            kdContextMap.set(uriStr, cached);
+            return cached;
         }
 
         const defaultId = newStdStringFromBuffer(adam);
@@ -74,9 +93,33 @@ setTimeout(() => {
         const ptr2 = svfootHillPKey.readPointer();
         if (ptr2.isNull()) return null;
 
-        const ap = ptr2.add(0x18).readPointer();
-        if (!ap.isNull()) kdContextMap.set(uriStr, ap);
-        return ap;
+        const entry = {kdContext: ptr2.add(0x18).readPointer(), users: 0};
+        if (!entry.kdContext.isNull()) {
+            evictKdContexts(kdContextLimit - 1);
+            kdContextMap.set(uriStr, entry);
+        }
+        return entry;
+    }
+
+    async function readKeyHeader(s, adamSize) {
+        const adam = await s.input.readAll(adamSize);
+        const uriSize = (await s.input.readAll(1)).unwrap().readU8();
+        const uri = await s.input.readAll(uriSize);
+        return [adam, uri];
+    }
+
+    async function prewarm(s) {
+        // Pairs of adam id and key URI until an empty adam id, answered with the number of contexts set up
+        let warmed = 0;
+        while (true) {
+            const adamSize = (await s.input.readAll(1)).unwrap().readU8();
+            if (adamSize === 0)
+                break;
+            const [adam, uri] = await readKeyHeader(s, adamSize);
+            const entry = getkdContext(adam, uri);
+            if (entry !== null && !entry.kdContext.isNull()) warmed++;
+        }
+        await s.output.writeAll([Math.min(warmed, 0xff)]);
     }
 
     async function handleConnection(s) {
@@ -85,18 +128,26 @@ setTimeout(() => {
             const adamSize = (await s.input.readAll(1)).unwrap().readU8();
             if (adamSize === 0)
                 break;
-            const adam = await s.input.readAll(adamSize);
-            const uriSize = (await s.input.readAll(1)).unwrap().readU8();
-            const uri = await s.input.readAll(uriSize);
-            const kdContext = getkdContext(adam, uri);
+            if (adamSize === prewarmCommand) {
+                await prewarm(s);
+                continue;
+            }
+            const [adam, uri] = await readKeyHeader(s, adamSize);
+            const entry = getkdContext(adam, uri);
+            const kdContext = entry === null ? null : entry.kdContext;
             // console.log(adam, uri, kdContext)
-            while (true) {
-                const size = (await s.input.readAll(4)).unwrap().readU32();
-                if (size === 0)
-                    break;
-                const sample = await s.input.readAll(size);
-                decryptSample(kdContext.readPointer(), 5, sample.unwrap(), sample.unwrap(), sample.byteLength);
-                await s.output.writeAll(sample);
+            if (entry !== null) entry.users++;
+            try {
+                while (true) {
+                    const size = (await s.input.readAll(4)).unwrap().readU32();
+                    if (size === 0)
+                        break;
+                    const sample = await s.input.readAll(size);
+                    decryptSample(kdContext.readPointer(), 5, sample.unwrap(), sample.unwrap(), sample.byteLength);
+                    await s.output.writeAll(sample);
+                }
+            } finally {
+                if (entry !== null) entry.users--;
             }
         }
         await s.close();
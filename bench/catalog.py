@@ -0,0 +1,393 @@
+"""
+Load test the catalog enumeration against a generated amp-api: an artist with thousands of albums
+and a playlist with ten thousand tracks, with latency and 429 responses if asked for.
+
+Usage: python -m bench.catalog [--artist-albums 2000] [--album-tracks 12] [--playlist-tracks 10000]
+                               [--latency 0.05] [--throttle 0.01] [--recorded <directory>] [--json]
+                               [--scenarios playlist artist-albums ...]
+
+Every scenario calls the functions of src.api that rip_playlist, rip_artist and rip_album call before
+the first song is queued, and reports its wall time, the requests it took (by resource, and the 429s),
+the bytes the stand-in sent and how far the Python heap grew while it ran. The scenarios share the caches of src.api, like one
+shell would, so their order matters: the availability scenarios reuse the enumerated songs and albums.
+
+The stand-in runs in its own process, so that generating the responses does not count as enumerating.
+Like amp-api, it honours the fields[type] parameters and gzips the responses for clients accepting it.
+Its resources are copies of recorded amp-api resources with new ids and names. A directory given with
+--recorded replaces them with your own recordings: song.json, album.json, playlist.json and artist.json,
+each one resource (`data[0]` of a response) of the catalog endpoint of that type.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import multiprocessing
+import sys
+import time
+import tracemalloc
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import httpx
+from loguru import logger
+
+from bench.standin import StandIn, StandInTransport
+from src import api
+from src.utils import playlist_write_song_index
+
+STOREFRONT = "us"
+CHECK_STOREFRONT = "jp"
+ARTIST_ID = "1000001"
+PLAYLIST_ID = "pl.u-bench000000"
+PLAYLIST_ARTIST_ID = "1000002"
+# Page sizes of amp-api, the offsets src.api steps by
+PAGE_SIZES = {"albums": 25, "songs": 20, "tracks": 100}
+ARTWORK = {"width": 3000, "height": 3000, "url": "https://is1-ssl.mzstatic.com/image/thumb/Music/bench/{w}x{h}bb.jpg",
+           "bgColor": "1b1b1b", "textColor1": "f4f4f4", "textColor2": "e0e0e0", "textColor3": "c6c6c6",
+           "textColor4": "b4b4b4", "hasP3": False}
+META = {"contentVersion": {"RTCI": 1700000000000, "MZ_INDEXER": 1700000000000}}
+TEMPLATES = {
+    "song": {"id": "", "type": "songs", "href": "", "attributes": {
+        "albumName": "", "hasTimeSyncedLyrics": True, "genreNames": ["Pop", "Music"], "trackNumber": 1,
+        "releaseDate": "2020-01-01", "durationInMillis": 215000, "isVocalAttenuationAllowed": True,
+        "isMasteredForItunes": True, "isrc": "", "artwork": ARTWORK, "composerName": "Bench Composer",
+        "audioLocale": "en-US", "url": "", "playParams": {"id": "", "kind": "song"}, "discNumber": 1,
+        "hasCredits": True, "isAppleDigitalMaster": True, "hasLyrics": True,
+        "audioTraits": ["atmos", "lossless", "lossy-stereo", "spatial"], "name": "",
+        "previews": [{"url": "https://audio-ssl.itunes.apple.com/itunes-assets/AudioPreview/bench.m4a"}],
+        "artistName": "", "contentRating": "explicit",
+        "extendedAssetUrls": {"plus": "", "lightweight": "", "superLightweight": "", "lightweightPlus": "",
+                              "enhancedHls": "https://aod.itunes.apple.com/itunes-assets/HLSMusic/bench/P0.m3u8"}},
+        "meta": META},
+    "album": {"id": "", "type": "albums", "href": "", "attributes": {
+        "copyright": "℗ 2020 Bench Records", "genreNames": ["Pop", "Music"], "releaseDate": "2020-01-01",
+        "isMasteredForItunes": True, "upc": "", "artwork": ARTWORK, "url": "",
+        "playParams": {"id": "", "kind": "album"}, "recordLabel": "Bench Records", "isCompilation": False, "trackCount": 12, "isPrerelease": False,
+        "audioTraits": ["atmos", "lossless", "lossy-stereo", "spatial"], "isSingle": False, "name": "",
+        "artistName": "", "isComplete": True, "editorialNotes": {"standard": "", "short": ""}}, "meta": META},
+    "playlist": {"id": "", "type": "playlists", "href": "", "attributes": {
+        "hasCollaboration": False, "curatorName": "Bench Curator", "lastModifiedDate": "2024-01-01T00:00:00Z",
+        "audioTraits": [], "name": "", "isChart": False, "supportsSing": True, "playlistType": "editorial",
+        "description": {"standard": "A generated playlist"}, "artwork": ARTWORK,
+        "playParams": {"id": "", "kind": "playlist", "versionHash": "bench"}, "url": ""}},
+    "artist": {"id": "", "type": "artists", "href": "", "attributes": {
+        "name": "", "genreNames": ["Pop"], "artwork": ARTWORK, "url": ""}},
+}
+
+
+class Catalog:
+    """
+    The generated catalog. Ids are derived from each other, so nothing has to be stored:
+    the albums of an artist are the artist id and a five digit index, the songs of an album are the album id
+    and a two digit track number, and the UPC of an album is 8 and its id.
+    """
+    artist_albums: int
+    album_tracks: int
+    playlist_tracks: int
+    templates: dict[str, dict]
+
+    def __init__(self, artist_albums: int, album_tracks: int, playlist_tracks: int, templates: dict[str, dict]):
+        self.artist_albums = artist_albums
+        self.album_tracks = album_tracks
+        self.playlist_tracks = playlist_tracks
+        self.templates = templates
+
+    @staticmethod
+    def _resource(template: dict, resource_id: str, href: str, **attributes) -> dict:
+        resource = copy.deepcopy(template)
+        resource["id"] = resource_id
+        resource["href"] = href
+        resource["attributes"].update(attributes)
+        if "playParams" in resource["attributes"]:
+            resource["attributes"]["playParams"]["id"] = resource_id
+        return resource
+
+    def album_ids(self, artist_id: str) -> list[str]:
+        return [f"{artist_id}{index:05d}" for index in range(self.artist_albums)]
+
+    def song_ids(self, album_id: str) -> list[str]:
+        return [f"{album_id}{track:02d}" for track in range(1, self.album_tracks + 1)]
+
+    def playlist_song_ids(self) -> list[str]:
+        return [f"{PLAYLIST_ARTIST_ID}{index // self.album_tracks:05d}{index % self.album_tracks + 1:02d}"
+                for index in range(self.playlist_tracks)]
+
+    @staticmethod
+    def available(upc: str, storefront: str) -> bool:
+        """Nine albums in ten are available in every storefront"""
+        return zlib.crc32(f"{upc}/{storefront}".encode()) % 10 != 0
+
+    def artist(self, artist_id: str, storefront: str) -> dict:
+        artist = self._resource(self.templates["artist"], artist_id, f"/v1/catalog/{storefront}/artists/{artist_id}",
+                                name=f"Artist {artist_id}",
+                                url=f"https://music.apple.com/{storefront}/artist/bench/{artist_id}")
+        albums = self.album_ids(artist_id)
+        artist["relationships"] = {"albums": {
+            "href": f"/v1/catalog/{storefront}/artists/{artist_id}/albums",
+            "next": f"/v1/catalog/{storefront}/artists/{artist_id}/albums?offset=25" if len(albums) > 25 else None,
+            "data": [{"id": album_id, "type": "albums", "href": f"/v1/catalog/{storefront}/albums/{album_id}"}
+                     for album_id in albums[:25]]}}
+        return artist
+
+    def album(self, album_id: str, storefront: str) -> dict:
+        artist_id = album_id[:-5]
+        return self._resource(self.templates["album"], album_id, f"/v1/catalog/{storefront}/albums/{album_id}",
+                              name=f"Album {album_id}", artistName=f"Artist {artist_id}", upc=f"8{album_id}",
+                              trackCount=self.album_tracks,
+                              url=f"https://music.apple.com/{storefront}/album/bench/{album_id}")
+
+    def song(self, song_id: str, storefront: str) -> dict:
+        album_id = song_id[:-2]
+        return self._resource(self.templates["song"], song_id, f"/v1/catalog/{storefront}/songs/{song_id}",
+                              name=f"Song {song_id}", albumName=f"Album {album_id}",
+                              artistName=f"Artist {album_id[:-5]}", trackNumber=int(song_id[-2:]),
+                              isrc=f"BENCH{song_id}", url=f"https://music.apple.com/{storefront}/song/bench/{song_id}")
+
+    def playlist(self, playlist_id: str, storefront: str) -> dict:
+        playlist = self._resource(self.templates["playlist"], playlist_id,
+                                  f"/v1/catalog/{storefront}/playlists/{playlist_id}",
+                                  name=f"Playlist {playlist_id}",
+                                  url=f"https://music.apple.com/{storefront}/playlist/bench/{playlist_id}")
+        tracks = self.page(self.playlist_song_ids(), "tracks", 0, f"/v1/catalog/{storefront}/playlists/"
+                                                                  f"{playlist_id}/tracks", storefront)
+        playlist["relationships"] = {"curator": {"href": "", "data": [{"id": "1", "type": "curators"}]},
+                                     "tracks": {"href": f"/v1/catalog/{storefront}/playlists/{playlist_id}/tracks",
+                                                **tracks}}
+        return playlist
+
+    def page(self, ids: list[str], kind: str, offset: int, href: str, storefront: str) -> dict:
+        size = PAGE_SIZES[kind]
+        make = self.album if kind == "albums" else self.song
+        page = {"data": [make(resource_id, storefront) for resource_id in ids[offset:offset + size]]}
+        if offset + size < len(ids):
+            page["next"] = f"{href}?offset={offset + size}"
+        return page
+
+    @staticmethod
+    def sparse(response, query: dict[str, str]):
+        """Keep only the attributes that the fields[type] parameters ask for, in every resource of the response"""
+        if isinstance(response, list):
+            return [Catalog.sparse(item, query) for item in response]
+        if not isinstance(response, dict):
+            return response
+        response = {key: Catalog.sparse(value, query) for key, value in response.items()}
+        if "attributes" in response and f"fields[{response.get('type')}]" in query:
+            fields = query[f"fields[{response['type']}]"].split(",")
+            response["attributes"] = {key: value for key, value in response["attributes"].items() if key in fields}
+        return response
+
+    def route(self, path: str, query: dict[str, str]) -> tuple[str, dict | None]:
+        """Return the resource type of the request and its response, None if not found"""
+        resource, response = self._route(path, query)
+        return resource, self.sparse(response, query) if response else response
+
+    def _route(self, path: str, query: dict[str, str]) -> tuple[str, dict | None]:
+        match path.strip("/").split("/"):
+            case ["v1", "catalog", storefront, "artists", artist_id]:
+                return "artist", {"data": [self.artist(artist_id, storefront)]}
+            case ["v1", "catalog", storefront, "artists", artist_id, "albums"]:
+                return "artist albums", self.page(self.album_ids(artist_id), "albums", int(query.get("offset", 0)),
+                                                  path, storefront)
+            case ["v1", "catalog", storefront, "artists", artist_id, "songs"]:
+                song_ids = [song_id for album_id in self.album_ids(artist_id) for song_id in self.song_ids(album_id)]
+                return "artist songs", self.page(song_ids, "songs", int(query.get("offset", 0)), path, storefront)
+            case ["v1", "catalog", storefront, "playlists", playlist_id]:
+                return "playlist", {"data": [self.playlist(playlist_id, storefront)]}
+            case ["v1", "catalog", storefront, "playlists", _, "tracks"]:
+                return "playlist tracks", self.page(self.playlist_song_ids(), "tracks", int(query.get("offset", 0)),
+                                                    path, storefront)
+            case ["v1", "catalog", storefront, "albums"] if "filter[upc]" in query:
+                upcs = [upc for upc in query["filter[upc]"].split(",") if self.available(upc, storefront)]
+                return "albums by upc", {"data": [self.album(upc[1:], storefront) for upc in upcs]}
+            case ["v1", "catalog", storefront, "albums", album_id]:
+                album = self.album(album_id, storefront)
+                album["relationships"] = {
+                    "tracks": {"data": [self.song(song_id, storefront) for song_id in self.song_ids(album_id)]},
+                    "artists": {"data": [{"id": album_id[:-5], "type": "artists"}]},
+                    "record-labels": {"data": []}}
+                return "album", {"data": [album]}
+            case ["v1", "catalog", storefront, "songs"] if "ids" in query:
+                songs = []
+                for song_id in query["ids"].split(","):
+                    song = self.song(song_id, storefront)
+                    song["relationships"] = {"albums": {"data": [self.album(song_id[:-2], storefront)]}}
+                    songs.append(song)
+                return "songs by id", {"data": songs}
+            case ["v1", "catalog", storefront, "songs", song_id]:
+                song = self.song(song_id, storefront)
+                song["relationships"] = {"albums": {"data": [self.album(song_id[:-2], storefront)]},
+                                         "artists": {"data": [{"id": song_id[:-7], "type": "artists"}]}}
+                return "song", {"data": [song]}
+        return "unknown", None
+
+
+class CatalogStandIn(StandIn):
+    """Serves the generated catalog as amp-api, and its request counts on /_stats"""
+    catalog: Catalog
+    requests: dict[str, int]
+
+    def __init__(self, catalog: Catalog, latency: float, throttle: float):
+        super().__init__(latency, throttle)
+        self.catalog = catalog
+        self.requests = {}
+        self._render = lru_cache(maxsize=4096)(self._render)
+
+    def _render(self, path: str, query: tuple) -> tuple[str, bytes | None]:
+        resource, response = self.catalog.route(path, dict(query))
+        return resource, json.dumps(response, ensure_ascii=False).encode("utf-8") if response else None
+
+    async def respond(self, host: str, path: str, query: dict[str, str]) -> tuple[int, str, bytes]:
+        if path == "/_stats":
+            return 200, "application/json", json.dumps({"requests": self.requests, "sent": self.sent,
+                                                        "throttled": self.responses.get(429, 0)}).encode("utf-8")
+        resource, body = self._render(path, tuple(sorted(query.items())))
+        self.requests[resource] = self.requests.get(resource, 0) + 1
+        if body is None:
+            return 404, "application/json", b'{"errors": []}'
+        return 200, "application/json", body
+
+
+def _serve(catalog: Catalog, latency: float, throttle: float, connection):
+    async def serve():
+        stand_in = CatalogStandIn(catalog, latency, throttle)
+        await stand_in.start()
+        connection.send(stand_in.port)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def load_templates(recorded: Path | None) -> dict[str, dict]:
+    templates = copy.deepcopy(TEMPLATES)
+    if recorded:
+        for resource in templates:
+            if (recorded / f"{resource}.json").exists():
+                template = json.loads((recorded / f"{resource}.json").read_text(encoding="utf-8"))
+                template.pop("relationships", None)
+                templates[resource] = template
+    return templates
+
+
+async def _scenario_playlist(token: str, catalog_info: dict) -> int:
+    playlist = await api.get_playlist_info_and_tracks(PLAYLIST_ID, token, STOREFRONT, "en-US")
+    playlist = playlist_write_song_index(playlist)
+    catalog_info["playlist songs"] = [track.id for track in playlist.data[0].relationships.tracks.data]
+    return len(catalog_info["playlist songs"])
+
+
+async def _scenario_playlist_availability(token: str, catalog_info: dict) -> int:
+    song_ids = catalog_info.get("playlist songs") or []
+    await api.prefetch_storefront_availability(CHECK_STOREFRONT, token, song_ids=song_ids, storefront=STOREFRONT)
+    available = await asyncio.gather(*[api.exist_on_storefront_by_song_id(song_id, STOREFRONT, CHECK_STOREFRONT,
+                                                                          token, "en-US") for song_id in song_ids])
+    return sum(available)
+
+
+async def _scenario_artist_albums(token: str, catalog_info: dict) -> int:
+    await api.get_artist_info(ARTIST_ID, STOREFRONT, token, "en-US")
+    albums = await api.get_artist_albums(ARTIST_ID, STOREFRONT, token, "en-US")
+    catalog_info["artist albums"] = [(album.id, album.attributes.upc) for album in albums]
+    return len(await api.get_albums_from_artist(ARTIST_ID, STOREFRONT, token, "en-US"))
+
+
+async def _scenario_artist_availability(token: str, catalog_info: dict) -> int:
+    albums = catalog_info.get("artist albums") or []
+    await api.prefetch_storefront_availability(CHECK_STOREFRONT, token, upcs=[upc for _, upc in albums])
+    available = await asyncio.gather(*[api.exist_on_storefront_by_album_id(album_id, STOREFRONT, CHECK_STOREFRONT,
+                                                                           token, "en-US")
+                                       for album_id, _ in albums])
+    return sum(available)
+
+
+async def _scenario_artist_songs(token: str, catalog_info: dict) -> int:
+    return len(await api.get_songs_from_artist(ARTIST_ID, STOREFRONT, token, "en-US"))
+
+
+SCENARIOS = {
+    "playlist": _scenario_playlist,
+    "playlist-availability": _scenario_playlist_availability,
+    "artist-albums": _scenario_artist_albums,
+    "artist-availability": _scenario_artist_availability,
+    "artist-songs": _scenario_artist_songs,
+}
+
+
+async def run(args, port: int) -> list[dict]:
+    stats_client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}")
+
+    async def stats() -> dict:
+        return (await stats_client.get("/_stats")).json()
+
+    results = []
+    catalog_info = {}
+    with TemporaryDirectory() as cache_dir:
+        api.init_client_and_lock("", 32)
+        api.client = httpx.AsyncClient(transport=StandInTransport(port), event_hooks=api.client.event_hooks)
+        api.init_cache(cache_dir)
+        tracemalloc.start()
+        for name in args.scenarios:
+            before = await stats()
+            tracemalloc.reset_peak()
+            heap, _ = tracemalloc.get_traced_memory()
+            start = time.perf_counter()
+            error = None
+            try:
+                count = await SCENARIOS[name]("bench", catalog_info)
+            except Exception as e:
+                count, error = 0, f"{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            after = await stats()
+            requests = {resource: count - before["requests"].get(resource, 0)
+                        for resource, count in after["requests"].items()
+                        if count != before["requests"].get(resource, 0)}
+            results.append({"scenario": name, "items": count, "seconds": elapsed, "requests": requests,
+                            "sent_mib": (after["sent"] - before["sent"]) / 1024 / 1024,
+                            "throttled": after["throttled"] - before["throttled"], "peak_heap_mib": (peak - heap) / 1024 / 1024,
+                            "error": error})
+        tracemalloc.stop()
+        await api.client.aclose()
+    await stats_client.aclose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--artist-albums", type=int, default=2000)
+    parser.add_argument("--album-tracks", type=int, default=12)
+    parser.add_argument("--playlist-tracks", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean latency of every response in seconds")
+    parser.add_argument("--throttle", type=float, default=0.0, help="share of the requests answered with 429")
+    parser.add_argument("--recorded", type=Path, default=None, help="directory of recorded resources")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--json", default=False, action="store_true", help="print the result as JSON")
+    parser.add_argument("-v", "--verbose", default=False, action="store_true")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="INFO" if args.verbose else "ERROR")
+
+    catalog = Catalog(args.artist_albums, args.album_tracks, args.playlist_tracks, load_templates(args.recorded))
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    stand_in = multiprocessing.Process(target=_serve, args=(catalog, args.latency, args.throttle, sender),
+                                       daemon=True)
+    stand_in.start()
+    try:
+        results = asyncio.run(run(args, receiver.recv()))
+    finally:
+        stand_in.terminate()
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        requests = ", ".join(f"{count} {resource}" for resource, count in result["requests"].items())
+        print(f"{result['scenario']:>22} {result['items']:6d} items {result['seconds']:8.2f}s "
+              f"peak heap {result['peak_heap_mib']:7.1f} MiB  {result['sent_mib']:7.2f} MiB sent  "
+              f"{sum(result['requests'].values())} requests ({requests}), {result['throttled']} throttled")
+        if result["error"]:
+            print(f"{'':>22} failed: {result['error']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Check that the sparse fieldsets of src.api ask for every attribute that the models of src.models read.
+
+Usage: python -m bench.fieldsets [--recorded <directory>]
+
+Every catalog function of src.api is called against the generated catalog of bench.catalog, which honours
+the fields[type] parameters like amp-api. Each response is validated by its model twice: as it was sent,
+and as it would have been sent without the fields[type] parameters. A value that differs is an attribute
+read by the model but missing from api.CATALOG_FIELDS, and fails the check with exit status 1.
+A value that is empty in both is not covered by the templates of bench.catalog, and is only reported.
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Iterator
+
+import httpx
+from pydantic import BaseModel
+
+from bench.catalog import ARTIST_ID, PLAYLIST_ID, STOREFRONT, Catalog, load_templates
+from src import api
+from src.models import *
+
+MODELS: dict[str, type[BaseModel]] = {
+    "song": SongData,
+    "album": AlbumMeta,
+    "playlist": PlaylistInfo,
+    "playlist tracks": PlaylistTracks,
+    "artist": ArtistInfo,
+    "artist albums": ArtistAlbums,
+    "artist songs": ArtistSongs,
+    "albums by upc": AlbumUpcs,
+    "songs by id": SongUpcs,
+}
+
+
+def _diff(full, sparse, path: str) -> Iterator[tuple[str, bool | None]]:
+    """Yield the path of every value, with whether it differs, or None if it is empty in both"""
+    if isinstance(full, dict) and isinstance(sparse, dict):
+        for key in full:
+            yield from _diff(full[key], sparse.get(key), f"{path}.{key}")
+    elif isinstance(full, list) and isinstance(sparse, list) and len(full) == len(sparse):
+        for item, sparse_item in zip(full[:1], sparse[:1]):
+            yield from _diff(item, sparse_item, f"{path}[]")
+    elif full != sparse:
+        yield path, True
+    else:
+        yield path, None if full is None or full == [] else False
+
+
+async def check(catalog: Catalog) -> tuple[set[str], set[str]]:
+    missing, empty, covered = set(), set(), set()
+    requested = set()
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        query = dict(request.url.params)
+        resource, response = catalog.route(request.url.path, query)
+        if response is None:
+            return httpx.Response(404, json={"errors": []})
+        requested.add(resource)
+        _, full = catalog.route(request.url.path, {key: value for key, value in query.items()
+                                                   if not key.startswith("fields[")})
+        model = MODELS[resource]
+        for path, differs in _diff(model.model_validate(full).model_dump(),
+                                   model.model_validate(response).model_dump(), resource):
+            (missing if differs else empty if differs is None else covered).add(path)
+        return httpx.Response(200, json=response)
+
+    api.init_client_and_lock("", 8)
+    api.client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    cache_dir = TemporaryDirectory()
+    api.init_cache(cache_dir.name)
+    album_id = catalog.album_ids(ARTIST_ID)[0]
+    song_id = catalog.song_ids(album_id)[0]
+    await api.get_song_info(song_id, "bench", STOREFRONT, "en-US")
+    await api.get_album_info(album_id, "bench", STOREFRONT, "en-US")
+    await api.get_playlist_info_and_tracks(PLAYLIST_ID, "bench", STOREFRONT, "en-US")
+    await api.get_artist_info(ARTIST_ID, STOREFRONT, "bench", "en-US")
+    await api.get_artist_albums(ARTIST_ID, STOREFRONT, "bench", "en-US")
+    await api.get_songs_from_artist(ARTIST_ID, STOREFRONT, "bench", "en-US")
+    await api.get_album_by_upc(f"8{album_id}", STOREFRONT, "bench")
+    await api.get_existing_upcs((f"8{album_id}",), STOREFRONT, "bench")
+    await api.get_upcs_by_song_ids((song_id,), STOREFRONT, "bench")
+    await api.client.aclose()
+    cache_dir.cleanup()
+    never_requested = {f"{resource} (never requested)" for resource in set(api.CATALOG_FIELDS) - requested}
+    return missing, (empty - covered) | never_requested
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recorded", type=Path, default=None, help="directory of recorded resources")
+    args = parser.parse_args()
+
+    # Enough albums and tracks for every listing to have a second page
+    catalog = Catalog(30, 3, 150, load_templates(args.recorded))
+    missing, uncovered = asyncio.run(check(catalog))
+    for path in sorted(uncovered):
+        print(f"not covered by the templates: {path}")
+    for path in sorted(missing):
+        print(f"read by the model but not requested: {path}")
+    if missing:
+        sys.exit(1)
+    print("Every attribute read by the models is requested")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Check that the URL jobs of download-from-file and resume are started with backpressure.
+
+Usage: python -m bench.file_jobs [--lines 1000] [--job-seconds 0.01]
+
+The shell is given a stand-in for do_download that starts a job task sleeping for --job-seconds,
+and counts how many of them run at the same time. More than cmd.FILE_PARALLEL_JOBS at once,
+or a line that never ran, fails the check with exit status 1.
+"""
+import argparse
+import asyncio
+import os
+import sys
+from tempfile import NamedTemporaryFile
+
+from src import cmd
+from src.journal import Job
+
+
+class BenchShell(cmd.NewInteractiveShell):
+    """The shell without devices or a prompt, whose jobs only sleep"""
+    running: int
+    peak: int
+    started: list[str]
+
+    def __init__(self, job_seconds: float):
+        self.loop = asyncio.get_running_loop()
+        self.tasks = []
+        self.job_tasks = {}
+        self.running = 0
+        self.peak = 0
+        self.started = []
+        self.job_seconds = job_seconds
+
+    async def run_job(self):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(self.job_seconds)
+        finally:
+            self.running -= 1
+
+    async def do_download(self, raw_url: str, codec: str, force_download: bool, include: bool = False,
+                          job: Job = None, priority: int = None) -> Job:
+        job = Job(raw_url, codec)
+        self.started.append(raw_url)
+        if raw_url.endswith("illegal"):
+            # Finished right away, like an illegal URL
+            return job
+        task = self.loop.create_task(self.run_job())
+        self.job_tasks[job.id] = task
+        task.add_done_callback(lambda _: self.job_tasks.pop(job.id, None))
+        return job
+
+
+async def check(lines: int, job_seconds: float) -> BenchShell:
+    shell = BenchShell(job_seconds)
+    with NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as f:
+        for i in range(lines):
+            f.write(f"https://music.apple.com/jp/album/{i}{'/illegal' if i % 10 == 0 else ''}\n")
+    await shell.do_download_from_file(f.name, "alac", False)
+    # The command returns at once, the jobs are started in the background
+    while shell.tasks or shell.job_tasks:
+        await asyncio.sleep(job_seconds)
+    os.unlink(f.name)
+    return shell
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=1000)
+    parser.add_argument("--job-seconds", type=float, default=0.01)
+    args = parser.parse_args()
+
+    shell = asyncio.run(check(args.lines, args.job_seconds))
+    print(f"{len(shell.started)} of {args.lines} lines started, at most {shell.peak} jobs at once "
+          f"(limit {cmd.FILE_PARALLEL_JOBS})")
+    if shell.peak > cmd.FILE_PARALLEL_JOBS or len(shell.started) != args.lines:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
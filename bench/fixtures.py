@@ -0,0 +1,332 @@
+"""
+Generate synthetic encrypted songs, laid out the way Apple serves them, for the offline benchmark.
+
+Usage: python -m bench.fixtures <output directory> [--songs 12] [--duration 180] [--codecs alac aac ec3]
+
+Every codec is encoded once with ffmpeg from a sine tone into a fragmented MP4, then, for every song,
+rewritten into the encrypted layout of the CDN: the sample description becomes two `enca` entries
+with a `sinf` each, the first fragment uses the first one (the prefetch key) and the rest use the
+second (the song key), and every sample is scrambled with a keystream derived from its key URI,
+which the mock agent of bench.offline reverses.
+
+The output directory is the document root of the stand-in server of bench.offline, one directory
+per host, plus a manifest.json describing the album.
+"""
+import argparse
+import hashlib
+import json
+import struct
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import NamedTuple
+
+from src.types import Codec, CodecKeySuffix, prefetchKey
+
+STOREFRONT = "us"
+ALBUM_ID = "1900000000"
+ARTIST_ID = "1900000001"
+AMP_API_HOST = "amp-api.music.apple.com"
+CDN_HOST = "aod.itunes.apple.com"
+ARTWORK_HOST = "is1-ssl.mzstatic.com"
+CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+class Layout(NamedTuple):
+    ffmpeg_args: list[str]
+    group_id: str
+    codecs: str
+    channels: str
+    media_attributes: str
+    bandwidth: int
+    key_suffix: str
+
+
+LAYOUTS = {
+    Codec.ALAC: Layout(["-c:a", "alac", "-sample_fmt", "s16p", "-ac", "2", "-ar", "44100"],
+                       "audio-alac-stereo-44100-16", "alac", "2", "SAMPLE-RATE=44100,BIT-DEPTH=16", 1_000_000,
+                       CodecKeySuffix.KeySuffixAlac),
+    Codec.AAC: Layout(["-c:a", "aac", "-b:a", "256k", "-ac", "2", "-ar", "44100"],
+                      "audio-stereo-256", "mp4a.40.2", "2", "", 256_000, CodecKeySuffix.KeySuffixAAC),
+    Codec.EC3: Layout(["-c:a", "eac3", "-b:a", "768k", "-ac", "6", "-ar", "48000"],
+                      "audio-atmos-2768", "ec-3", "16/JOC", "", 768_000, CodecKeySuffix.KeySuffixAtmos),
+}
+
+
+def keystream_xor(data: bytes, key_uri: str) -> bytes:
+    """Scramble or unscramble a sample with the keystream of its key"""
+    stream = hashlib.shake_256(key_uri.encode("utf-8")).digest(len(data))
+    return (int.from_bytes(data, "big") ^ int.from_bytes(stream, "big")).to_bytes(len(data), "big")
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", 8 + len(payload)) + box_type + payload
+
+
+def _full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return _box(box_type, bytes([version]) + flags.to_bytes(3, "big") + payload)
+
+
+def _parse_boxes(data: bytes) -> list[tuple[bytes, bytes]]:
+    boxes = []
+    offset = 0
+    while offset < len(data):
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+        boxes.append((box_type, data[offset + header:offset + size]))
+        offset += size
+    return boxes
+
+
+def _sinf(original_format: bytes, kid: bytes) -> bytes:
+    # cbcs with a 1:9 pattern and a constant IV, as on the CDN
+    tenc = _full_box(b"tenc", 1, 0, bytes([0, 0x19, 1, 0]) + kid + bytes([16]) + bytes(16))
+    return _box(b"sinf", _box(b"frma", original_format)
+                + _full_box(b"schm", 0, 0, b"cbcs" + struct.pack(">I", 0x10000))
+                + _box(b"schi", tenc))
+
+
+def _protect_moov(payload: bytes, kids: list[bytes]) -> bytes:
+    children = []
+    for box_type, child in _parse_boxes(payload):
+        if box_type in CONTAINER_BOXES:
+            child = _protect_moov(child, kids)
+        elif box_type == b"stsd":
+            original_format, entry = _parse_boxes(child[8:])[0]
+            entries = [_box(b"enca", entry + _sinf(original_format, kid)) for kid in kids]
+            child = child[:4] + struct.pack(">I", len(entries)) + b"".join(entries)
+        children.append(_box(box_type, child))
+    return b"".join(children)
+
+
+def _protect_tfhd(payload: bytes, description_index: int) -> tuple[bytes, int]:
+    """Set the sample description index, return the tfhd and its default sample size"""
+    flags = int.from_bytes(payload[1:4], "big")
+    if flags & 0x01:
+        raise ValueError("Fragments with an explicit base data offset are not supported, "
+                         "encode with -movflags default_base_moof")
+    index = struct.pack(">I", description_index)
+    if flags & 0x02:
+        payload = payload[:8] + index + payload[12:]
+    else:
+        payload = payload[:1] + (flags | 0x02).to_bytes(3, "big") + payload[4:8] + index + payload[8:]
+    offset = 12 + (4 if flags & 0x08 else 0)
+    default_size = struct.unpack_from(">I", payload, offset)[0] if flags & 0x10 else None
+    return payload, default_size
+
+
+def _parse_trun(payload: bytes, default_size: int) -> tuple[int, list[int]]:
+    """Return the data offset of the run, or -1, and the sizes of its samples"""
+    flags = int.from_bytes(payload[1:4], "big")
+    count = struct.unpack_from(">I", payload, 4)[0]
+    offset = 8
+    data_offset = -1
+    if flags & 0x01:
+        data_offset = struct.unpack_from(">i", payload, offset)[0]
+        offset += 4
+    if flags & 0x04:
+        offset += 4
+    sizes = []
+    for _ in range(count):
+        if flags & 0x100:
+            offset += 4
+        if flags & 0x200:
+            sizes.append(struct.unpack_from(">I", payload, offset)[0])
+            offset += 4
+        elif default_size is not None:
+            sizes.append(default_size)
+        else:
+            raise ValueError("Sample size is neither in the trun nor in the tfhd")
+        offset += (4 if flags & 0x400 else 0) + (4 if flags & 0x800 else 0)
+    return data_offset, sizes
+
+
+def _protect_fragment(moof: bytes, mdat: bytes, description_index: int, key_uri: str) -> tuple[bytes, bytes]:
+    def build(delta: int) -> tuple[bytes, list[tuple[int, list[int]]]]:
+        children, runs = [], []
+        for box_type, child in _parse_boxes(moof):
+            if box_type == b"traf":
+                traf, default_size = [], None
+                for traf_type, traf_child in _parse_boxes(child):
+                    if traf_type == b"tfhd":
+                        traf_child, default_size = _protect_tfhd(traf_child, description_index)
+                    elif traf_type == b"trun":
+                        data_offset, sizes = _parse_trun(traf_child, default_size)
+                        runs.append((data_offset, sizes))
+                        if data_offset >= 0:
+                            traf_child = traf_child[:8] + struct.pack(">i", data_offset + delta) + traf_child[12:]
+                    traf.append(_box(traf_type, traf_child))
+                child = b"".join(traf)
+            children.append(_box(box_type, child))
+        return _box(b"moof", b"".join(children)), runs
+
+    protected_moof, runs = build(0)
+    protected_moof, _ = build(len(protected_moof) - len(moof) - 8)
+    # With default_base_moof the data offsets count from the start of the moof, the mdat payload follows it
+    protected_mdat = bytearray(mdat)
+    position = 0
+    for data_offset, sizes in runs:
+        if data_offset >= 0:
+            position = data_offset - len(moof) - 16
+        for size in sizes:
+            protected_mdat[position:position + size] = keystream_xor(mdat[position:position + size], key_uri)
+            position += size
+    return protected_moof, _box(b"mdat", bytes(protected_mdat))
+
+
+def protect_song(plain: bytes, song_id: str, key_suffix: str) -> tuple[bytes, bytes, list[bytes]]:
+    """Return the encrypted init segment, the encrypted fragments and the keys they use, in playlist order"""
+    song_key = f"skd://itunes.apple.com/bench/{song_id}/{key_suffix}"
+    kids = [hashlib.md5(prefetchKey.encode()).digest(), hashlib.md5(song_key.encode()).digest()]
+    init, fragments, keys = b"", [], []
+    boxes = _parse_boxes(plain)
+    for i, (box_type, payload) in enumerate(boxes):
+        match box_type:
+            case b"moov":
+                init += _box(b"moov", _protect_moov(payload, kids))
+            case b"moof":
+                first = not fragments
+                key_uri = prefetchKey if first else song_key
+                moof, mdat = _protect_fragment(payload, boxes[i + 1][1], 1 if first else 2, key_uri)
+                fragments.append(moof + mdat)
+                keys.append(key_uri)
+            case b"mdat" | b"mfra" | b"sidx":
+                pass
+            case _:
+                if not fragments:
+                    init += _box(box_type, payload)
+    return init, fragments, keys
+
+
+def _media_playlist(file_name: str, init_size: int, fragments: list[bytes], keys: list[str],
+                    fragment_seconds: float) -> str:
+    lines = ["#EXTM3U", f"#EXT-X-TARGETDURATION:{int(fragment_seconds) + 1}", "#EXT-X-VERSION:7",
+             "#EXT-X-PLAYLIST-TYPE:VOD", "#EXT-X-INDEPENDENT-SEGMENTS",
+             f'#EXT-X-MAP:URI="{file_name}",BYTERANGE="{init_size}@0"']
+    offset, last_key = init_size, None
+    for fragment, key in zip(fragments, keys):
+        if key != last_key:
+            lines.append(f'#EXT-X-KEY:METHOD=SAMPLE-AES,URI="{key}",KEYFORMAT="com.apple.streamingkeydelivery",'
+                         f'KEYFORMATVERSIONS="1"')
+            # Other DRM systems are listed next to FairPlay and have to be skipped
+            lines.append('#EXT-X-KEY:METHOD=SAMPLE-AES,URI="data:text/plain;base64,AAAAAA==",'
+                         'KEYFORMAT="urn:uuid:edef8ba9-79d6-4ace-a3c8-27dcd51d21ed",KEYFORMATVERSIONS="1"')
+            last_key = key
+        lines += [f"#EXTINF:{fragment_seconds:.5f},", f"#EXT-X-BYTERANGE:{len(fragment)}@{offset}", file_name]
+        offset += len(fragment)
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def _master_playlist(codecs: list[str]) -> str:
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for codec in codecs:
+        layout = LAYOUTS[codec]
+        attributes = f",{layout.media_attributes}" if layout.media_attributes else ""
+        lines += [f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="{layout.group_id}",NAME="{codec}",AUTOSELECT=YES,'
+                  f'CHANNELS="{layout.channels}"{attributes}',
+                  f'#EXT-X-STREAM-INF:BANDWIDTH={layout.bandwidth},AVERAGE-BANDWIDTH={layout.bandwidth},'
+                  f'CODECS="{layout.codecs}",AUDIO="{layout.group_id}"',
+                  f"{codec}.m3u8"]
+    return "\n".join(lines) + "\n"
+
+
+def _album_attributes(cover_url: str, songs: int) -> dict:
+    return {"artistName": "Bench Artist", "name": "Bench Album", "genreNames": ["Benchmark"],
+            "releaseDate": "2024-01-01", "upc": "190000000000", "copyright": "℗ 2024 Bench",
+            "recordLabel": "Bench Records", "trackCount": songs, "isSingle": False, "isCompilation": False,
+            "isComplete": True, "url": f"https://music.apple.com/{STOREFRONT}/album/bench-album/{ALBUM_ID}",
+            "artwork": {"width": 3000, "height": 3000, "url": cover_url}}
+
+
+def _song_attributes(song_id: str, track: int, duration: int, cover_url: str) -> dict:
+    return {"artistName": "Bench Artist", "name": f"Bench Track {track:02d}", "albumName": "Bench Album",
+            "genreNames": ["Benchmark"], "trackNumber": track, "discNumber": 1,
+            "durationInMillis": duration * 1000, "releaseDate": "2024-01-01", "isrc": f"BENCH{song_id}",
+            "composerName": "Bench Composer", "hasLyrics": False, "hasTimeSyncedLyrics": False,
+            "audioTraits": ["atmos", "lossless", "lossy-stereo"], "previews": [],
+            "url": f"https://music.apple.com/{STOREFRONT}/song/bench-track-{track:02d}/{song_id}",
+            "playParams": {"id": song_id, "kind": "song"},
+            "artwork": {"width": 3000, "height": 3000, "url": cover_url}}
+
+
+def _write(root: Path, host: str, path: str, content: bytes | str):
+    file = root / host / path.lstrip("/")
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_bytes(content.encode("utf-8") if isinstance(content, str) else content)
+
+
+def _encode(codec: str, duration: int, fragment_seconds: float, out: Path) -> bytes:
+    subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+                    *LAYOUTS[codec].ffmpeg_args, "-f", "mp4",
+                    "-movflags", "empty_moov+default_base_moof+skip_trailer",
+                    "-frag_duration", str(int(fragment_seconds * 1_000_000)), str(out)], check=True)
+    return out.read_bytes()
+
+
+def generate(root: Path, songs: int, duration: int, codecs: list[str], fragment_seconds: float) -> dict:
+    cover_url = f"https://{ARTWORK_HOST}/image/thumb/bench/{ALBUM_ID}/{{w}}x{{h}}bb.jpg"
+    with TemporaryDirectory() as tmp_dir:
+        plain = {codec: _encode(codec, duration, fragment_seconds, Path(tmp_dir) / f"{codec}.mp4")
+                 for codec in codecs}
+        cover = Path(tmp_dir) / "cover.jpg"
+        subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", "color=c=0x3050a0:s=600x600",
+                        "-frames:v", "1", str(cover)], check=True)
+        _write(root, ARTWORK_HOST, f"/image/thumb/bench/{ALBUM_ID}/cover.jpg", cover.read_bytes())
+
+    album_attributes = _album_attributes(cover_url, songs)
+    song_ids, tracks, song_bytes = [], [], 0
+    for track in range(1, songs + 1):
+        song_id = str(int(ALBUM_ID) + 100 + track)
+        song_dir = f"/bench/{song_id}"
+        for codec in codecs:
+            init, fragments, keys = protect_song(plain[codec], song_id, LAYOUTS[codec].key_suffix)
+            _write(root, CDN_HOST, f"{song_dir}/{codec}.mp4", init + b"".join(fragments))
+            _write(root, CDN_HOST, f"{song_dir}/{codec}.m3u8",
+                   _media_playlist(f"{codec}.mp4", len(init), fragments, keys, fragment_seconds))
+            song_bytes += len(init) + sum(len(fragment) for fragment in fragments)
+        _write(root, CDN_HOST, f"{song_dir}/master.m3u8", _master_playlist(codecs))
+        attributes = _song_attributes(song_id, track, duration, cover_url)
+        master_url = f"https://{CDN_HOST}{song_dir}/master.m3u8"
+        song = {"id": song_id, "type": "songs",
+                "attributes": {**attributes, "extendedAssetUrls": {"enhancedHls": master_url}},
+                "relationships": {"albums": {"data": [{"id": ALBUM_ID, "type": "albums",
+                                                       "attributes": album_attributes}]},
+                                  "artists": {"data": [{"id": ARTIST_ID, "type": "artists"}]}}}
+        _write(root, AMP_API_HOST, f"/v1/catalog/{STOREFRONT}/songs/{song_id}", json.dumps({"data": [song]}))
+        song_ids.append(song_id)
+        tracks.append({"id": song_id, "type": "songs", "attributes": attributes,
+                       "relationships": {"artists": {"data": [{"id": ARTIST_ID, "type": "artists",
+                                                               "attributes": {"name": "Bench Artist"}}]}}})
+    album = {"data": [{"id": ALBUM_ID, "type": "albums", "attributes": album_attributes,
+                       "relationships": {"tracks": {"data": tracks},
+                                         "artists": {"data": [{"id": ARTIST_ID, "type": "artists",
+                                                               "attributes": {"name": "Bench Artist"}}]},
+                                         "record-labels": {"data": []}}}]}
+    _write(root, AMP_API_HOST, f"/v1/catalog/{STOREFRONT}/albums/{ALBUM_ID}", json.dumps(album))
+    manifest = {"storefront": STOREFRONT, "album": ALBUM_ID, "songs": song_ids, "codecs": codecs,
+                "duration": duration, "bytes": song_bytes}
+    (root / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--songs", type=int, default=12)
+    parser.add_argument("--duration", type=int, default=180, help="length of every song in seconds")
+    parser.add_argument("--codecs", nargs="+", choices=list(LAYOUTS), default=list(LAYOUTS))
+    parser.add_argument("--fragment", type=float, default=2.0, help="length of every fragment in seconds")
+    args = parser.parse_args()
+    manifest = generate(args.output, args.songs, args.duration, args.codecs, args.fragment)
+    print(f"{len(manifest['songs'])} songs in {', '.join(manifest['codecs'])}, "
+          f"{manifest['bytes'] / 1024 / 1024:.1f} MiB, written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
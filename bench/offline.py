@@ -0,0 +1,243 @@
+"""
+Rip a synthetic album end to end without Apple's servers or a phone, and report the throughput.
+
+Usage: python -m bench.fixtures <fixture directory>
+       python -m bench.offline <fixture directory> [-c alac] [--mode album|songs] [--agents 2]
+                               [--decrypt-rate 0] [--key-setup 0] [--config config.example.toml]
+                               [--trace trace.json] [--json]
+
+amp-api, the CDN and the artwork host are served by a local stand-in from the fixture directory:
+the HTTP client is given a transport that sends every request to it, with the original Host header.
+Decryption goes to mock agents speaking the protocol of agent.js, which reverse the scrambling of
+bench.fixtures, optionally throttled to the given MiB/s per agent to imitate a phone.
+Everything else is the real thing: the scheduler, the pipeline stages, gpac, mp4box, ffmpeg and the disk,
+so ffmpeg, gpac, mp4box, mp4edit and mp4extract have to be installed.
+
+The album is ripped once into a temporary directory, with the settings of the config file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import httpx
+import regex
+from loguru import logger
+
+from bench.fixtures import LAYOUTS, keystream_xor
+from bench.standin import StandIn, StandInTransport
+from src import api, journal, library, metrics, output, pipeline, scheduler, tracing
+from src.adb import HyperDecryptDevice
+from src.config import Config
+from src.decrypt import PREWARM_COMMAND
+from src.journal import SongState
+from src.rip import rip_album, rip_song
+from src.types import GlobalAuthParams
+from src.url import Album, Song, URLType
+
+CONTENT_TYPES = {".m3u8": "application/vnd.apple.mpegurl", ".mp4": "video/mp4", ".jpg": "image/jpeg"}
+
+
+class FixtureStandIn(StandIn):
+    """Serves the fixture directory, one directory per host"""
+    root: Path
+    _files: dict[Path, bytes]
+
+    def __init__(self, root: Path):
+        super().__init__()
+        self.root = root.absolute()
+        self._files = {}
+
+    async def respond(self, host: str, path: str, query: dict[str, str]) -> tuple[int, str, bytes]:
+        file = (self.root / host / path.lstrip("/")).resolve()
+        # The artwork host scales covers to any size, the fixtures have one
+        file = file.with_name(regex.sub(r"^\d+x\d+bb\.\w+$", "cover.jpg", file.name))
+        if not file.is_relative_to(self.root) or not file.is_file():
+            return 404, "application/json", b'{"errors": []}'
+        # Keep the files in memory, so that the disk of the fixtures is not part of the benchmark
+        if file not in self._files:
+            self._files[file] = file.read_bytes()
+        return 200, CONTENT_TYPES.get(file.suffix, "application/json"), self._files[file]
+
+
+async def start_agent(rate: float, key_setup: float = 0) -> int:
+    """
+    Start a mock agent on a free port, unscrambling at most rate bytes per second if given.
+    Setting up the context of a key URI the agent has not seen takes key_setup seconds, like fetching the key
+    """
+    contexts: dict[str, asyncio.Task] = {}
+
+    async def get_context(key_uri: str):
+        if key_uri not in contexts:
+            contexts[key_uri] = asyncio.create_task(asyncio.sleep(key_setup))
+        await contexts[key_uri]
+
+    async def read_key_uri(reader: asyncio.StreamReader, adam_size: int) -> str:
+        await reader.readexactly(adam_size)
+        return (await reader.readexactly((await reader.readexactly(1))[0])).decode("utf-8")
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while adam_size := (await reader.readexactly(1))[0]:
+                if adam_size == PREWARM_COMMAND:
+                    warmed = 0
+                    while adam_size := (await reader.readexactly(1))[0]:
+                        await get_context(await read_key_uri(reader, adam_size))
+                        warmed += 1
+                    writer.write(bytes([min(warmed, 255)]))
+                    continue
+                key_uri = await read_key_uri(reader, adam_size)
+                await get_context(key_uri)
+                while size := int.from_bytes(await reader.readexactly(4), "little"):
+                    sample = await reader.readexactly(size)
+                    if rate:
+                        await asyncio.sleep(size / rate)
+                    writer.write(keystream_xor(sample, key_uri))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server.sockets[0].getsockname()[1]
+
+
+class BenchDevice:
+    """Stands in for an injected device: one agent is used directly, more are used as hyperDecryptDevices"""
+    host: str
+    serial: str
+    fridaPort: int
+    decryptLock: asyncio.Lock
+    hyperDecryptDevices: list[HyperDecryptDevice]
+
+    def __init__(self, ports: list[int]):
+        self.host = "127.0.0.1"
+        self.serial = "bench"
+        self.fridaPort = ports[0]
+        self.decryptLock = asyncio.Lock()
+        self.hyperDecryptDevices = [HyperDecryptDevice(self.host, port, self) for port in ports] \
+            if len(ports) > 1 else []
+
+    def restart_inject_frida(self):
+        logger.error("The mock agent refused the connection")
+
+    async def get_m3u8(self, adam_id: str):
+        return None
+
+
+def load_config(config_file: str, output: Path) -> Config:
+    config = Config.load_from_config(config_file)
+    config.download.getM3u8FromDevice = False
+    config.download.afterDownloaded = ""
+    config.download.proxy = ""
+    config.m3u8Api.enable = False
+    config.cache.directory = str(output / "cache")
+    return config
+
+
+def init(config: Config, port: int):
+    api.init_client_and_lock("", config.download.parallelNum)
+    api.client = httpx.AsyncClient(transport=StandInTransport(port), event_hooks=api.client.event_hooks)
+    api.init_cache(config.cache.directory, config.cache.catalogTtl)
+    library.init_library_index(config.cache.directory)
+    output.init_output_writer(config.download.fsyncSongs)
+    journal.init_job_journal(config.cache.directory)
+    scheduler.init_scheduler(config.download.songParallelNum, config.download.interactiveParallelNum,
+                             config.download.jobQueueSize)
+    pipeline.init_pipeline(config.download.networkWorkers, config.download.cpuWorkers,
+                           config.download.diskWorkers, config.download.stageQueueSize)
+
+
+def peak_rss() -> tuple[float, float]:
+    """Peak resident set size of this process and of its largest subprocess, in MiB"""
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+
+async def run(args) -> dict:
+    manifest = json.loads((args.fixtures / "manifest.json").read_text(encoding="utf-8"))
+    if args.codec not in manifest["codecs"]:
+        raise SystemExit(f"The fixtures have no {args.codec}, generated codecs: {', '.join(manifest['codecs'])}")
+    stand_in = FixtureStandIn(args.fixtures)
+    await stand_in.start()
+    device = BenchDevice([await start_agent(args.decrypt_rate * 1024 * 1024, args.key_setup)
+                          for _ in range(args.agents)])
+    storefront = manifest["storefront"]
+    auth_params = GlobalAuthParams(dsid="0", accountToken="", accountAccessToken="", storefront=storefront,
+                                   anonymousAccessToken="bench")
+    workdir = os.getcwd()
+    trace_file = str(Path(args.trace).absolute()) if args.trace else ""
+    with TemporaryDirectory() as output:
+        config = load_config(args.config, Path(output))
+        # The download paths of the config are relative, so the songs land in the temporary directory
+        os.chdir(output)
+        init(config, stand_in.port)
+        tracing.init_tracing(trace_file, [], "profiles")
+        album = Album(url="", storefront=storefront, id=manifest["album"], type=URLType.Album)
+        job = journal.job_journal.start_job(f"bench:{args.mode}", args.codec, force=True)
+        metrics.registry.job_stats(job.id)
+        start = time.perf_counter()
+        if args.mode == "album":
+            await rip_album(album, auth_params, args.codec, config, device, force_save=True, job=job)
+        else:
+            await asyncio.gather(*[rip_song(Song(url="", storefront=storefront, id=song_id, type=URLType.Song),
+                                            auth_params, args.codec, config, device, force_save=True, job=job)
+                                   for song_id in manifest["songs"]])
+        elapsed = time.perf_counter() - start
+        journal.job_journal.finish_job(job)
+        await api.client.aclose()
+        stats = metrics.registry.pop_job_stats(job.id)
+        saved = [file for file in Path(output).rglob("*") if file.is_file() and "cache" not in file.parts]
+        os.chdir(workdir)
+    states = {}
+    for state in job.songs.values():
+        states[state] = states.get(state, 0) + 1
+    rss, child_rss = peak_rss()
+    return {"codec": args.codec, "mode": args.mode, "agents": args.agents, "songs": len(manifest["songs"]),
+            "states": states, "seconds": elapsed,
+            "songs_per_minute": states.get(SongState.Saved, 0) / elapsed * 60,
+            "decrypted_bytes_per_second": (stats.decrypted_bytes if stats else 0) / elapsed,
+            "saved_files": len(saved), "peak_rss_mib": rss, "peak_child_rss_mib": child_rss,
+            "stages": {stage: {"count": count, "seconds": seconds}
+                       for stage, (count, seconds) in (stats.stages.items() if stats else [])}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", type=Path)
+    parser.add_argument("-c", "--codec", choices=list(LAYOUTS), default="alac")
+    parser.add_argument("--mode", choices=["album", "songs"], default="album",
+                        help="rip_album once, or rip_song for every song of the album at the same time")
+    parser.add_argument("--agents", type=int, default=1, help="mock agents, more than one are hyperDecryptDevices")
+    parser.add_argument("--decrypt-rate", type=float, default=0, help="MiB/s of every agent, 0 for unlimited")
+    parser.add_argument("--key-setup", type=float, default=0,
+                        help="seconds an agent takes to set up the context of a new key")
+    parser.add_argument("--config", default="config.example.toml")
+    parser.add_argument("--trace", default="", help="write a Chrome trace of the run to this file")
+    parser.add_argument("--json", default=False, action="store_true", help="print the result as JSON")
+    parser.add_argument("-v", "--verbose", default=False, action="store_true")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="INFO" if args.verbose else "WARNING")
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"{result['songs']} songs in {result['codec']} ({result['mode']}, {result['agents']} agents): "
+          f"{', '.join(f'{count} {state}' for state, count in result['states'].items())}")
+    print(f"{result['seconds']:.2f}s, {result['songs_per_minute']:.1f} songs/min, "
+          f"{result['decrypted_bytes_per_second'] / 1024 / 1024:.2f} MiB/s decrypted")
+    print(f"Peak RSS {result['peak_rss_mib']:.1f} MiB, largest subprocess {result['peak_child_rss_mib']:.1f} MiB")
+    for stage, stage_stats in result["stages"].items():
+        print(f"{stage:>10} {stage_stats['count']:5d}x {stage_stats['seconds']:8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
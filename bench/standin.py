@@ -0,0 +1,97 @@
+import asyncio
+import gzip
+import json
+import random
+import zlib
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+
+STATUS_TEXT = {200: "OK", 304: "Not Modified", 404: "Not Found", 429: "Too Many Requests"}
+TOO_MANY_REQUESTS = json.dumps({"errors": [{"id": "BENCH", "title": "Too Many Requests", "status": "429",
+                                            "code": "42900"}]}).encode("utf-8")
+
+
+class StandIn:
+    """
+    A local HTTP/1.1 server with keep-alive standing in for Apple's hosts, which are told apart by the Host header.
+    Subclasses answer the requests, this adds the latency and the rate limiting of the real servers,
+    ETags with 304 responses, gzips JSON for clients that accept it, and counts the responses by status
+    and the bytes sent.
+    """
+    latency: float
+    throttle: float
+    port: int
+    responses: dict[int, int]
+    sent: int
+    _random: random.Random
+    _server: asyncio.Server
+
+    def __init__(self, latency: float = 0.0, throttle: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.throttle = throttle
+        self.responses = {}
+        self.sent = 0
+        self._random = random.Random(seed)
+
+    async def start(self, port: int = 0):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def respond(self, host: str, path: str, query: dict[str, str]) -> tuple[int, str, bytes]:
+        """Return the status, the content type and the body of a GET request"""
+        raise NotImplementedError
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while request_line := await reader.readline():
+                _, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                await reader.readexactly(int(headers.get("content-length", 0)))
+                if self.latency:
+                    await asyncio.sleep(self._random.uniform(0.5, 1.5) * self.latency)
+                if self.throttle and self._random.random() < self.throttle:
+                    status, content_type, body = 429, "application/json", TOO_MANY_REQUESTS
+                else:
+                    url = urlsplit(target)
+                    status, content_type, body = await self.respond(headers.get("host", "").split(":")[0],
+                                                                    url.path, dict(parse_qsl(url.query)))
+                extra_headers = b"Retry-After: 1\r\n" if status == 429 else b""
+                if status == 200:
+                    etag = f'"{zlib.crc32(body):08x}"'
+                    extra_headers += f"ETag: {etag}\r\n".encode("latin-1")
+                    if headers.get("if-none-match") == etag:
+                        status, body = 304, b""
+                self.responses[status] = self.responses.get(status, 0) + 1
+                if body and content_type == "application/json" and "gzip" in headers.get("accept-encoding", ""):
+                    body = gzip.compress(body, 6)
+                    extra_headers += b"Content-Encoding: gzip\r\n"
+                self.sent += len(body)
+                writer.write(f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'OK')}\r\nContent-Type: {content_type}\r\n"
+                             f"Content-Length: {len(body)}\r\n".encode("latin-1") + extra_headers + b"\r\n")
+                writer.write(body)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class StandInTransport(httpx.AsyncHTTPTransport):
+    """Sends every request to the stand-in, keeping the Host header of the original URL"""
+    port: int
+
+    def __init__(self, port: int):
+        super().__init__()
+        self.port = port
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = request.url.copy_with(scheme="http", host="127.0.0.1", port=self.port)
+        return await super().handle_async_request(httpx.Request(request.method, url, headers=request.headers,
+                                                                stream=request.stream,
+                                                                extensions=request.extensions))
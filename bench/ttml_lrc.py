@@ -0,0 +1,90 @@
+"""
+Compare the TTML to LRC converter with the previous BeautifulSoup implementation.
+
+Usage: python -m bench.ttml_lrc <ttml file or directory> [...] [-n 20]
+
+The TTML files are the raw `ttml` attribute of the amp-api lyrics resource
+(`/v1/catalog/{storefront}/songs/{id}/lyrics`), one song per file.
+"""
+import argparse
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from src.utils import ttml_convent_to_lrc
+
+
+def get_digit_from_string(text: str) -> int:
+    return int(''.join(filter(str.isdigit, text)))
+
+
+def legacy_ttml_convent_to_lrc(ttml: str) -> str:
+    b = BeautifulSoup(ttml, features="xml")
+    lrc_lines = []
+    for item in b.tt.body.children:
+        for lyric in item.children:
+            h, m, s, ms = 0, 0, 0, 0
+            lyric_time: str = lyric.get("begin")
+            if lyric_time.find('.') == -1:
+                lyric_time += '.000'
+            match lyric_time.count(":"):
+                case 0:
+                    split_time = lyric_time.split(".")
+                    s, ms = get_digit_from_string(split_time[0]), get_digit_from_string(split_time[1])
+                case 1:
+                    split_time = lyric_time.split(":")
+                    s_ms = split_time[-1]
+                    del split_time[-1]
+                    split_time.extend(s_ms.split("."))
+                    m, s, ms = (get_digit_from_string(split_time[0]), get_digit_from_string(split_time[1]),
+                                get_digit_from_string(split_time[2]))
+                case 2:
+                    split_time = lyric_time.split(":")
+                    s_ms = split_time[-1]
+                    del split_time[-1]
+                    split_time.extend(s_ms.split("."))
+                    h, m, s, ms = (get_digit_from_string(split_time[0]), get_digit_from_string(split_time[1]),
+                                   get_digit_from_string(split_time[2]), get_digit_from_string(split_time[3]))
+            lrc_lines.append(
+                f"[{str(m + h * 60).rjust(2, '0')}:{str(s).rjust(2, '0')}.{str(int(ms / 10)).rjust(2, '0')}]{lyric.text}")
+    return "\n".join(lrc_lines)
+
+
+def load_payloads(paths: list[str]) -> list[str]:
+    payloads = []
+    for path in map(Path, paths):
+        files = sorted(path.glob("*.ttml")) if path.is_dir() else [path]
+        payloads.extend(file.read_text(encoding="utf-8") for file in files)
+    return payloads
+
+
+def measure(func, payloads: list[str], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            func(payload)
+    return (time.perf_counter() - start) / (rounds * len(payloads))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("-n", "--rounds", type=int, default=20)
+    args = parser.parse_args()
+    payloads = load_payloads(args.paths)
+    if not payloads:
+        parser.error("No TTML payloads found")
+    mismatches = sum(legacy_ttml_convent_to_lrc(payload) != ttml_convent_to_lrc(payload) for payload in payloads)
+    print(f"{len(payloads)} payloads, {sum(map(len, payloads)) / len(payloads) / 1024:.1f} KiB on average, "
+          f"{mismatches} with different output (the legacy converter misreads fractions shorter than 3 digits)")
+    legacy = measure(legacy_ttml_convent_to_lrc, payloads, args.rounds)
+    line = measure(ttml_convent_to_lrc, payloads, args.rounds)
+    word = measure(lambda payload: ttml_convent_to_lrc(payload, True), payloads, args.rounds)
+    print(f"legacy BeautifulSoup: {legacy * 1000:.3f} ms/song")
+    print(f"iterparse (line):     {line * 1000:.3f} ms/song ({legacy / line:.1f}x)")
+    print(f"iterparse (word):     {word * 1000:.3f} ms/song ({legacy / word:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,14 @@
+import argparse
 import asyncio
 import sys
 
 from src.cmd import NewInteractiveShell
+from src.daemon import Daemon
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--daemon", default=False, action="store_true")
+    args = parser.parse_args()
     if sys.platform in ('win32', 'cygwin', 'cli'):
         import winloop
         winloop.install()
@@ -13,6 +18,11 @@ if __name__ == '__main__':
     loop = asyncio.get_event_loop()
     cmd = NewInteractiveShell(loop)
     try:
-        loop.run_until_complete(cmd.start())
+        if args.daemon:
+            loop.run_until_complete(Daemon(cmd).serve())
+        else:
+            loop.run_until_complete(cmd.start())
     except KeyboardInterrupt:
+        if args.daemon:
+            loop.run_until_complete(Daemon.shutdown())
         loop.stop()
@@ -1,6 +1,9 @@
 import asyncio
+import importlib.util
 import logging
+import time
 from io import BytesIO
+from pathlib import Path
 from ssl import SSLError
 from typing import Optional
 
@@ -8,30 +11,112 @@ import httpx
 import regex
 from async_lru import alru_cache
 from loguru import logger
-from tenacity import retry, retry_if_exception_type, stop_after_attempt, before_sleep_log, wait_random_exponential
-
+from tenacity import retry, retry_if_exception, retry_if_exception_type, stop_after_attempt, before_sleep_log, \
+    wait_random_exponential
+
+from src import metrics, tracing
+from src.scheduler import SingleFlight
+from src.artwork import ArtworkCache
+from src.availability import StorefrontAvailabilityIndex
+from src.catalog_cache import CatalogCache
 from src.models import *
 from src.models.song_data import Datum
+from src.utils import chunk
 
 client: httpx.AsyncClient
 download_lock: asyncio.Semaphore
 request_lock: asyncio.Semaphore
+availability_index: StorefrontAvailabilityIndex
+catalog_cache: CatalogCache
+artwork_cache: ArtworkCache
+upc_checks = SingleFlight("upc_checks")
 retry_times = 32
 user_agent_browser = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 user_agent_itunes = "iTunes/12.11.3 (Windows; Microsoft Windows 10 x64 Professional Edition (Build 19041); x64) AppleWebKit/7611.1022.4001.1 (dt:2)"
 user_agent_app = "Music/5.7 Android/10 model/Pixel6GR1YH build/1234 (dt:66)"
+# httpx decodes br only with brotli installed, so it is only asked for then
+accept_encoding = "br, gzip" if importlib.util.find_spec("brotli") or importlib.util.find_spec("brotlicffi") else "gzip"
+# Sparse fieldsets of the catalog requests: the attributes the models of src.models read, and nothing else.
+# bench.fieldsets fails when a model reads an attribute that its request does not ask for
+CATALOG_FIELDS = {
+    "song": {"include": "albums,explicit", "omit[resource]": "autos",
+             "fields[songs]": "albumName,artistName,artwork,composerName,contentRating,discNumber,extendedAssetUrls,"
+                              "genreNames,hasTimeSyncedLyrics,isrc,name,releaseDate,trackNumber,url",
+             "fields[albums]": "artistName,copyright,name,recordLabel,releaseDate,upc"},
+    "album": {"include": "tracks", "omit[resource]": "autos", "fields[albums]": "artistName,name,releaseDate,upc,url",
+              "fields[songs]": "name", "fields[music-videos]": "name"},
+    "playlist": {"include": "tracks", "omit[resource]": "autos", "fields[playlists]": "curatorName,name,url",
+                 "fields[songs]": "name", "fields[music-videos]": "name"},
+    "playlist tracks": {"fields[songs]": "name", "fields[music-videos]": "name"},
+    "artist": {"omit[resource]": "autos", "fields[artists]": "name,url"},
+    "artist albums": {"fields[albums]": "name,upc,url"},
+    "artist songs": {"fields[songs]": "name,url"},
+    "albums by upc": {"fields[albums]": "upc"},
+    "songs by id": {"include": "albums", "fields[songs]": "name", "fields[albums]": "upc"},
+}
+
+
+async def _record_request(request: httpx.Request):
+    request.extensions["trace_start"] = time.perf_counter()
+
+
+async def _record_response(response: httpx.Response):
+    metrics.http_responses.inc(host=response.request.url.host, status=response.status_code)
+    if start := response.request.extensions.get("trace_start"):
+        tracing.complete(f"{response.request.method} {response.request.url.host}{response.request.url.path}", "http",
+                         start, time.perf_counter(), status=response.status_code)
+
+
+def catalog_request(resource: str, token: str, lang: str = None, user_agent: str = user_agent_browser,
+                    **params) -> dict:
+    """The params and headers of an amp-api request for a resource of CATALOG_FIELDS"""
+    params = {**CATALOG_FIELDS[resource], **params}
+    if lang:
+        params["l"] = lang
+    return {"params": params, "headers": {"Authorization": f"Bearer {token}", "User-Agent": user_agent,
+                                          "Origin": "https://music.apple.com", "Accept-Encoding": accept_encoding}}
 
 
 def init_client_and_lock(proxy: str, parallel_num: int):
     global client, download_lock, request_lock
+    event_hooks = {"request": [_record_request], "response": [_record_response]}
     if proxy:
-        client = httpx.AsyncClient(proxy=proxy)
+        client = httpx.AsyncClient(proxy=proxy, event_hooks=event_hooks)
     else:
-        client = httpx.AsyncClient()
+        client = httpx.AsyncClient(event_hooks=event_hooks)
     download_lock = asyncio.Semaphore(parallel_num)
     request_lock = asyncio.Semaphore(256)
 
 
+def init_cache(cache_dir: str, catalog_ttl: dict[str, int] = None):
+    global availability_index, artwork_cache, catalog_cache
+    availability_index = StorefrontAvailabilityIndex(Path(cache_dir) / "storefront_availability.db")
+    artwork_cache = ArtworkCache(Path(cache_dir) / "artwork")
+    catalog_cache = CatalogCache(Path(cache_dir) / "catalog.db", catalog_ttl)
+
+
+async def get_catalog(resource: str, url: str, params: dict, headers: dict, **kwargs) -> bytes:
+    """GET a catalog resource, from the catalog cache while it is fresh and revalidated with its ETag after"""
+    if not catalog_cache.enabled(resource):
+        return (await client.get(url, params=params, headers=headers, **kwargs)).content
+    key = catalog_cache.key(url, params)
+    cached = catalog_cache.get(key)
+    if cached and catalog_cache.fresh(resource, cached):
+        metrics.cache_lookup("catalog", True)
+        return cached.body
+    if cached and cached.etag:
+        headers = {**headers, "If-None-Match": cached.etag}
+    resp = await client.get(url, params=params, headers=headers, **kwargs)
+    if resp.status_code == 304 and cached:
+        metrics.cache_lookups.inc(cache="catalog", result="revalidated")
+        catalog_cache.touch(key)
+        return cached.body
+    metrics.cache_lookup("catalog", False)
+    if resp.status_code == 200:
+        catalog_cache.put(key, resource, resp.content, resp.headers.get("ETag"))
+    return resp.content
+
+
 @retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
        wait=wait_random_exponential(multiplier=1, max=60),
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
@@ -79,6 +164,7 @@ async def get_token():
 @retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
        wait=wait_random_exponential(multiplier=1, max=60),
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
+@metrics.timed("download")
 async def download_song(url: str) -> bytes:
     async with download_lock:
         result = BytesIO()
@@ -95,29 +181,25 @@ async def download_song(url: str) -> bytes:
 @retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
        wait=wait_random_exponential(multiplier=1, max=60),
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
+@metrics.timed("catalog")
 async def get_album_info(album_id: str, token: str, storefront: str, lang: str):
     async with request_lock:
-        req = await client.get(f"https://amp-api.music.apple.com/v1/catalog/{storefront}/albums/{album_id}",
-                               params={"omit[resource]": "autos", "include": "tracks,artists,record-labels",
-                                       "include[songs]": "artists", "fields[artists]": "name",
-                                       "fields[albums:albums]": "artistName,artwork,name,releaseDate,url",
-                                       "fields[record-labels]": "name", "l": lang},
-                               headers={"Authorization": f"Bearer {token}", "User-Agent": user_agent_browser,
-                                        "Origin": "https://music.apple.com"})
-        return AlbumMeta.model_validate(req.json())
+        body = await get_catalog("album", f"https://amp-api.music.apple.com/v1/catalog/{storefront}/albums/{album_id}",
+                                 **catalog_request("album", token, lang))
+        return AlbumMeta.model_validate_json(body)
 
 
 @alru_cache
 @retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
        wait=wait_random_exponential(multiplier=1, max=60),
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
+@metrics.timed("catalog")
 async def get_playlist_info_and_tracks(playlist_id: str, token: str, storefront: str, lang: str):
     async with request_lock:
-        resp = await client.get(f"https://amp-api.music.apple.com/v1/catalog/{storefront}/playlists/{playlist_id}",
-                                params={"l": lang},
-                                headers={"Authorization": f"Bearer {token}", "User-Agent": user_agent_browser,
-                                         "Origin": "https://music.apple.com"})
-        playlist_info_obj = PlaylistInfo.parse_obj(resp.json())
+        body = await get_catalog("playlist",
+                                 f"https://amp-api.music.apple.com/v1/catalog/{storefront}/playlists/{playlist_id}",
+                                 **catalog_request("playlist", token, lang))
+        playlist_info_obj = PlaylistInfo.model_validate_json(body)
         if playlist_info_obj.data[0].relationships.tracks.next:
             all_tracks = await get_playlist_tracks(playlist_id, token, storefront, lang)
             playlist_info_obj.data[0].relationships.tracks.data = all_tracks
@@ -130,12 +212,11 @@ async def get_playlist_info_and_tracks(playlist_id: str, token: str, storefront:
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
 async def get_playlist_tracks(playlist_id: str, token: str, storefront: str, lang: str, offset: int = 0):
     async with request_lock:
-        resp = await client.get(
+        body = await get_catalog(
+            "playlist tracks",
             f"https://amp-api.music.apple.com/v1/catalog/{storefront}/playlists/{playlist_id}/tracks",
-            params={"l": lang, "offset": offset},
-            headers={"Authorization": f"Bearer {token}", "User-Agent": user_agent_browser,
-                     "Origin": "https://music.apple.com"})
-        playlist_tracks = PlaylistTracks.parse_obj(resp.json())
+            **catalog_request("playlist tracks", token, lang, offset=offset))
+        playlist_tracks = PlaylistTracks.model_validate_json(body)
         tracks = playlist_tracks.data
         if playlist_tracks.next:
             next_tracks = await get_playlist_tracks(playlist_id, token, storefront, lang, offset + 100)
@@ -143,8 +224,14 @@ async def get_playlist_tracks(playlist_id: str, token: str, storefront: str, lan
         return tracks
 
 
-@alru_cache
-@retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
+def _cover_retryable(e: BaseException) -> bool:
+    # A missing or forbidden artwork stays so, only rate limits and server errors are worth waiting for
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, (httpx.HTTPError, SSLError, FileNotFoundError))
+
+
+@retry(retry=retry_if_exception(_cover_retryable),
        wait=wait_random_exponential(multiplier=1, max=60),
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
 async def get_cover(url: str, cover_format: str, cover_size: str):
@@ -152,20 +239,39 @@ async def get_cover(url: str, cover_format: str, cover_size: str):
         formatted_url = regex.sub('bb.jpg', f'bb.{cover_format}', url)
         req = await client.get(formatted_url.replace("{w}x{h}", cover_size),
                                headers={"User-Agent": user_agent_browser})
+        # An error page must never reach the artwork cache, which keeps covers forever
+        req.raise_for_status()
         return req.content
 
 
+@alru_cache
+async def get_cover_path(url: str, cover_format: str, cover_size: str) -> Optional[Path]:
+    """The cached cover, or None if the artwork host refuses it, in which case the song is saved without one"""
+    # Covers are hashed and written off the event loop
+    cover_path = await asyncio.to_thread(artwork_cache.get, url, cover_format, cover_size)
+    metrics.cache_lookup("artwork", bool(cover_path))
+    if not cover_path:
+        try:
+            cover = await get_cover(url, cover_format, cover_size)
+        except httpx.HTTPStatusError as e:
+            if _cover_retryable(e):
+                raise
+            logger.warning(f"Unable to get cover {url}: {e.response.status_code}")
+            return None
+        cover_path = await asyncio.to_thread(artwork_cache.put, url, cover_format, cover_size, cover)
+    return cover_path
+
+
 @alru_cache
 @retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
        wait=wait_random_exponential(multiplier=1, max=60),
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
+@metrics.timed("catalog")
 async def get_song_info(song_id: str, token: str, storefront: str, lang: str):
     async with request_lock:
-        req = await client.get(f"https://amp-api.music.apple.com/v1/catalog/{storefront}/songs/{song_id}",
-                               params={"extend": "extendedAssetUrls", "include": "albums,explicit", "l": lang},
-                               headers={"Authorization": f"Bearer {token}", "User-Agent": user_agent_itunes,
-                                        "Origin": "https://music.apple.com"})
-        song_data_obj = SongData.model_validate(req.json())
+        body = await get_catalog("song", f"https://amp-api.music.apple.com/v1/catalog/{storefront}/songs/{song_id}",
+                                 **catalog_request("song", token, lang, user_agent_itunes, extend="extendedAssetUrls"))
+        song_data_obj = SongData.model_validate_json(body)
         for data in song_data_obj.data:
             if data.id == song_id:
                 return data
@@ -178,12 +284,13 @@ async def get_song_info(song_id: str, token: str, storefront: str, lang: str):
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
 async def get_song_lyrics(song_id: str, storefront: str, token: str, dsid: str, account_token: str, lang: str) -> Optional[str]:
     async with request_lock:
-        req = await client.get(f"https://amp-api.music.apple.com/v1/catalog/{storefront}/songs/{song_id}/lyrics",
-                               params={"l": lang},
-                               headers={"Authorization": f"Bearer {token}", "User-Agent": user_agent_app,
-                                        "X-Dsid": dsid},
-                               cookies={f"mz_at_ssl-{dsid}": account_token})
-        result = SongLyrics.model_validate(req.json())
+        body = await get_catalog("lyrics",
+                                 f"https://amp-api.music.apple.com/v1/catalog/{storefront}/songs/{song_id}/lyrics",
+                                 params={"l": lang},
+                                 headers={"Authorization": f"Bearer {token}", "User-Agent": user_agent_app,
+                                          "X-Dsid": dsid, "Accept-Encoding": accept_encoding},
+                                 cookies={f"mz_at_ssl-{dsid}": account_token})
+        result = SongLyrics.model_validate_json(body)
         if result.data:
             return result.data[0].attributes.ttml
         else:
@@ -194,18 +301,22 @@ async def get_song_lyrics(song_id: str, storefront: str, token: str, dsid: str,
 @retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
        wait=wait_random_exponential(multiplier=1, max=60),
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
-async def get_albums_from_artist(artist_id: str, storefront: str, token: str, lang: str, offset: int = 0):
+async def get_artist_albums(artist_id: str, storefront: str, token: str, lang: str, offset: int = 0):
     async with request_lock:
-        resp = await client.get(f"https://amp-api.music.apple.com/v1/catalog/{storefront}/artists/{artist_id}/albums",
-                                params={"l": lang, "offset": offset},
-                                headers={"Authorization": f"Bearer {token}", "User-Agent": user_agent_browser,
-                                         "Origin": "https://music.apple.com"})
-        artist_album = ArtistAlbums.parse_obj(resp.json())
-        albums = [album.attributes.url for album in artist_album.data]
+        body = await get_catalog("artist albums",
+                                 f"https://amp-api.music.apple.com/v1/catalog/{storefront}/artists/{artist_id}/albums",
+                                 **catalog_request("artist albums", token, lang, offset=offset))
+        artist_album = ArtistAlbums.model_validate_json(body)
+        albums = artist_album.data
         if artist_album.next:
-            next_albums = await get_albums_from_artist(artist_id, storefront, token, lang, offset + 25)
+            next_albums = await get_artist_albums(artist_id, storefront, token, lang, offset + 25)
             albums.extend(next_albums)
-        return list(set(albums))
+        return albums
+
+
+async def get_albums_from_artist(artist_id: str, storefront: str, token: str, lang: str):
+    albums = await get_artist_albums(artist_id, storefront, token, lang)
+    return list(set([album.attributes.url for album in albums]))
 
 
 @alru_cache
@@ -214,11 +325,10 @@ async def get_albums_from_artist(artist_id: str, storefront: str, token: str, la
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
 async def get_songs_from_artist(artist_id: str, storefront: str, token: str, lang: str, offset: int = 0):
     async with request_lock:
-        resp = await client.get(f"https://amp-api.music.apple.com/v1/catalog/{storefront}/artists/{artist_id}/songs",
-                                params={"l": lang, "offset": offset},
-                                headers={"Authorization": f"Bearer {token}", "User-Agent": user_agent_browser,
-                                         "Origin": "https://music.apple.com"})
-        artist_song = ArtistSongs.parse_obj(resp.json())
+        body = await get_catalog("artist songs",
+                                 f"https://amp-api.music.apple.com/v1/catalog/{storefront}/artists/{artist_id}/songs",
+                                 **catalog_request("artist songs", token, lang, offset=offset))
+        artist_song = ArtistSongs.model_validate_json(body)
         songs = [song.attributes.url for song in artist_song.data]
         if artist_song.next:
             next_songs = await get_songs_from_artist(artist_id, storefront, token, lang, offset + 20)
@@ -232,11 +342,10 @@ async def get_songs_from_artist(artist_id: str, storefront: str, token: str, lan
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
 async def get_artist_info(artist_id: str, storefront: str, token: str, lang: str):
     async with request_lock:
-        resp = await client.get(f"https://amp-api.music.apple.com/v1/catalog/{storefront}/artists/{artist_id}",
-                                params={"l": lang},
-                                headers={"Authorization": f"Bearer {token}", "User-Agent": user_agent_browser,
-                                         "Origin": "https://music.apple.com"})
-        return ArtistInfo.parse_obj(resp.json())
+        body = await get_catalog("artist",
+                                 f"https://amp-api.music.apple.com/v1/catalog/{storefront}/artists/{artist_id}",
+                                 **catalog_request("artist", token, lang))
+        return ArtistInfo.model_validate_json(body)
 
 
 @alru_cache
@@ -258,41 +367,99 @@ async def get_real_url(url: str):
     return str(req.url)
 
 
-@alru_cache
 @retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
        wait=wait_random_exponential(multiplier=1, max=60),
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
 async def get_album_by_upc(upc: str, storefront: str, token: str):
     req = await client.get(f"https://amp-api.music.apple.com/v1/catalog/{storefront}/albums",
-                           params={"filter[upc]": upc},
-                           headers={"Authorization": f"Bearer {token}", "Origin": "https://music.apple.com"})
-    resp = req.json()
-    try:
-        if resp["data"]:
-            return req.json()
-        else:
-            return None
-    except KeyError:
+                           **catalog_request("albums by upc", token, **{"filter[upc]": upc}))
+    resp = AlbumUpcs.model_validate_json(req.content)
+    if resp.data is None:
         logger.debug(f"UPC: {upc}, Storefront: {storefront}")
         return None
+    return resp if resp.data else None
+
+
+@retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
+       wait=wait_random_exponential(multiplier=1, max=60),
+       stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
+async def get_existing_upcs(upcs: tuple[str, ...], storefront: str, token: str) -> set[str]:
+    async with request_lock:
+        req = await client.get(f"https://amp-api.music.apple.com/v1/catalog/{storefront}/albums",
+                               **catalog_request("albums by upc", token, **{"filter[upc]": ",".join(upcs)}))
+        resp = AlbumUpcs.model_validate_json(req.content)
+        if resp.data is None:
+            logger.debug(f"UPCs: {upcs}, Storefront: {storefront}")
+            return set()
+        return {album.attributes.upc for album in resp.data if album.attributes and album.attributes.upc}
+
+
+@retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
+       wait=wait_random_exponential(multiplier=1, max=60),
+       stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
+async def get_upcs_by_song_ids(song_ids: tuple[str, ...], storefront: str, token: str) -> dict[str, str]:
+    async with request_lock:
+        req = await client.get(f"https://amp-api.music.apple.com/v1/catalog/{storefront}/songs",
+                               **catalog_request("songs by id", token, ids=",".join(song_ids)))
+        resp = SongUpcs.model_validate_json(req.content)
+        song_upcs = {}
+        for song in resp.data or []:
+            albums = song.relationships.albums.data if song.relationships and song.relationships.albums else []
+            if albums and albums[0].attributes and albums[0].attributes.upc:
+                song_upcs[song.id] = albums[0].attributes.upc
+        return song_upcs
+
+
+async def prefetch_storefront_availability(check_storefront: str, token: str, upcs: list[str] = None,
+                                           song_ids: list[str] = None, storefront: str = None):
+    """
+    Fill the availability index for a whole album, playlist or artist before its songs are ripped,
+    so that the per-song checks can be answered without any request
+    """
+    song_ids = list(song_ids or [])
+    unknown_song_ids = [song_id for song_id in song_ids if not availability_index.get_song_upc(song_id)]
+    for song_ids_chunk in chunk(unknown_song_ids, 300):
+        availability_index.set_song_upcs(await get_upcs_by_song_ids(song_ids_chunk, storefront, token))
+    upcs = list(upcs or []) + [availability_index.get_song_upc(song_id) for song_id in song_ids]
+    for upcs_chunk in chunk(availability_index.missing(upcs, check_storefront), 25):
+        existing_upcs = await get_existing_upcs(upcs_chunk, check_storefront, token)
+        availability_index.set_many({upc: upc in existing_upcs for upc in upcs_chunk}, check_storefront)
+
+
+async def _check_upc(upc: str, check_storefront: str, token: str) -> bool:
+    available = bool(await get_album_by_upc(upc, check_storefront, token))
+    availability_index.set(upc, check_storefront, available)
+    return available
+
+
+# The availability index is the cache of these checks, with its TTL. Nothing is memoized in memory,
+# so that a long running daemon re-checks expired answers; concurrent checks of a UPC share one request
+async def exist_on_storefront_by_upc(upc: str, check_storefront: str, token: str):
+    available = availability_index.get(upc, check_storefront)
+    metrics.cache_lookup("availability", available is not None)
+    if available is None:
+        available = await upc_checks.run((upc, check_storefront.lower()),
+                                         lambda: _check_upc(upc, check_storefront, token))
+    return available
 
 
-@alru_cache
 @retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
        wait=wait_random_exponential(multiplier=1, max=60),
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
 async def exist_on_storefront_by_song_id(song_id: str, storefront: str, check_storefront: str, token: str, lang: str):
     if storefront.upper() == check_storefront.upper():
         return True
-    song = await get_song_info(song_id, token, storefront, lang)
-    album_id = song.relationships.albums.data[0].id
-    album = await get_album_info(album_id, token, storefront, lang)
-    upc = album.data[0].attributes.upc
-    upc_result = await get_album_by_upc(upc, check_storefront, token)
-    return bool(upc_result)
+    upc = availability_index.get_song_upc(song_id)
+    if not upc:
+        song = await get_song_info(song_id, token, storefront, lang)
+        upc = song.relationships.albums.data[0].attributes.upc
+        if not upc:
+            album = await get_album_info(song.relationships.albums.data[0].id, token, storefront, lang)
+            upc = album.data[0].attributes.upc
+        availability_index.set_song_upcs({song_id: upc})
+    return await exist_on_storefront_by_upc(upc, check_storefront, token)
 
 
-@alru_cache
 @retry(retry=retry_if_exception_type((httpx.HTTPError, SSLError, FileNotFoundError)),
        wait=wait_random_exponential(multiplier=1, max=60),
        stop=stop_after_attempt(retry_times), before_sleep=before_sleep_log(logger, logging.WARN))
@@ -301,5 +468,15 @@ async def exist_on_storefront_by_album_id(album_id: str, storefront: str, check_
         return True
     album = await get_album_info(album_id, token, storefront, lang)
     upc = album.data[0].attributes.upc
-    upc_result = await get_album_by_upc(upc, check_storefront, token)
-    return bool(upc_result)
+    availability_index.set_song_upcs({track.id: upc for track in album.data[0].relationships.tracks.data})
+    return await exist_on_storefront_by_upc(upc, check_storefront, token)
+
+
+def _collect_cache_metrics():
+    for func in (get_song_info, get_album_info, get_playlist_info_and_tracks, get_song_lyrics, get_cover_path):
+        info = func.cache_info()
+        metrics.cache_lookups.set(info.hits, cache=func.__name__, result="hit")
+        metrics.cache_lookups.set(info.misses, cache=func.__name__, result="miss")
+
+
+metrics.registry.add_collector(_collect_cache_metrics)
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Callable, Optional
+
+
+class ArtworkCache:
+    """
+    Covers are stored once per content hash under blobs/, and refs/ maps an artwork URL template,
+    size and format to the hash, so every song of an album points at the same file across runs.
+    """
+    directory: Path
+    _verified: dict[Path, tuple[str, int, float]]
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        (self.directory / "blobs").mkdir(parents=True, exist_ok=True)
+        (self.directory / "refs").mkdir(parents=True, exist_ok=True)
+        self._verified = {}
+
+    @staticmethod
+    def _ref_name(url: str, cover_format: str, cover_size: str) -> str:
+        return hashlib.sha1(f"{url}|{cover_size}|{cover_format}".encode("utf-8")).hexdigest()
+
+    def _blob_path(self, digest: str, cover_format: str) -> Path:
+        return self.directory / "blobs" / f"{digest}.{cover_format}"
+
+    @staticmethod
+    def _atomic_write(path: Path, data: bytes):
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, url: str, cover_format: str, cover_size: str) -> Optional[Path]:
+        ref = self.directory / "refs" / self._ref_name(url, cover_format, cover_size)
+        if not ref.exists():
+            return None
+        blob = self._blob_path(ref.read_text().strip(), cover_format)
+        if not blob.exists():
+            return None
+        return blob
+
+    def put(self, url: str, cover_format: str, cover_size: str, cover: bytes) -> Path:
+        digest = hashlib.sha256(cover).hexdigest()
+        blob = self._blob_path(digest, cover_format)
+        if not blob.exists():
+            self._atomic_write(blob, cover)
+        self._atomic_write(self.directory / "refs" / self._ref_name(url, cover_format, cover_size),
+                           digest.encode("utf-8"))
+        return blob
+
+    def _same_content(self, blob: Path, target: Path) -> bool:
+        if not target.exists():
+            return False
+        digest = blob.name.split(".")[0]
+        stat = target.stat()
+        if self._verified.get(target) == (digest, stat.st_size, stat.st_mtime):
+            return True
+        if stat.st_size != blob.stat().st_size:
+            return False
+        with open(target, "rb") as f:
+            if hashlib.file_digest(f, "sha256").hexdigest() != digest:
+                return False
+        self._verified[target] = (digest, stat.st_size, stat.st_mtime)
+        return True
+
+    def copy_to(self, blob: Path, target: Path, copy: Callable[[Path, Path], None] = shutil.copyfile) -> bool:
+        """Copy a cached cover to target unless it already holds the same content. Return whether it was written"""
+        if self._same_content(blob, target):
+            return False
+        copy(blob, target)
+        stat = target.stat()
+        self._verified[target] = (blob.name.split(".")[0], stat.st_size, stat.st_mtime)
+        return True
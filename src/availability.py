@@ -0,0 +1,68 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+from src.db import DeferredCommit, connect_db
+
+# Albums can be added to or pulled from a storefront, so negative and positive answers are both re-checked eventually
+AVAILABILITY_TTL = 7 * 24 * 60 * 60
+
+
+class StorefrontAvailabilityIndex:
+    """
+    Whether an album (identified by its UPC) can be found in a storefront only depends on the album,
+    so the answer is shared by every track of it and kept on disk between runs.
+    """
+    db: sqlite3.Connection
+    commits: DeferredCommit
+    _availability: dict[tuple[str, str], tuple[bool, float]]
+    _song_upc: dict[str, str]
+
+    def __init__(self, db_path: str | Path):
+        self.db = connect_db(db_path)
+        self.commits = DeferredCommit(self.db)
+        self.db.execute("CREATE TABLE IF NOT EXISTS availability "
+                        "(upc TEXT, storefront TEXT, available INTEGER, checked_at REAL, "
+                        "PRIMARY KEY (upc, storefront))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS song_upc (song_id TEXT PRIMARY KEY, upc TEXT)")
+        self.db.commit()
+        self._availability = {(upc, storefront): (bool(available), checked_at) for upc, storefront, available, checked_at
+                              in self.db.execute("SELECT upc, storefront, available, checked_at FROM availability")}
+        self._song_upc = dict(self.db.execute("SELECT song_id, upc FROM song_upc"))
+
+    def get(self, upc: str, storefront: str) -> Optional[bool]:
+        result = self._availability.get((upc, storefront.lower()))
+        if not result:
+            return None
+        available, checked_at = result
+        if time.time() - checked_at > AVAILABILITY_TTL:
+            return None
+        return available
+
+    def set(self, upc: str, storefront: str, available: bool):
+        self.set_many({upc: available}, storefront)
+
+    def set_many(self, availabilities: dict[str, bool], storefront: str):
+        now = time.time()
+        storefront = storefront.lower()
+        for upc, available in availabilities.items():
+            self._availability[(upc, storefront)] = (available, now)
+        self.db.executemany("INSERT OR REPLACE INTO availability VALUES (?, ?, ?, ?)",
+                            [(upc, storefront, int(available), now) for upc, available in availabilities.items()])
+        self.commits.changed()
+
+    def missing(self, upcs: list[str], storefront: str) -> list[str]:
+        return [upc for upc in dict.fromkeys(upcs) if upc and self.get(upc, storefront) is None]
+
+    def get_song_upc(self, song_id: str) -> Optional[str]:
+        return self._song_upc.get(song_id)
+
+    def set_song_upcs(self, song_upcs: dict[str, str]):
+        song_upcs = {song_id: upc for song_id, upc in song_upcs.items()
+                     if upc and self._song_upc.get(song_id) != upc}
+        if not song_upcs:
+            return
+        self._song_upc.update(song_upcs)
+        self.db.executemany("INSERT OR REPLACE INTO song_upc VALUES (?, ?)", song_upcs.items())
+        self.commits.changed()
@@ -0,0 +1,78 @@
+import hashlib
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+from src.db import DeferredCommit, connect_db
+
+# Seconds an amp-api response is used without asking again, by resource. After that it is revalidated with
+# its ETag, so an unchanged resource costs a 304 instead of its body. 0 does not keep the resource at all
+CATALOG_TTL = {
+    "song": 7 * 24 * 60 * 60,
+    "album": 24 * 60 * 60,
+    "playlist": 60 * 60,
+    "playlist tracks": 60 * 60,
+    "artist": 7 * 24 * 60 * 60,
+    "artist albums": 24 * 60 * 60,
+    "artist songs": 24 * 60 * 60,
+    "lyrics": 30 * 24 * 60 * 60,
+}
+# Responses that were not fetched or revalidated for this long are dropped when the cache is opened
+PRUNE_AGE = 90 * 24 * 60 * 60
+
+
+class CatalogResponse:
+    body: bytes
+    etag: Optional[str]
+    fetched_at: float
+
+    def __init__(self, body: bytes, etag: Optional[str], fetched_at: float):
+        self.body = body
+        self.etag = etag
+        self.fetched_at = fetched_at
+
+
+class CatalogCache:
+    """
+    amp-api responses kept on disk between runs, keyed by the URL and the parameters of the request,
+    which include the storefront and the language. Only catalog resources are kept: the media URLs
+    of the CDN are signed and expire, so they never go through here.
+    """
+    db: sqlite3.Connection
+    commits: DeferredCommit
+    ttl: dict[str, int]
+
+    def __init__(self, db_path: str | Path, ttl: dict[str, int] = None):
+        self.db = connect_db(db_path)
+        self.commits = DeferredCommit(self.db)
+        self.db.execute("CREATE TABLE IF NOT EXISTS responses "
+                        "(key TEXT PRIMARY KEY, resource TEXT, etag TEXT, body BLOB, fetched_at REAL)")
+        self.db.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - PRUNE_AGE,))
+        self.db.commit()
+        self.ttl = {**CATALOG_TTL, **(ttl or {})}
+
+    @staticmethod
+    def key(url: str, params: dict[str, str | int]) -> str:
+        query = "&".join(f"{name}={value}" for name, value in sorted(params.items()))
+        return hashlib.sha1(f"{url}?{query}".encode("utf-8")).hexdigest()
+
+    def enabled(self, resource: str) -> bool:
+        return self.ttl.get(resource, 0) > 0
+
+    def get(self, key: str) -> Optional[CatalogResponse]:
+        row = self.db.execute("SELECT body, etag, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+        return CatalogResponse(*row) if row else None
+
+    def fresh(self, resource: str, response: CatalogResponse) -> bool:
+        return time.time() - response.fetched_at < self.ttl.get(resource, 0)
+
+    def put(self, key: str, resource: str, body: bytes, etag: Optional[str]):
+        self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                        (key, resource, etag, body, time.time()))
+        self.commits.changed()
+
+    def touch(self, key: str):
+        """The response was revalidated, so its TTL starts again"""
+        self.db.execute("UPDATE responses SET fetched_at = ? WHERE key = ?", (time.time(), key))
+        self.commits.changed()
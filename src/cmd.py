@@ -9,21 +9,39 @@ from prettytable import PrettyTable
 from prompt_toolkit import PromptSession, print_formatted_text, ANSI
 from prompt_toolkit.patch_stdout import patch_stdout
 
+from src import hooks, library, journal, output, scheduler, pipeline, metrics, tracing, watchdog
 from src.adb import Device
-from src.api import get_token, init_client_and_lock, get_real_url, get_album_info
+from src.api import get_token, init_client_and_lock, get_real_url, get_album_info, init_cache
 from src.config import Config
 from src.exceptions import CodecNotFoundException
+from src.journal import Job
 from src.quality import get_available_song_audio_quality
 from src.rip import rip_song, rip_album, rip_artist, rip_playlist
-from src.types import GlobalAuthParams
+from src.types import Codec, GlobalAuthParams, JobPriority
 from src.url import AppleMusicURL, URLType, Song
-from src.utils import get_song_id_from_m3u8, check_dep
+from src.utils import get_song_id_from_m3u8, check_dep, split_codecs, get_output_roots
+
+
+# URL jobs of a file, or of a resume, that are enumerating and ripping at the same time.
+# The others wait for one of them to finish, so that every job does not fill its own queue at once
+FILE_PARALLEL_JOBS = 4
+CODECS = [Codec.ALAC, Codec.EC3, Codec.AAC, Codec.AAC_BINAURAL, Codec.AAC_DOWNMIX, Codec.AC3]
+
+
+def codec_list(value: str) -> str:
+    """A codec, or several separated by commas, which rips every song once for all of them"""
+    codecs = split_codecs(value)
+    for codec in codecs:
+        if codec not in CODECS:
+            raise argparse.ArgumentTypeError(f"invalid codec: {codec} (choose from {', '.join(CODECS)})")
+    return ",".join(codecs)
 
 
 class NewInteractiveShell:
     loop: asyncio.AbstractEventLoop
     config: Config
     tasks: list[Task] = []
+    job_tasks: dict[str, Task] = {}
     devices: list[Device] = []
     storefront_device_mapping: dict[str, list[Device]] = {}
     anonymous_access_token: str
@@ -39,32 +57,47 @@ class NewInteractiveShell:
         self.loop = loop
         self.config = Config.load_from_config()
         init_client_and_lock(self.config.download.proxy, self.config.download.parallelNum)
+        init_cache(self.config.cache.directory, self.config.cache.catalogTtl)
+        library.init_library_index(self.config.cache.directory)
+        output.init_output_writer(self.config.download.fsyncSongs)
+        hooks.init_hook_executor(self.config.download.afterDownloaded, self.config.download.afterDownloadedBatchSize,
+                                 self.config.download.afterDownloadedBatchTimeout,
+                                 self.config.download.afterDownloadedParallel,
+                                 self.config.download.afterDownloadedTimeout, self.config.download.afterDownloadedDetach)
+        journal.init_job_journal(self.config.cache.directory, self.config.cache.journalFsync)
+        scheduler.init_scheduler(self.config.download.songParallelNum, self.config.download.interactiveParallelNum,
+                                 self.config.download.jobQueueSize)
+        pipeline.init_pipeline(self.config.download.networkWorkers, self.config.download.cpuWorkers,
+                               self.config.download.diskWorkers, self.config.download.stageQueueSize)
+        if self.config.watchdog.enable:
+            watchdog.init_watchdog(loop, self.config.watchdog.threshold)
+        tracing.init_tracing(self.config.trace.file, self.config.trace.profileSongs,
+                             self.config.trace.profileDirectory)
+        if self.config.metrics.port:
+            loop.run_until_complete(metrics.serve(self.config.metrics.host, self.config.metrics.port))
         self.anonymous_access_token = loop.run_until_complete(get_token())
 
         self.parser = argparse.ArgumentParser(exit_on_error=False)
         subparser = self.parser.add_subparsers()
         download_parser = subparser.add_parser("download", aliases=["dl"])
         download_parser.add_argument("url", type=str)
-        download_parser.add_argument("-c", "--codec",
-                                     choices=["alac", "ec3", "aac", "aac-binaural", "aac-downmix", "ac3"],
-                                     default="alac")
+        download_parser.add_argument("-c", "--codec", type=codec_list, default="alac")
         download_parser.add_argument("-f", "--force", default=False, action="store_true")
         download_parser.add_argument("--include-participate-songs", default=False, dest="include", action="store_true")
         download_from_file_parser = subparser.add_parser("download-from-file", aliases=["dlf"])
         download_from_file_parser.add_argument("file", type=str)
         download_from_file_parser.add_argument("-f", "--force", default=False, action="store_true")
-        download_from_file_parser.add_argument("-c", "--codec",
-                                     choices=["alac", "ec3", "aac", "aac-binaural", "aac-downmix", "ac3"],
-                                     default="alac")
+        download_from_file_parser.add_argument("-c", "--codec", type=codec_list, default="alac")
         m3u8_parser = subparser.add_parser("m3u8")
         m3u8_parser.add_argument("url", type=str)
-        m3u8_parser.add_argument("-c", "--codec",
-                                 choices=["alac", "ec3", "aac", "aac-binaural", "aac-downmix", "ac3"],
-                                 default="alac")
+        m3u8_parser.add_argument("-c", "--codec", choices=CODECS, default="alac")
         m3u8_parser.add_argument("-f", "--force", default=False, action="store_true")
         m3u8_parser.add_argument("-q", "--quality", default="", dest="quality")
         quality_parser = subparser.add_parser("quality")
         quality_parser.add_argument("url", type=str)
+        subparser.add_parser("rescan")
+        resume_parser = subparser.add_parser("resume")
+        resume_parser.add_argument("--retry-failed", default=False, dest="retry_failed", action="store_true")
         subparser.add_parser("exit")
 
         logger.remove()
@@ -102,39 +135,85 @@ class NewInteractiveShell:
                 await self.do_download_from_file(args.file, args.codec, args.force)
             case "quality":
                 await self.do_quality(args.url)
+            case "rescan":
+                self.do_rescan()
+            case "resume":
+                await self.do_resume(args.retry_failed)
             case "exit":
+                await hooks.hook_executor.close()
                 self.loop.stop()
                 sys.exit()
 
-    async def do_download(self, raw_url: str, codec: str, force_download: bool, include: bool = False):
+    async def do_download(self, raw_url: str, codec: str, force_download: bool, include: bool = False,
+                          job: Job = None, priority: int = None) -> Job:
+        if not job:
+            job = journal.job_journal.start_job(raw_url, codec, force_download, include)
+        metrics.registry.job_stats(job.id)
         url = AppleMusicURL.parse_url(raw_url)
         if not url:
-            real_url = await get_real_url(raw_url)
-            url = AppleMusicURL.parse_url(real_url)
+            # Only web links can redirect to a music.apple.com URL
+            if raw_url.startswith(("http://", "https://")):
+                url = AppleMusicURL.parse_url(await get_real_url(raw_url))
             if not url:
                 logger.error("Illegal URL!")
-                return
+                journal.job_journal.finish_job(job)
+                return job
+        if priority is None:
+            match url.type:
+                case URLType.Song:
+                    priority = JobPriority.Interactive
+                case URLType.Artist:
+                    priority = JobPriority.Bulk
+                case _:
+                    priority = JobPriority.Normal
+        job.priority = priority
         available_device = await self._get_available_device(url.storefront)
         global_auth_param = GlobalAuthParams.from_auth_params_and_token(available_device.get_auth_params(),
                                                                         self.anonymous_access_token)
         match url.type:
             case URLType.Song:
                 task = self.loop.create_task(
-                    rip_song(url, global_auth_param, codec, self.config, available_device, force_download))
+                    rip_song(url, global_auth_param, codec, self.config, available_device, force_download, job=job))
             case URLType.Album:
                 task = self.loop.create_task(rip_album(url, global_auth_param, codec, self.config, available_device,
-                                                       force_download))
+                                                       force_download, job=job))
             case URLType.Artist:
                 task = self.loop.create_task(rip_artist(url, global_auth_param, codec, self.config, available_device,
-                                                        force_download, include))
+                                                        force_download, include, job=job))
             case URLType.Playlist:
                 task = self.loop.create_task(rip_playlist(url, global_auth_param, codec, self.config, available_device,
-                                                          force_download))
+                                                          force_download, job=job))
             case _:
                 logger.error("Unsupported URLType")
-                return
+                journal.job_journal.finish_job(job)
+                return job
         self.tasks.append(task)
+        self.job_tasks[job.id] = task
         task.add_done_callback(self.tasks.remove)
+        task.add_done_callback(lambda _: self.job_tasks.pop(job.id, None))
+        task.add_done_callback(lambda t: None if t.cancelled() else journal.job_journal.finish_job(job))
+        task.add_done_callback(lambda _: self._log_job_summary(job))
+        # The songs of a finished job are not held back until the batch fills up
+        task.add_done_callback(lambda _: hooks.hook_executor.flush())
+        return job
+
+    @staticmethod
+    def _log_job_summary(job: Job):
+        states = {}
+        for state in job.songs.values():
+            states[state] = states.get(state, 0) + 1
+        stats = metrics.registry.pop_job_stats(job.id)
+        logger.info(f"Job {job.url} done: " + ", ".join(f"{count} {state}" for state, count in states.items())
+                    + (f"; {stats.summary()}" if stats else ""))
+
+    def cancel_job(self, job: Job) -> bool:
+        """Stop a running job. Songs that are already being ripped still finish. Return whether the job was running"""
+        task = self.job_tasks.get(job.id)
+        if not task:
+            return False
+        task.cancel()
+        journal.job_journal.finish_job(job)
+        return True
 
     async def do_m3u8(self, m3u8_url: str, codec: str, force_download: bool):
         song_id = get_song_id_from_m3u8(m3u8_url)
@@ -150,16 +229,36 @@ class NewInteractiveShell:
     async def do_download_from_file(self, file: str, codec: str, force_download: bool):
         with open(file, "r", encoding="utf-8") as f:
             urls = f.readlines()
-        for url in urls:
-            task = self.loop.create_task(self.do_download(raw_url=url, codec=codec, force_download=force_download))
-            self.tasks.append(task)
-            task.add_done_callback(self.tasks.remove)
+        self._start_bounded([{"raw_url": url, "codec": codec, "force_download": force_download,
+                              "priority": JobPriority.Bulk} for url in [url.strip() for url in urls if url.strip()]])
+
+    def _start_bounded(self, downloads: list[dict]):
+        task = self.loop.create_task(self._download_bounded(downloads))
+        self.tasks.append(task)
+        task.add_done_callback(self.tasks.remove)
+
+    async def _download_bounded(self, downloads: list[dict]):
+        """Start the jobs one after another, each once one of the FILE_PARALLEL_JOBS running jobs has finished"""
+        slots = asyncio.Semaphore(FILE_PARALLEL_JOBS)
+        for download in downloads:
+            await slots.acquire()
+            try:
+                job = await self.do_download(**download)
+            except Exception as e:
+                logger.error(f"Failed to start job {download.get('raw_url')}: {e}")
+                slots.release()
+                continue
+            if task := self.job_tasks.get(job.id):
+                task.add_done_callback(lambda _: slots.release())
+            else:
+                slots.release()
 
     async def do_quality(self, raw_url: str):
         url = AppleMusicURL.parse_url(raw_url)
         if not url:
-            real_url = await get_real_url(raw_url)
-            url = AppleMusicURL.parse_url(real_url)
+            # Only web links can redirect to a music.apple.com URL
+            if raw_url.startswith(("http://", "https://")):
+                url = AppleMusicURL.parse_url(await get_real_url(raw_url))
             if not url:
                 logger.error("Illegal URL!")
                 return
@@ -204,6 +303,23 @@ class NewInteractiveShell:
             case _:
                 logger.error("Unsupported link!")
 
+    async def do_resume(self, retry_failed: bool = False):
+        jobs = journal.job_journal.resumable_jobs(retry_failed)
+        logger.info(f"Resuming {len(jobs)} jobs")
+        for job in jobs:
+            if retry_failed:
+                job.forget_failed_songs()
+            journal.job_journal.restart_job(job)
+        self._start_bounded([{"raw_url": job.url, "codec": job.codec, "force_download": job.force,
+                              "include": job.include, "job": job, "priority": JobPriority.Bulk} for job in jobs])
+
+    def do_rescan(self):
+        kept, removed = library.library_index.rescan()
+        logger.info(f"Library index rescanned: {kept} songs kept, {removed} missing songs removed")
+        stale = output.output_writer.remove_stale(get_output_roots(self.config.download))
+        if stale:
+            logger.info(f"Removed {stale} temporary files left by interrupted rips")
+
     async def _get_available_device(self, storefront: str):
         devices = self.storefront_device_mapping.get(storefront)
         if not devices:
@@ -233,4 +349,5 @@ class NewInteractiveShell:
             try:
                 await self.handle_command()
             finally:
+                await hooks.hook_executor.close()
                 logger.info("Existing shell")
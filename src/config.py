@@ -26,6 +26,13 @@ class M3U8Api(BaseModel):
 class Download(BaseModel):
     proxy: str
     parallelNum: int
+    songParallelNum: int = 16
+    interactiveParallelNum: int = 2
+    jobQueueSize: int = 32
+    networkWorkers: int = 8
+    cpuWorkers: int = 0
+    diskWorkers: int = 2
+    stageQueueSize: int = 8
     getM3u8FromDevice: bool
     codecAlternative: bool
     codecPriority: list[str]
@@ -36,24 +43,66 @@ class Download(BaseModel):
     playlistDirPathFormat: str
     playlistSongNameFormat: str
     saveLyrics: bool
+    lyricsWordTiming: bool = False
     saveCover: bool
     coverFormat: str
     coverSize: str
     alacMax: int
     atmosMax: int
     afterDownloaded: str
+    afterDownloadedBatchSize: int = 50
+    afterDownloadedBatchTimeout: float = 10.0
+    afterDownloadedParallel: int = 2
+    afterDownloadedTimeout: float = 600.0
+    afterDownloadedDetach: bool = False
+    fsyncSongs: bool = False
+    playlistFromLibrary: str = ""
+    prewarmDecryptKeys: bool = True
 
 
 class Metadata(BaseModel):
     embedMetadata: list[str]
 
 
+class Cache(BaseModel):
+    directory: str = "cache"
+    journalFsync: bool = False
+    catalogTtl: dict[str, int] = {}
+
+
+class Watchdog(BaseModel):
+    enable: bool = False
+    threshold: float = 0.1
+
+
+class Trace(BaseModel):
+    file: str = ""
+    profileSongs: list[str] = []
+    profileDirectory: str = "profiles"
+
+
+class Metrics(BaseModel):
+    host: str = "127.0.0.1"
+    port: int = 0
+
+
+class Daemon(BaseModel):
+    host: str = "127.0.0.1"
+    port: int = 8765
+    unixSocket: str = ""
+
+
 class Config(BaseModel):
     region: Region
     devices: list[Device]
     m3u8Api: M3U8Api
     download: Download
     metadata: Metadata
+    cache: Cache = Cache()
+    metrics: Metrics = Metrics()
+    trace: Trace = Trace()
+    watchdog: Watchdog = Watchdog()
+    daemon: Daemon = Daemon()
 
     @classmethod
     def load_from_config(cls, config_file: str = "config.toml"):
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import signal
+import sys
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from src import hooks, journal, metrics, pipeline, scheduler
+from src.cmd import CODECS, NewInteractiveShell
+from src.journal import Job
+from src.types import Codec, JobPriority
+from src.utils import split_codecs
+
+PRIORITIES = {"interactive": JobPriority.Interactive, "normal": JobPriority.Normal, "bulk": JobPriority.Bulk}
+STATUS_TEXT = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               409: "Conflict", 500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    status: int
+    message: str
+
+    def __init__(self, status: int, message: str):
+        self.status = status
+        self.message = message
+
+
+class Daemon:
+    """
+    Keeps the devices injected and the caches warm, and takes jobs from other programs over HTTP/JSON,
+    on TCP or on a Unix socket. All clients share the scheduler of the shell.
+
+    POST   /jobs              {"url": ..., "codec": "alac", "force": false, "include": false, "priority": null}
+                              codec can also be a list, or comma separated, to rip every song in each codec
+    GET    /jobs              the jobs submitted to this daemon
+    GET    /jobs/<id>         a job and the state of its songs
+    DELETE /jobs/<id>         cancel a job
+    GET    /jobs/<id>/events  the song state changes of a job as JSON lines, until it finishes
+    GET    /status            songs and stage queues
+    GET    /metrics           metrics in the Prometheus text format
+    """
+    shell: NewInteractiveShell
+    jobs: dict[str, Job]
+
+    def __init__(self, shell: NewInteractiveShell):
+        self.shell = shell
+        self.jobs = {}
+
+    async def serve(self):
+        logger.remove()
+        logger.add(sys.stderr, level="INFO")
+        config = self.shell.config.daemon
+        if config.unixSocket:
+            server = await asyncio.start_unix_server(self._handle, config.unixSocket)
+            logger.info(f"Daemon listening on {config.unixSocket}")
+        else:
+            server = await asyncio.start_server(self._handle, config.host, config.port)
+            logger.info(f"Daemon listening on http://{config.host}:{config.port}")
+        if sys.platform != "win32":
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            # Closed by SIGTERM
+            if server.is_serving():
+                raise
+        finally:
+            await self.shutdown()
+
+    @staticmethod
+    async def shutdown():
+        # Run the afterDownloaded command for the songs still waiting for their batch
+        await hooks.hook_executor.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            path = urlsplit(target).path.rstrip("/").split("/")[1:]
+            await self._route(method, path, body, writer)
+        except HTTPError as e:
+            await self._respond(writer, e.status, {"error": e.message})
+        except (ValueError, asyncio.IncompleteReadError):
+            await self._respond(writer, 400, {"error": "Malformed request"})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logger.exception(e)
+            await self._respond(writer, 500, {"error": str(e)})
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: list[str], body: bytes, writer: asyncio.StreamWriter):
+        match method, path:
+            case "POST", ["jobs"]:
+                job = await self.submit(json.loads(body or b"{}"))
+                await self._respond(writer, 202, self._job_summary(job))
+            case "GET", ["jobs"]:
+                await self._respond(writer, 200, [self._job_summary(job) for job in self.jobs.values()])
+            case "GET", ["jobs", job_id]:
+                job = self._get_job(job_id)
+                await self._respond(writer, 200, {**self._job_summary(job), "songs": job.songs})
+            case "DELETE", ["jobs", job_id]:
+                job = self._get_job(job_id)
+                if not self.shell.cancel_job(job):
+                    raise HTTPError(409, f"Job {job_id} is not running")
+                await self._respond(writer, 200, self._job_summary(job))
+            case "GET", ["jobs", job_id, "events"]:
+                await self._stream_events(self._get_job(job_id), writer)
+            case "GET", ["status"]:
+                await self._respond(writer, 200, self._status())
+            case "GET", ["metrics"]:
+                writer.write(metrics.http_response())
+                await writer.drain()
+            case _, ["jobs"] | ["jobs", _] | ["jobs", _, "events"] | ["status"] | ["metrics"]:
+                raise HTTPError(405, f"Method {method} is not allowed")
+            case _:
+                raise HTTPError(404, "Not found")
+
+    async def submit(self, request: dict) -> Job:
+        if not isinstance(request, dict) or not isinstance(request.get("url"), str):
+            raise HTTPError(400, "Field url is required")
+        codec = request.get("codec", Codec.ALAC)
+        if isinstance(codec, list):
+            codec = ",".join(map(str, codec))
+        if not isinstance(codec, str) or not all(name in CODECS for name in split_codecs(codec)):
+            raise HTTPError(400, f"Unknown codec {codec}, expected one or a list of {', '.join(CODECS)}")
+        codec = ",".join(split_codecs(codec))
+        priority = request.get("priority")
+        if priority is not None and priority not in PRIORITIES:
+            raise HTTPError(400, f"Unknown priority {priority}, expected one of {', '.join(PRIORITIES)}")
+        job = await self.shell.do_download(request["url"], codec, bool(request.get("force", False)),
+                                           bool(request.get("include", False)),
+                                           priority=PRIORITIES[priority] if priority else None)
+        if job.id not in self.shell.job_tasks:
+            # do_download finishes the job without starting it when the URL is illegal or unsupported
+            raise HTTPError(400, f"Illegal or unsupported URL {request['url']}")
+        self.jobs[job.id] = job
+        return job
+
+    def _get_job(self, job_id: str) -> Job:
+        job = self.jobs.get(job_id) or journal.job_journal.jobs.get(job_id)
+        if not job:
+            raise HTTPError(404, f"Job {job_id} not found")
+        return job
+
+    @staticmethod
+    def _job_summary(job: Job) -> dict:
+        states = {}
+        for state in job.songs.values():
+            states[state] = states.get(state, 0) + 1
+        return {"id": job.id, "url": job.url, "codec": job.codec, "priority": job.priority,
+                "finished": job.finished, "states": states}
+
+    @staticmethod
+    def _status() -> dict:
+        return {"running": scheduler.scheduler.running,
+                "queued": scheduler.scheduler.queued(),
+                "stages": {stage.name: {"workers": stage.workers, "busy": stage.busy, "queued": stage.queued()}
+                           for stage in pipeline.pipeline.stages()}}
+
+    async def _stream_events(self, job: Job, writer: asyncio.StreamWriter):
+        queue = job.subscribe()
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+            for song_id, state in list(job.songs.items()):
+                writer.write(self._json_line({"event": "song", "job": job.id, "song": song_id, "state": state}))
+            if job.finished:
+                writer.write(self._json_line({"event": "finish", "job": job.id}))
+                await writer.drain()
+                return
+            await writer.drain()
+            while True:
+                event = await queue.get()
+                writer.write(self._json_line(event))
+                await writer.drain()
+                if event["event"] == "finish":
+                    return
+        finally:
+            job.unsubscribe(queue)
+
+    @staticmethod
+    def _json_line(data) -> bytes:
+        return json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n"
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+        writer.write(body)
+        await writer.drain()
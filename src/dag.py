@@ -0,0 +1,39 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class DAG:
+    """
+    Async steps with dependencies. Every step starts as soon as the steps it depends on have finished
+    and is called with their results, in the order the dependencies were given.
+    If a step raises, the remaining steps are cancelled and the exception is raised from run().
+    """
+    _steps: dict[str, tuple[Callable[..., Awaitable], tuple[str, ...]]]
+
+    def __init__(self):
+        self._steps = {}
+
+    def add(self, name: str, func: Callable[..., Awaitable], *depends_on: str):
+        for dependency in depends_on:
+            if dependency not in self._steps:
+                raise ValueError(f"Step {name} depends on unknown step {dependency}")
+        self._steps[name] = (func, depends_on)
+
+    async def run(self) -> dict[str, Any]:
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def run_step(name: str):
+            func, depends_on = self._steps[name]
+            return await func(*[await tasks[dependency] for dependency in depends_on])
+
+        # Steps can only depend on steps added before them, so there are no cycles
+        for name in self._steps:
+            tasks[name] = asyncio.create_task(run_step(name))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        return {name: task.result() for name, task in tasks.items()}
@@ -0,0 +1,47 @@
+import asyncio
+import atexit
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+# Seconds that the writes of the event loop are collected before they are committed together
+COMMIT_DELAY = 1.0
+
+
+def connect_db(db_path: str | Path) -> sqlite3.Connection:
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(db_path)
+    # In WAL mode with synchronous=NORMAL a commit does not wait for the disk, only checkpoints do
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class DeferredCommit:
+    """
+    Commits the writes made on an SQLite connection from the event loop once per COMMIT_DELAY,
+    instead of one transaction per row. The connection reads its own uncommitted rows, and what is
+    still pending is committed at exit. Outside the event loop every write is committed at once.
+    """
+    db: sqlite3.Connection
+    _timer: Optional[asyncio.TimerHandle]
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self._timer = None
+        atexit.register(self.commit)
+
+    def changed(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.commit()
+            return
+        if not self._timer:
+            self._timer = loop.call_later(COMMIT_DELAY, self.commit)
+
+    def commit(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self.db.commit()
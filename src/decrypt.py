@@ -1,9 +1,11 @@
 import asyncio
 import logging
+import time
 
 from loguru import logger
 from tenacity import retry, retry_if_exception_type, stop_after_attempt, before_sleep_log
 
+from src import metrics, tracing
 from src.adb import Device, HyperDecryptDevice
 from src.exceptions import DecryptException, RetryableDecryptException
 from src.models.song_data import Datum
@@ -12,6 +14,20 @@ from src.types import defaultId, prefetchKey
 from src.utils import timeit
 
 retry_count = {}
+# First byte of a key header that asks the agent to set up key contexts without decrypting
+PREWARM_COMMAND = 0xff
+_prewarm_tasks: set[asyncio.Task] = set()
+# Songs pinned to each agent that it has not decrypted yet, by agent serial
+_pinned: dict[str, int] = {}
+
+
+def _key_headers(keys: list[str], manifest: Datum) -> list[tuple[str, str]]:
+    headers = []
+    for key_uri in keys:
+        header = (defaultId if key_uri == prefetchKey else manifest.id, key_uri)
+        if header not in headers:
+            headers.append(header)
+    return headers
 
 
 @retry(retry=retry_if_exception_type(RetryableDecryptException), stop=stop_after_attempt(3),
@@ -19,6 +35,7 @@ retry_count = {}
 @timeit
 async def decrypt(info: SongInfo, keys: list[str], manifest: Datum, device: Device | HyperDecryptDevice) -> bytes:
     async with device.decryptLock:
+        start = time.perf_counter()
         if isinstance(device, HyperDecryptDevice):
             logger.info(f"Using hyperDecryptDevice {device.serial} to decrypt song: {manifest.attributes.artistName} - {manifest.attributes.name}")
         else:
@@ -36,9 +53,7 @@ async def decrypt(info: SongInfo, keys: list[str], manifest: Datum, device: Devi
                 if len(decrypted) != 0:
                     writer.write(bytes([0, 0, 0, 0]))
                 key_uri = keys[sample.descIndex]
-                track_id = manifest.id
-                if key_uri == prefetchKey:
-                    track_id = defaultId
+                track_id = defaultId if key_uri == prefetchKey else manifest.id
                 writer.write(bytes([len(track_id)]))
                 writer.write(track_id.encode("utf-8"))
                 writer.write(bytes([len(key_uri)]))
@@ -62,7 +77,14 @@ async def decrypt(info: SongInfo, keys: list[str], manifest: Datum, device: Devi
             decrypted.append(result)
         writer.write(bytes([0, 0, 0, 0]))
         writer.close()
-        return bytes().join(decrypted)
+        decrypted_song = bytes().join(decrypted)
+        end = time.perf_counter()
+        metrics.observe_stage("decrypt", end - start)
+        metrics.observe_decrypt(device.serial, len(decrypted_song), end - start)
+        tracing.complete("decrypt", "stage", start, end)
+        tracing.complete(f"{manifest.attributes.artistName} - {manifest.attributes.name}", "decrypt", start, end,
+                         track=f"device {device.serial}", bytes=len(decrypted_song))
+        return decrypted_song
 
 
 async def decrypt_sample(writer: asyncio.StreamWriter, reader: asyncio.StreamReader, sample: SampleInfo) -> bytes:
@@ -72,3 +94,55 @@ async def decrypt_sample(writer: asyncio.StreamWriter, reader: asyncio.StreamRea
     if not result:
         raise RetryableDecryptException
     return result
+
+
+async def prewarm(keys: list[str], manifest: Datum, device: Device | HyperDecryptDevice):
+    """
+    Have the agent set up the key contexts of a song while it is still downloading, instead of on its first sample.
+    Only an optimisation: failures are logged and otherwise ignored
+    """
+    try:
+        reader, writer = await asyncio.open_connection(device.host, device.fridaPort)
+    except OSError as e:
+        logger.debug(f"Failed to connect to device {device.serial} to prewarm keys: {e}")
+        return
+    try:
+        writer.write(bytes([PREWARM_COMMAND]))
+        for track_id, key_uri in _key_headers(keys, manifest):
+            writer.write(bytes([len(track_id)]))
+            writer.write(track_id.encode("utf-8"))
+            writer.write(bytes([len(key_uri)]))
+            writer.write(key_uri.encode("utf-8"))
+        writer.write(bytes([0]))
+        warmed = (await reader.readexactly(1))[0]
+        writer.write(bytes([0]))
+        await writer.drain()
+        logger.debug(f"Prewarmed {warmed} keys of song {manifest.attributes.artistName} - {manifest.attributes.name} "
+                     f"on device {device.serial}")
+    except (OSError, asyncio.IncompleteReadError) as e:
+        logger.debug(f"Failed to prewarm keys on device {device.serial}: {e}")
+    finally:
+        writer.close()
+
+
+def pick_decrypt_device(device: Device) -> Device | HyperDecryptDevice:
+    """
+    The agent that will decrypt a song, chosen when its keys are known so that only that agent prewarms them:
+    the one with the fewest songs pinned to it, then an idle one. Every pick is ended with unpin_decrypt_device
+    """
+    agent = min(device.hyperDecryptDevices or [device],
+                key=lambda candidate: (_pinned.get(candidate.serial, 0), candidate.decryptLock.locked()))
+    _pinned[agent.serial] = _pinned.get(agent.serial, 0) + 1
+    return agent
+
+
+def unpin_decrypt_device(agent: Device | HyperDecryptDevice):
+    """The song pinned to the agent was decrypted, or will not be"""
+    _pinned[agent.serial] -= 1
+
+
+def start_prewarm(keys: list[str], manifest: Datum, device: Device | HyperDecryptDevice):
+    """Prewarm the keys on the agent that will decrypt the song, without waiting"""
+    task = asyncio.create_task(prewarm(keys, manifest, device))
+    _prewarm_tasks.add(task)
+    task.add_done_callback(_prewarm_tasks.discard)
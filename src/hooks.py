@@ -0,0 +1,214 @@
+import asyncio
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from loguru import logger
+
+from src import metrics
+
+
+class HookResult:
+    command: str | list[str]
+    filenames: list[str]
+    returncode: int
+    seconds: float
+    output: str
+    timed_out: bool
+
+    def __init__(self, command: str | list[str], filenames: list[str], returncode: int, seconds: float, output: str,
+                 timed_out: bool = False):
+        self.command = command
+        self.filenames = filenames
+        self.returncode = returncode
+        self.seconds = seconds
+        self.output = output
+        self.timed_out = timed_out
+
+
+class HookExecutor:
+    """
+    Runs the afterDownloaded command for the saved songs, at most `parallel` runs at a time, each waited for
+    and killed after run_timeout seconds. A command with {filename} runs once per song. With `detach` it is
+    started without the limit and the timeout instead, like a media player that stays open, and one waiter
+    thread records its exit. Any other command gets the songs in batches of batch_size, or whatever was saved
+    within `timeout` seconds of the first song of the batch: as arguments with {filenames}, as a file listing
+    one filename per line with {manifest}, and one filename per line on stdin otherwise.
+    """
+    command: str
+    batch_size: int
+    timeout: float
+    run_timeout: float
+    detach: bool
+    results: deque[HookResult]
+    _slots: asyncio.Semaphore
+    _executor: ThreadPoolExecutor
+    _pending: list[str]
+    _timer: Optional[asyncio.TimerHandle]
+    _running: set[asyncio.Task]
+    _detached: list[tuple[subprocess.Popen, str, float]]
+    _detached_lock: threading.Lock
+    _waiter: Optional[threading.Thread]
+
+    def __init__(self, command: str, batch_size: int, timeout: float, parallel: int, run_timeout: float = 600.0,
+                 detach: bool = False):
+        self.command = command
+        self.batch_size = max(batch_size, 1)
+        self.timeout = timeout
+        self.run_timeout = run_timeout
+        self.detach = detach
+        self.results = deque(maxlen=100)
+        self._slots = asyncio.Semaphore(max(parallel, 1))
+        # Waited runs may take minutes, so they get threads of their own instead of the default executor's
+        self._executor = ThreadPoolExecutor(max(parallel, 1), thread_name_prefix="hook")
+        self._pending = []
+        self._timer = None
+        self._running = set()
+        self._detached = []
+        self._detached_lock = threading.Lock()
+        self._waiter = None
+
+    def submit(self, filename: str):
+        if "{filename}" in self.command:
+            if self.detach:
+                self._detach(filename)
+            else:
+                self._start([filename])
+            return
+        self._pending.append(filename)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        elif not self._timer:
+            self._timer = asyncio.get_running_loop().call_later(self.timeout, self.flush)
+
+    def flush(self):
+        """Run the songs collected so far without waiting for the batch to fill up"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            batch, self._pending = self._pending, []
+            self._start(batch)
+
+    async def close(self):
+        """Run the collected songs and wait for every run"""
+        self.flush()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _detach(self, filename: str):
+        command = self._build([filename], "")
+        logger.info(f"Executing command: {command}")
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+        except OSError as e:
+            self._record(HookResult(command, [filename], -1, 0, str(e)))
+            return
+        with self._detached_lock:
+            self._detached.append((process, filename, time.perf_counter()))
+            if not self._waiter:
+                self._waiter = threading.Thread(target=self._wait_detached, args=(asyncio.get_running_loop(),),
+                                                name="hook-waiter", daemon=True)
+                self._waiter.start()
+
+    def _wait_detached(self, loop: asyncio.AbstractEventLoop):
+        # One thread polls every detached command, so that each exit is reaped and recorded
+        while True:
+            with self._detached_lock:
+                running = []
+                for process, filename, start in self._detached:
+                    if process.poll() is None:
+                        running.append((process, filename, start))
+                    else:
+                        result = HookResult(process.args, [filename], process.returncode,
+                                            time.perf_counter() - start, "")
+                        loop.call_soon_threadsafe(self._record, result)
+                self._detached = running
+                if not running:
+                    self._waiter = None
+                    return
+            time.sleep(0.5)
+
+    def _start(self, filenames: list[str]):
+        task = asyncio.create_task(self._run(filenames))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, filenames: list[str]):
+        async with self._slots:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, self._execute, filenames)
+        self._record(result)
+
+    def _record(self, result: HookResult):
+        filenames = result.filenames
+        self.results.append(result)
+        metrics.hook_runs.inc(result="ok" if result.returncode == 0 else
+                              "timeout" if result.timed_out else "failed")
+        metrics.hook_songs.inc(len(filenames))
+        if result.timed_out:
+            logger.warning(f"Command was killed after {self.run_timeout:g}s for {', '.join(filenames[:3])}"
+                           f"{f' and {len(filenames) - 3} more' if len(filenames) > 3 else ''}")
+        elif result.returncode:
+            output = result.output.strip().splitlines()
+            logger.warning(f"Command exited with {result.returncode} for {', '.join(filenames[:3])}"
+                           f"{f' and {len(filenames) - 3} more' if len(filenames) > 3 else ''}"
+                           f"{f': {output[-1]}' if output else ''}")
+
+    def _build(self, filenames: list[str], manifest: str) -> str | list[str]:
+        params = {"filename": filenames[0], "manifest": manifest}
+        if sys.platform == "win32":
+            return self.command.format(filenames=subprocess.list2cmdline(filenames), **params)
+        # Split before formatting, so that filenames with spaces or quotes stay single arguments
+        args = []
+        for part in shlex.split(self.command):
+            if part == "{filenames}":
+                args.extend(filenames)
+            else:
+                args.append(part.format(filenames=shlex.join(filenames), **params))
+        return args
+
+    def _execute(self, filenames: list[str]) -> HookResult:
+        manifest = ""
+        if "{manifest}" in self.command:
+            fd, manifest = tempfile.mkstemp(prefix="amdl-hook-", suffix=".txt", text=True)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write("\n".join(filenames) + "\n")
+        stdin = "\n".join(filenames) + "\n" if not any(f"{{{name}}}" in self.command
+                                                        for name in ("filename", "filenames", "manifest")) else None
+        command = self._build(filenames, manifest)
+        if len(filenames) == 1:
+            logger.info(f"Executing command: {command}")
+        else:
+            logger.info(f"Executing command: {self.command} for {len(filenames)} songs")
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            process = subprocess.run(command, input=stdin, stdin=None if stdin else subprocess.DEVNULL,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace",
+                                     timeout=self.run_timeout or None)
+            returncode, output = process.returncode, process.stderr
+        except subprocess.TimeoutExpired as e:
+            # subprocess.run has killed the command
+            returncode, output, timed_out = -1, e.stderr or "", True
+        except OSError as e:
+            returncode, output = -1, str(e)
+        finally:
+            if manifest:
+                os.unlink(manifest)
+        return HookResult(command, filenames, returncode, time.perf_counter() - start, output, timed_out)
+
+
+hook_executor: HookExecutor
+
+
+def init_hook_executor(command: str, batch_size: int, timeout: float, parallel: int, run_timeout: float = 600.0,
+                       detach: bool = False):
+    global hook_executor
+    hook_executor = HookExecutor(command, batch_size, timeout, parallel, run_timeout, detach)
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Optional, TextIO
+
+from src.types import JobPriority
+
+
+class SongState:
+    Queued = "queued"
+    Metadata = "metadata"
+    Downloaded = "downloaded"
+    Decrypted = "decrypted"
+    Saved = "saved"
+    Skipped = "skipped"
+    Failed = "failed"
+
+
+class Job:
+    id: str
+    url: str
+    codec: str
+    force: bool
+    include: bool
+    finished: bool
+    priority: int
+    songs: dict[str, str]
+    _journal: Optional["JobJournal"]
+    _subscribers: list[asyncio.Queue]
+
+    def __init__(self, url: str, codec: str, force: bool = False, include: bool = False, job_id: str = None,
+                 journal: "JobJournal" = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.url = url
+        self.codec = codec
+        self.force = force
+        self.include = include
+        self.finished = False
+        self.priority = JobPriority.Normal
+        self.songs = {}
+        self._journal = journal
+        self._subscribers = []
+
+    def record(self, song_id: str, state: str):
+        self.songs[song_id] = state
+        if self._journal:
+            self._journal.append({"event": "song", "job": self.id, "song": song_id, "state": state})
+        self.publish({"event": "song", "job": self.id, "song": song_id, "state": state})
+
+    def subscribe(self) -> asyncio.Queue:
+        """Receive every following event of this job, ending with a "finish" event"""
+        queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def publish(self, event: dict):
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    def is_song_done(self, song_id: str) -> bool:
+        return self.songs.get(song_id) in (SongState.Saved, SongState.Skipped, SongState.Failed)
+
+    def failed_songs(self) -> list[str]:
+        return [song_id for song_id, state in self.songs.items() if state == SongState.Failed]
+
+    def forget_failed_songs(self):
+        self.songs = {song_id: state for song_id, state in self.songs.items() if state != SongState.Failed}
+
+
+class JobJournal:
+    """
+    Append-only record of every job and of the state transitions of its songs, written before the work
+    continues, so a crashed or interrupted run can be resumed without repeating the finished songs.
+    The file is compacted on start, keeping only the jobs that still have work to do.
+    """
+    path: Path
+    fsync: bool
+    jobs: dict[str, Job]
+    _file: TextIO
+
+    def __init__(self, path: str | Path, fsync: bool = False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.jobs = self._replay()
+        self._compact()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _replay(self) -> dict[str, Job]:
+        jobs = {}
+        if not self.path.exists():
+            return jobs
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut short by a crash
+                    continue
+                match record["event"]:
+                    case "job" if record["job"] in jobs:
+                        jobs[record["job"]].finished = False
+                    case "job":
+                        jobs[record["job"]] = Job(record["url"], record["codec"], record["force"], record["include"],
+                                                  job_id=record["job"], journal=self)
+                    case "song" if record["job"] in jobs:
+                        jobs[record["job"]].songs[record["song"]] = record["state"]
+                    case "finish" if record["job"] in jobs:
+                        jobs[record["job"]].finished = True
+        return jobs
+
+    def _compact(self):
+        self.jobs = {job_id: job for job_id, job in self.jobs.items() if not job.finished or job.failed_songs()}
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for job in self.jobs.values():
+                f.write(json.dumps(self._job_record(job), ensure_ascii=False) + "\n")
+                for song_id, state in job.songs.items():
+                    f.write(json.dumps({"event": "song", "job": job.id, "song": song_id, "state": state}) + "\n")
+                if job.finished:
+                    f.write(json.dumps({"event": "finish", "job": job.id}) + "\n")
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _job_record(job: Job) -> dict:
+        return {"event": "job", "job": job.id, "url": job.url, "codec": job.codec,
+                "force": job.force, "include": job.include}
+
+    def append(self, record: dict, sync: bool = False):
+        record["time"] = time.time()
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.fsync or sync:
+            os.fsync(self._file.fileno())
+
+    def start_job(self, url: str, codec: str, force: bool = False, include: bool = False) -> Job:
+        job = Job(url, codec, force, include, journal=self)
+        self.jobs[job.id] = job
+        self.append(self._job_record(job), sync=True)
+        return job
+
+    def restart_job(self, job: Job):
+        job.finished = False
+        self.append(self._job_record(job), sync=True)
+
+    def finish_job(self, job: Job):
+        job.finished = True
+        self.append({"event": "finish", "job": job.id}, sync=True)
+        job.publish({"event": "finish", "job": job.id})
+        if not job.failed_songs():
+            self.jobs.pop(job.id, None)
+
+    def resumable_jobs(self, retry_failed: bool = False) -> list[Job]:
+        return [job for job in self.jobs.values() if not job.finished or (retry_failed and job.failed_songs())]
+
+
+job_journal: JobJournal
+
+
+def init_job_journal(cache_dir: str, fsync: bool = False):
+    global job_journal
+    job_journal = JobJournal(Path(cache_dir) / "journal.jsonl", fsync)
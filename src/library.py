@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+from pydantic import BaseModel
+
+from src import metrics
+from src.db import DeferredCommit, connect_db
+
+
+class LibraryEntry(BaseModel):
+    song_id: str
+    codec: str
+    layout: str
+    actual_codec: Optional[str] = None
+    bit_depth: Optional[int] = None
+    sample_rate: Optional[int] = None
+    path: str
+    size: int
+    saved_at: float
+
+
+class LibraryIndex:
+    """
+    Songs that have been saved, keyed by song id, requested codec and layout
+    (an empty string for the album layout, the playlist id for playlist layouts).
+    An entry only counts while its file still exists with the recorded size.
+    """
+    db: sqlite3.Connection
+    commits: DeferredCommit
+
+    def __init__(self, db_path: str | Path):
+        self.db = connect_db(db_path)
+        self.commits = DeferredCommit(self.db)
+        self.db.execute("CREATE TABLE IF NOT EXISTS songs "
+                        "(song_id TEXT, codec TEXT, layout TEXT, actual_codec TEXT, bit_depth INTEGER, "
+                        "sample_rate INTEGER, path TEXT, size INTEGER, saved_at REAL, "
+                        "PRIMARY KEY (song_id, codec, layout))")
+        self.db.commit()
+
+    def get(self, song_id: str, codec: str, layout: str = "") -> Optional[LibraryEntry]:
+        row = self.db.execute("SELECT * FROM songs WHERE song_id = ? AND codec = ? AND layout = ?",
+                              (song_id, codec, layout)).fetchone()
+        if not row:
+            return None
+        entry = LibraryEntry(**dict(zip(LibraryEntry.model_fields.keys(), row)))
+        try:
+            if os.stat(entry.path).st_size != entry.size:
+                return None
+        except OSError:
+            return None
+        return entry
+
+    def contains(self, song_id: str, codec: str, layout: str = "") -> bool:
+        found = self.get(song_id, codec, layout) is not None
+        metrics.cache_lookup("library", found)
+        return found
+
+    def record(self, song_id: str, codec: str, path: str | Path, layout: str = "", actual_codec: str = None,
+               bit_depth: int = None, sample_rate: int = None):
+        path = str(Path(path).absolute())
+        self.db.execute("INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (song_id, codec, layout, actual_codec, bit_depth, sample_rate, path,
+                         os.stat(path).st_size, time.time()))
+        self.commits.changed()
+
+    def rescan(self) -> tuple[int, int]:
+        """
+        Check every entry against the disk. Entries whose file is gone are dropped and the size of
+        modified files (e.g. retagged by another program) is refreshed. Return the kept and removed counts
+        """
+        kept, removed, updated = 0, [], []
+        for song_id, codec, layout, path, size in self.db.execute(
+                "SELECT song_id, codec, layout, path, size FROM songs").fetchall():
+            try:
+                actual_size = os.stat(path).st_size
+            except OSError:
+                removed.append((song_id, codec, layout))
+                continue
+            if actual_size != size:
+                updated.append((actual_size, song_id, codec, layout))
+            kept += 1
+        self.db.executemany("DELETE FROM songs WHERE song_id = ? AND codec = ? AND layout = ?", removed)
+        self.db.executemany("UPDATE songs SET size = ? WHERE song_id = ? AND codec = ? AND layout = ?", updated)
+        self.commits.commit()
+        return kept, len(removed)
+
+
+library_index: LibraryIndex
+
+
+def init_library_index(cache_dir: str):
+    global library_index
+    library_index = LibraryIndex(Path(cache_dir) / "library.db")
@@ -1,12 +1,12 @@
 from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
-from src.api import get_cover
+from src.api import get_cover_path
 from src.models.song_data import Datum
 from src.utils import ttml_convent_to_lrc
 
-NOT_INCLUDED_FIELD = ["cover", "playlistIndex", "bit_depth", "sample_rate",
+NOT_INCLUDED_FIELD = ["cover_path", "playlistIndex", "bit_depth", "sample_rate",
                       "sample_rate_kHz", "song_id", "album_id", "album_created"]
 
 
@@ -25,7 +25,7 @@ class SongMetadata(BaseModel):
     tracknum: Optional[int] = None
     disk: Optional[int] = None
     lyrics: Optional[str] = None
-    cover: bytes = None
+    cover_path: Optional[str] = None
     cover_url: Optional[str] = None
     copyright: Optional[str] = None
     record_company: Optional[str] = None
@@ -35,6 +35,7 @@ class SongMetadata(BaseModel):
     bit_depth: Optional[int] = None
     sample_rate: Optional[int] = None
     sample_rate_kHz: Optional[str] = None
+    _lrc: dict[bool, str] = PrivateAttr(default_factory=dict)
 
     def to_itags_params(self, embed_metadata: list[str]):
         tags = []
@@ -45,8 +46,7 @@ class SongMetadata(BaseModel):
                 if key in NOT_INCLUDED_FIELD:
                     continue
                 if key == "lyrics":
-                    lrc = ttml_convent_to_lrc(value)
-                    tags.append(f"{key}={lrc}")
+                    tags.append(f"{key}={self.get_lrc()}")
                     continue
                 if key.lower() in ('upc', 'isrc'):
                     tags.append(f"WM/{key.lower()}={value}")
@@ -85,9 +85,16 @@ class SongMetadata(BaseModel):
 
     def set_lyrics(self, lyrics: str):
         self.lyrics = lyrics
+        self._lrc.clear()
+
+    def get_lrc(self, word_timing: bool = False) -> str:
+        if word_timing not in self._lrc:
+            self._lrc[word_timing] = ttml_convent_to_lrc(self.lyrics, word_timing)
+        return self._lrc[word_timing]
 
     async def get_cover(self, cover_format: str, cover_size: str):
-        self.cover = await get_cover(self.cover_url, cover_format, cover_size)
+        cover_path = await get_cover_path(self.cover_url, cover_format, cover_size)
+        self.cover_path = str(cover_path) if cover_path else None
 
     def set_playlist_index(self, index: int):
         self.playlistIndex = index
@@ -0,0 +1,235 @@
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Optional
+
+from src import tracing
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Id of the job whose song is being ripped, copied into the stage workers and threads that run its steps
+current_job: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_job", default=None)
+
+
+class Metric:
+    name: str
+    help: str
+    type: str
+    _values: dict[tuple[tuple[str, str], ...], object]
+    _lock: threading.Lock
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _labels(labels: dict) -> tuple[tuple[str, str], ...]:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @staticmethod
+    def _format_labels(labels: tuple[tuple[str, str], ...], extra: tuple[tuple[str, str], ...] = ()) -> str:
+        labels = labels + extra
+        if not labels:
+            return ""
+        escaped = [(key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                   for key, value in labels]
+        return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{self._format_labels(labels)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        """For totals that are counted elsewhere, such as the hits of an alru_cache"""
+        with self._lock:
+            self._values[self._labels(labels)] = value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._labels(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+    buckets: tuple[float, ...]
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for labels, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{self._format_labels(labels, (('le', le),))} {cumulative}")
+                lines.append(f"{self.name}_sum{self._format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+        return lines
+
+
+class JobStats:
+    """Time spent in every stage and bytes decrypted by one job, logged when the job finishes"""
+    stages: dict[str, tuple[int, float]]
+    decrypted_bytes: int
+    started_at: float
+
+    def __init__(self):
+        self.stages = {}
+        self.decrypted_bytes = 0
+        self.started_at = time.time()
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{stage} {count}x {seconds:.1f}s" for stage, (count, seconds) in self.stages.items())
+        return (f"{time.time() - self.started_at:.1f}s wall, {self.decrypted_bytes / 1024 / 1024:.1f} MiB decrypted"
+                + (f", {stages}" if stages else ""))
+
+
+class Registry:
+    metrics: list[Metric]
+    collectors: list[Callable[[], None]]
+    jobs: dict[str, JobStats]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Called before every render, to refresh gauges that are read from other modules"""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            collector()
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+    def job_stats(self, job_id: str) -> JobStats:
+        with self._lock:
+            if job_id not in self.jobs:
+                self.jobs[job_id] = JobStats()
+            return self.jobs[job_id]
+
+    def pop_job_stats(self, job_id: str) -> Optional[JobStats]:
+        with self._lock:
+            return self.jobs.pop(job_id, None)
+
+
+registry = Registry()
+stage_seconds = registry.add(Histogram("amdl_stage_seconds", "Time spent in each step of ripping a song"))
+decrypt_bytes = registry.add(Counter("amdl_decrypt_bytes_total", "Bytes decrypted by each device"))
+decrypt_seconds = registry.add(Counter("amdl_decrypt_seconds_total", "Time each device spent decrypting"))
+http_responses = registry.add(Counter("amdl_http_responses_total", "HTTP responses by host and status code"))
+cache_lookups = registry.add(Counter("amdl_cache_lookups_total", "Cache lookups by cache and result"))
+songs = registry.add(Counter("amdl_songs_total", "Songs by final state"))
+songs_in_flight = registry.add(Gauge("amdl_songs_in_flight", "Songs being ripped"))
+songs_queued = registry.add(Gauge("amdl_songs_queued", "Songs waiting for the scheduler"))
+stage_busy = registry.add(Gauge("amdl_stage_busy", "Busy workers of each pipeline stage"))
+stage_queued = registry.add(Gauge("amdl_stage_queued", "Songs waiting for each pipeline stage"))
+loop_stall_seconds = registry.add(Histogram("amdl_loop_stall_seconds", "Event loop stalls seen by the watchdog"))
+hook_runs = registry.add(Counter("amdl_hook_runs_total", "afterDownloaded command runs by result"))
+hook_songs = registry.add(Counter("amdl_hook_songs_total", "Songs handed to the afterDownloaded command"))
+
+
+def observe_stage(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage=stage)
+    if job_id := current_job.get():
+        stats = registry.job_stats(job_id)
+        with registry._lock:
+            count, total = stats.stages.get(stage, (0, 0.0))
+            stats.stages[stage] = (count + 1, total + seconds)
+
+
+def observe_decrypt(device: str, size: int, seconds: float):
+    decrypt_bytes.inc(size, device=device)
+    decrypt_seconds.inc(seconds, device=device)
+    if job_id := current_job.get():
+        stats = registry.job_stats(job_id)
+        with registry._lock:
+            stats.decrypted_bytes += size
+
+
+def cache_lookup(cache: str, hit: bool):
+    cache_lookups.inc(cache=cache, result="hit" if hit else "miss")
+
+
+@contextmanager
+def stage_timer(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        observe_stage(stage, end - start)
+        tracing.complete(stage, "stage", start, end)
+
+
+def timed(stage: str):
+    """Record the run time of an async function as the given stage"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def http_response() -> bytes:
+    body = registry.render().encode("utf-8")
+    return (b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+
+
+async def serve(host: str, port: int) -> asyncio.Server:
+    """Serve the metrics in the Prometheus text format on every path, for a scraper"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            writer.write(http_response())
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class Attributes(BaseModel):
+    upc: Optional[str] = None
+
+
+class Datum(BaseModel):
+    id: Optional[str] = None
+    attributes: Optional[Attributes] = None
+
+
+class AlbumUpcs(BaseModel):
+    data: Optional[List[Datum]] = None
+
+
+class Albums(BaseModel):
+    data: List[Datum] = []
+
+
+class Relationships(BaseModel):
+    albums: Optional[Albums] = None
+
+
+class Datum1(BaseModel):
+    id: Optional[str] = None
+    relationships: Optional[Relationships] = None
+
+
+class SongUpcs(BaseModel):
+    data: Optional[List[Datum1]] = None
@@ -3,16 +3,8 @@ from typing import List, Optional
 from pydantic import BaseModel
 
 
-class PlayParams(BaseModel):
-    id: Optional[str] = None
-    kind: Optional[str] = None
-    catalogId: Optional[str] = None
-    displayType: Optional[int] = None
-
-
 class Attributes(BaseModel):
     ttml: Optional[str] = None
-    playParams: PlayParams
 
 
 class Datum(BaseModel):
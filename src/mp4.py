@@ -12,12 +12,13 @@ import regex
 from bs4 import BeautifulSoup
 from loguru import logger
 
+from src import metrics, tracing
 from src.api import download_m3u8
 from src.exceptions import CodecNotFoundException
 from src.metadata import SongMetadata
 from src.types import *
-from src.utils import find_best_codec, get_codec_from_codec_id, get_suffix, convent_mac_timestamp_to_datetime, \
-    if_raw_atmos
+from src.utils import get_suffix, convent_mac_timestamp_to_datetime, if_raw_atmos
+from src.variants import get_variant_index
 
 
 def if_shell():
@@ -28,28 +29,27 @@ def if_shell():
 
 
 async def get_available_codecs(m3u8_url: str) -> Tuple[list[str], list[str]]:
-    parsed_m3u8 = m3u8.loads(await download_m3u8(m3u8_url), uri=m3u8_url)
-    codec_ids = [playlist.stream_info.audio for playlist in parsed_m3u8.playlists]
-    codecs = [get_codec_from_codec_id(codec_id) for codec_id in codec_ids]
-    return codecs, codec_ids
+    variants = (await get_variant_index(m3u8_url)).variants
+    return [variant.codec for variant in variants], [variant.codec_id for variant in variants]
 
+@metrics.timed("m3u8")
 async def extract_media(m3u8_url: str, codec: str, song_metadata: SongMetadata,
                         codec_priority: list[str], alternative_codec: bool = False, alacMax: Optional[int] = None,
                         atmosMax: Optional[int] = None) -> Tuple[str, list[str], str, Optional[int], Optional[int]]:
-    parsed_m3u8 = m3u8.loads(await download_m3u8(m3u8_url), uri=m3u8_url)
-    specifyPlaylist = find_best_codec(parsed_m3u8, codec, alacMax, atmosMax)
-    if not specifyPlaylist and alternative_codec:
+    variant_index = await get_variant_index(m3u8_url)
+    variant = variant_index.best(codec, alacMax, atmosMax)
+    if not variant and alternative_codec:
         logger.warning(f"Codec {codec} of song: {song_metadata.artist} - {song_metadata.title} did not found")
         for a_codec in codec_priority:
-            specifyPlaylist = find_best_codec(parsed_m3u8, a_codec, alacMax, atmosMax)
-            if specifyPlaylist:
+            variant = variant_index.best(a_codec, alacMax, atmosMax)
+            if variant:
                 codec = a_codec
                 break
-    if not specifyPlaylist:
+    if not variant:
         raise CodecNotFoundException
-    selected_codec = specifyPlaylist.media[0].group_id
+    selected_codec = variant.codec_id
     logger.info(f"Selected codec: {selected_codec} for song: {song_metadata.artist} - {song_metadata.title}")
-    stream = m3u8.loads(await download_m3u8(specifyPlaylist.absolute_uri), uri=specifyPlaylist.absolute_uri)
+    stream = m3u8.loads(await download_m3u8(variant.uri), uri=variant.uri)
     skds = [key.uri for key in stream.keys if regex.match('(skd?://[^"]*)', key.uri)]
     keys = [prefetchKey]
     key_suffix = CodecKeySuffix.KeySuffixDefault
@@ -68,13 +68,13 @@ async def extract_media(m3u8_url: str, codec: str, song_metadata: SongMetadata,
         if key.endswith(key_suffix) or key.endswith(CodecKeySuffix.KeySuffixDefault):
             keys.append(key)
     if codec == Codec.ALAC:
-        sample_rate, bit_depth = specifyPlaylist.media[0].extras.values()
-        sample_rate, bit_depth = int(sample_rate), int(bit_depth)
+        sample_rate, bit_depth = variant.sample_rate, variant.bit_depth
     else:
         sample_rate, bit_depth = None, None
     return stream.segment_map[0].absolute_uri, keys, selected_codec, bit_depth, sample_rate
 
 
+@metrics.timed("extract")
 async def extract_song(raw_song: bytes, codec: str) -> SongInfo:
     tmp_dir = TemporaryDirectory()
     mp4_name = uuid.uuid4().hex
@@ -83,11 +83,11 @@ async def extract_song(raw_song: bytes, codec: str) -> SongInfo:
         f.write(raw_song)
     nhml_name = (Path(tmp_dir.name) / Path(mp4_name).with_suffix('.nhml')).absolute()
     media_name = (Path(tmp_dir.name) / Path(mp4_name).with_suffix('.media')).absolute()
-    subprocess.run(f"gpac -i {raw_mp4.absolute()} nhmlw:pckp=true -o {nhml_name}",
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
+    tracing.run_subprocess(f"gpac -i {raw_mp4.absolute()} nhmlw:pckp=true -o {nhml_name}",
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
     xml_name = (Path(tmp_dir.name) / Path(mp4_name).with_suffix('.xml')).absolute()
-    subprocess.run(f"mp4box -diso {raw_mp4.absolute()} -out {xml_name}",
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
+    tracing.run_subprocess(f"mp4box -diso {raw_mp4.absolute()} -out {xml_name}",
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
     decoder_params = None
 
     with open(xml_name, "r") as f:
@@ -101,7 +101,7 @@ async def extract_song(raw_song: bytes, codec: str) -> SongInfo:
     match codec:
         case Codec.ALAC:
             alac_atom_name = (Path(tmp_dir.name) / Path(mp4_name).with_suffix('.atom')).absolute()
-            subprocess.run(
+            tracing.run_subprocess(
                 f"mp4extract moov/trak/mdia/minf/stbl/stsd/enca[0]/alac {raw_mp4.absolute()} {alac_atom_name}",
                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
             with open(alac_atom_name, "rb") as f:
@@ -144,6 +144,7 @@ async def extract_song(raw_song: bytes, codec: str) -> SongInfo:
     return SongInfo(codec=codec, raw=raw_song, samples=samples, nhml=raw_nhml, decoderParams=decoder_params, params=params)
 
 
+@metrics.timed("mux")
 async def encapsulate(song_info: SongInfo, decrypted_media: bytes, atmos_convent: bool) -> bytes:
     tmp_dir = TemporaryDirectory()
     name = uuid.uuid4().hex
@@ -158,13 +159,13 @@ async def encapsulate(song_info: SongInfo, decrypted_media: bytes, atmos_convent
                 nhml_xml = BeautifulSoup(song_info.nhml, features="xml")
                 nhml_xml.NHNTStream["baseMediaFile"] = media.name
                 f.write(str(nhml_xml))
-            subprocess.run(f"gpac -i {nhml_name.absolute()} nhmlr -o {song_name.absolute()}",
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
+            tracing.run_subprocess(f"gpac -i {nhml_name.absolute()} nhmlr -o {song_name.absolute()}",
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
             alac_params_atom_name = Path(tmp_dir.name) / Path(f"{name}.atom")
             with open(alac_params_atom_name.absolute(), "wb") as f:
                 f.write(song_info.decoderParams)
             final_m4a_name = Path(tmp_dir.name) / Path(f"{name}_final.m4a")
-            subprocess.run(
+            tracing.run_subprocess(
                 f"mp4edit --insert moov/trak/mdia/minf/stbl/stsd/alac:{alac_params_atom_name.absolute()} {song_name.absolute()} {final_m4a_name.absolute()}",
                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
             song_name = final_m4a_name
@@ -173,8 +174,8 @@ async def encapsulate(song_info: SongInfo, decrypted_media: bytes, atmos_convent
                 with open(song_name.absolute(), "wb") as f:
                     f.write(decrypted_media)
             else:
-                subprocess.run(f"gpac -i {media.absolute()} -o {song_name.absolute()}",
-                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
+                tracing.run_subprocess(f"gpac -i {media.absolute()} -o {song_name.absolute()}",
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
         case Codec.AAC_BINAURAL | Codec.AAC_DOWNMIX | Codec.AAC:
             nhml_name = Path(tmp_dir.name) / Path(f"{name}.nhml")
             info_name = Path(tmp_dir.name) / Path(f"{name}.info")
@@ -186,17 +187,18 @@ async def encapsulate(song_info: SongInfo, decrypted_media: bytes, atmos_convent
                 nhml_xml.NHNTStream["specificInfoFile"] = info_name.name
                 nhml_xml.NHNTStream["streamType"] = "5"
                 f.write(str(nhml_xml))
-            subprocess.run(f"gpac -i {nhml_name.absolute()} nhmlr -o {song_name.absolute()}",
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
+            tracing.run_subprocess(f"gpac -i {nhml_name.absolute()} nhmlr -o {song_name.absolute()}",
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
     if not if_raw_atmos(song_info.codec, atmos_convent):
-        subprocess.run(f'mp4box -brand "M4A " -ab "M4A " -ab "mp42" {song_name.absolute()}',
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
+        tracing.run_subprocess(f'mp4box -brand "M4A " -ab "M4A " -ab "mp42" {song_name.absolute()}',
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
     with open(song_name.absolute(), "rb") as f:
         final_song = f.read()
     tmp_dir.cleanup()
     return final_song
 
 
+@metrics.timed("tag")
 async def write_metadata(song: bytes, metadata: SongMetadata, embed_metadata: list[str],
                          cover_format: str, params: dict[str, Any]) -> bytes:
     tmp_dir = TemporaryDirectory()
@@ -205,17 +207,14 @@ async def write_metadata(song: bytes, metadata: SongMetadata, embed_metadata: li
     with open(song_name.absolute(), "wb") as f:
         f.write(song)
     absolute_cover_path = ""
-    if "cover" in embed_metadata:
-        cover_path = Path(tmp_dir.name) / Path(f"cover.{cover_format}")
-        absolute_cover_path = cover_path.absolute()
-        with open(cover_path.absolute(), "wb") as f:
-            f.write(metadata.cover)
-    subprocess.run(["mp4box",
-                    "-time", params.get("CreationTime").strftime("%d/%m/%Y-%H:%M:%S"),
-                    "-mtime", params.get("ModificationTime").strftime("%d/%m/%Y-%H:%M:%S"), "-keep-utc",
-                    "-name", f"1={metadata.title}", "-itags", ":".join(["tool=", f"cover={absolute_cover_path}",
-                              metadata.to_itags_params(embed_metadata)]),
-                    song_name.absolute()], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if "cover" in embed_metadata and metadata.cover_path:
+        absolute_cover_path = Path(metadata.cover_path).absolute()
+    tracing.run_subprocess(["mp4box",
+                            "-time", params.get("CreationTime").strftime("%d/%m/%Y-%H:%M:%S"),
+                            "-mtime", params.get("ModificationTime").strftime("%d/%m/%Y-%H:%M:%S"), "-keep-utc",
+                            "-name", f"1={metadata.title}", "-itags", ":".join(["tool=", f"cover={absolute_cover_path}",
+                                      metadata.to_itags_params(embed_metadata)]),
+                            song_name.absolute()], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     with open(song_name.absolute(), "rb") as f:
         embed_song = f.read()
     tmp_dir.cleanup()
@@ -225,6 +224,7 @@ async def write_metadata(song: bytes, metadata: SongMetadata, embed_metadata: li
 # There are suspected errors in M4A files encapsulated by MP4Box and GPAC,
 # causing some applications to be unable to correctly process Metadata (such as Android.media, Salt Music)
 # Using FFMPEG re-encapsulating solves this problem
+@metrics.timed("mux")
 async def fix_encapsulate(song: bytes) -> bytes:
     tmp_dir = TemporaryDirectory()
     name = uuid.uuid4().hex
@@ -232,7 +232,7 @@ async def fix_encapsulate(song: bytes) -> bytes:
     new_song_name = Path(tmp_dir.name) / Path(f"{name}_fixed.m4a")
     with open(song_name.absolute(), "wb") as f:
         f.write(song)
-    subprocess.run(
+    tracing.run_subprocess(
         f"ffmpeg -y -i {song_name.absolute()} -fflags +bitexact -map_metadata 0 -c:a copy -c:v copy {new_song_name.absolute()}",
         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
     with open(new_song_name.absolute(), "rb") as f:
@@ -244,6 +244,7 @@ async def fix_encapsulate(song: bytes) -> bytes:
 # FFMPEG will overwrite maxBitrate in DecoderConfigDescriptor
 # Using raw song's esds box to fix it
 # see also https://trac.ffmpeg.org/ticket/4894
+@metrics.timed("mux")
 async def fix_esds_box(raw_song: bytes, song: bytes) -> bytes:
     tmp_dir = TemporaryDirectory()
     name = uuid.uuid4().hex
@@ -255,10 +256,10 @@ async def fix_esds_box(raw_song: bytes, song: bytes) -> bytes:
         f.write(raw_song)
     with open(song_name.absolute(), "wb") as f:
         f.write(song)
-    subprocess.run(
+    tracing.run_subprocess(
         f"mp4extract moov/trak/mdia/minf/stbl/stsd/enca[0]/esds {raw_song_name.absolute()} {esds_name.absolute()}",
         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
-    subprocess.run(
+    tracing.run_subprocess(
         f"mp4edit --replace moov/trak/mdia/minf/stbl/stsd/mp4a/esds:{esds_name.absolute()} {song_name.absolute()} {final_song_name.absolute()}",
         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, shell=if_shell())
     with open(final_song_name.absolute(), "rb") as f:
@@ -267,12 +268,13 @@ async def fix_esds_box(raw_song: bytes, song: bytes) -> bytes:
     return final_song
 
 
+@metrics.timed("verify")
 async def check_song_integrity(song: bytes) -> bool:
     tmp_dir = TemporaryDirectory()
     name = uuid.uuid4().hex
     song_name = Path(tmp_dir.name) / Path(f"{name}.m4a")
     with open(song_name.absolute(), "wb") as f:
         f.write(song)
-    output = subprocess.run(f"ffmpeg -y -v error -i {song_name.absolute()} -c:a pcm_s16le -f null /dev/null", capture_output=True)
+    output = tracing.run_subprocess(f"ffmpeg -y -v error -i {song_name.absolute()} -c:a pcm_s16le -f null /dev/null", capture_output=True)
     tmp_dir.cleanup()
     return not bool(output.stderr)
@@ -0,0 +1,147 @@
+import os
+import shutil
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Callable
+
+import regex
+
+if sys.platform == "linux":
+    import fcntl
+
+# ioctl that shares the extents of one file with another on btrfs, XFS and other copy-on-write filesystems
+FICLONE = 0x40049409
+# Temporary files modified more recently than this many seconds ago may still be written by another instance
+STALE_TMP_AGE = 3600
+TMP_NAME = regex.compile(r"^\..+\.[0-9a-f]{32}\.tmp$")
+
+
+class OutputWriter:
+    """
+    Writes the ripped songs, covers and lyrics. Every file is written to a temporary file in its directory
+    and renamed over the target once complete, so an interrupted rip never leaves a truncated file
+    under a name that the existence checks take for a finished song.
+    Runs on the threads of the disk stage, never on the event loop.
+    """
+    fsync: bool
+    _directories: set[Path]
+    _writing: set[Path]
+
+    def __init__(self, fsync: bool = False):
+        self.fsync = fsync
+        self._directories = set()
+        self._writing = set()
+
+    def makedirs(self, directory: Path):
+        directory = directory.absolute()
+        if directory in self._directories:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        self._directories.add(directory)
+
+    @staticmethod
+    def _tmp_path(path: Path) -> Path:
+        return path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+
+    def _commit(self, tmp_path: Path, path: Path):
+        try:
+            if self.fsync:
+                with open(tmp_path, "rb+") as f:
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        if self.fsync and sys.platform != "win32":
+            # The rename itself is only durable once the directory is
+            directory = os.open(path.parent, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    def _write(self, path: Path, write: Callable[[Path], None]):
+        self.makedirs(path.parent)
+        tmp_path = self._tmp_path(path)
+        self._writing.add(tmp_path.absolute())
+        try:
+            try:
+                write(tmp_path)
+            except FileNotFoundError:
+                # The directory was removed since it was created
+                self._directories.discard(path.parent.absolute())
+                self.makedirs(path.parent)
+                write(tmp_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            self._writing.discard(tmp_path.absolute())
+            raise
+        try:
+            self._commit(tmp_path, path)
+        finally:
+            self._writing.discard(tmp_path.absolute())
+
+    def write(self, path: Path, data: bytes | str):
+        if isinstance(data, str):
+            self._write(path, lambda tmp_path: tmp_path.write_text(data, encoding="utf-8"))
+        else:
+            self._write(path, lambda tmp_path: tmp_path.write_bytes(data))
+
+    def copy(self, source: Path, path: Path):
+        self._write(path, lambda tmp_path: shutil.copyfile(source, tmp_path))
+
+    @staticmethod
+    def _reflink(source: Path, tmp_path: Path):
+        with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+    def _link(self, source: Path, tmp_path: Path, mode: str):
+        try:
+            if mode == "hardlink":
+                os.link(source, tmp_path)
+                return
+            if mode == "reflink" and sys.platform == "linux":
+                self._reflink(source, tmp_path)
+                return
+        except OSError:
+            # Another filesystem, or one without hardlinks or reflinks
+            tmp_path.unlink(missing_ok=True)
+        shutil.copyfile(source, tmp_path)
+
+    def link(self, source: Path, path: Path, mode: str):
+        """Put the existing file at path as a hardlink, a reflink or a copy, falling back to a copy"""
+        self._write(path, lambda tmp_path: self._link(source, tmp_path, mode))
+
+    def remove_stale(self, roots: list[Path]) -> int:
+        """
+        Remove the temporary files that rips interrupted between the write and the rename left under the roots,
+        except the ones being written. Return the number removed
+        """
+        removed = 0
+        now = time.time()
+        for root in roots:
+            for directory, _, filenames in os.walk(root):
+                for filename in filenames:
+                    if not TMP_NAME.match(filename):
+                        continue
+                    tmp_path = Path(directory, filename)
+                    if tmp_path.absolute() in self._writing:
+                        continue
+                    try:
+                        if now - tmp_path.stat().st_mtime < STALE_TMP_AGE:
+                            continue
+                        tmp_path.unlink()
+                    except OSError:
+                        continue
+                    removed += 1
+        return removed
+
+
+output_writer: OutputWriter
+
+
+def init_output_writer(fsync: bool = False):
+    global output_writer
+    output_writer = OutputWriter(fsync)
@@ -0,0 +1,119 @@
+import asyncio
+import contextvars
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+from src import metrics
+from src.adb import Device
+
+
+class Stage:
+    """
+    A pool of workers taking work from a bounded priority queue.
+    Putting work into a full queue waits, so a slow stage holds back the stages in front of it.
+    Threaded stages run each piece of work on its own event loop in a thread, for the steps that block on
+    gpac, mp4box, ffmpeg or the disk. Their threads are their own, one per worker, so that nothing else
+    running on the default executor can take them.
+    """
+    name: str
+    workers: int
+    threaded: bool
+    busy: int
+    _queue: asyncio.PriorityQueue
+    _counter: itertools.count
+    _worker_tasks: list[asyncio.Task]
+    _executor: Optional[ThreadPoolExecutor]
+
+    def __init__(self, name: str, workers: int, queue_size: int, threaded: bool = False):
+        self.name = name
+        self.workers = workers
+        self.threaded = threaded
+        self.busy = 0
+        self._queue = asyncio.PriorityQueue(queue_size)
+        self._counter = itertools.count()
+        self._worker_tasks = []
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix=f"stage-{name}") if threaded else None
+
+    def _start(self):
+        if self._worker_tasks:
+            return
+        for _ in range(self.workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    async def run(self, priority: int, factory: Callable[[], Awaitable]):
+        """Run the work on this stage and return its result. Lower priorities go first, then first come first served"""
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        # The work runs in the context of the song that submitted it, not in the context of the worker
+        await self._queue.put((priority, next(self._counter), factory, future, contextvars.copy_context()))
+        return await future
+
+    async def _worker(self):
+        while True:
+            _, _, factory, future, context = await self._queue.get()
+            if future.cancelled():
+                continue
+            self.busy += 1
+            try:
+                if self.threaded:
+                    result = await asyncio.get_running_loop().run_in_executor(self._executor, context.run,
+                                                                              asyncio.run, factory())
+                else:
+                    result = await asyncio.create_task(factory(), context=context)
+                if not future.cancelled():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self.busy -= 1
+
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+
+class Pipeline:
+    """
+    The stages a song goes through: fetching from the network, muxing and checking on the CPU,
+    decrypting on a device and writing to disk. Every device gets its own decrypt stage with a worker
+    per decrypt connection, so a device always has the next song ready while the other stages are busy.
+    """
+    network: Stage
+    cpu: Stage
+    disk: Stage
+    queue_size: int
+    _decrypt_stages: dict[str, Stage]
+
+    def __init__(self, network_workers: int, cpu_workers: int, disk_workers: int, queue_size: int):
+        self.queue_size = queue_size
+        self.network = Stage("network", network_workers, queue_size)
+        self.cpu = Stage("cpu", cpu_workers or os.cpu_count() or 1, queue_size, threaded=True)
+        self.disk = Stage("disk", disk_workers, queue_size, threaded=True)
+        self._decrypt_stages = {}
+
+    def decrypt(self, device: Device) -> Stage:
+        stage = self._decrypt_stages.get(device.serial)
+        if not stage:
+            stage = self._decrypt_stages[device.serial] = Stage(f"decrypt-{device.serial}",
+                                                                len(device.hyperDecryptDevices) or 1, self.queue_size)
+        return stage
+
+    def stages(self) -> list[Stage]:
+        return [self.network, self.cpu, *self._decrypt_stages.values(), self.disk]
+
+
+pipeline: Pipeline
+
+
+def _collect_metrics():
+    for stage in pipeline.stages():
+        metrics.stage_busy.set(stage.busy, stage=stage.name)
+        metrics.stage_queued.set(stage.queued(), stage=stage.name)
+
+
+def init_pipeline(network_workers: int, cpu_workers: int, disk_workers: int, queue_size: int):
+    global pipeline
+    pipeline = Pipeline(network_workers, cpu_workers, disk_workers, queue_size)
+    metrics.registry.add_collector(_collect_metrics)
@@ -1,31 +1,21 @@
 from typing import Optional
 
-import m3u8
 from loguru import logger
 from pydantic import BaseModel
 
-from src.api import get_song_info, get_m3u8_from_api, download_m3u8
+from src.api import get_song_info, get_m3u8_from_api
 from src.config import Config, Device
 from src.exceptions import CodecNotFoundException
 from src.metadata import SongMetadata
 from src.types import GlobalAuthParams
 from src.url import Song
-from src.utils import get_codec_from_codec_id
+from src.variants import get_variant_index
 
 
 async def get_available_audio_quality(m3u8_url: str):
-    parsed_m3u8 = m3u8.loads(await download_m3u8(m3u8_url), uri=m3u8_url)
-    result = []
-    for playlist in parsed_m3u8.playlists:
-        if get_codec_from_codec_id(playlist.stream_info.audio):
-            result.append(AudioQuality(codec_id=playlist.stream_info.audio,
-                                       codec=get_codec_from_codec_id(playlist.stream_info.audio),
-                                       bitrate=playlist.stream_info.bandwidth,
-                                       average_bitrate=playlist.stream_info.average_bandwidth,
-                                       channels=playlist.media[0].channels,
-                                       sample_rate=playlist.media[0].extras.get("sample_rate", None),
-                                       bit_depth=playlist.media[0].extras.get("bit_depth", None)))
-    return result
+    variant_index = await get_variant_index(m3u8_url)
+    return [AudioQuality.model_validate(variant.model_dump(exclude={"uri"}))
+            for variant in variant_index.variants if variant.codec]
 
 
 class AudioQuality(BaseModel):
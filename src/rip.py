@@ -1,136 +1,412 @@
 import asyncio
 import random
-import subprocess
+from pathlib import Path
+from typing import Optional
 
 from loguru import logger
 from tenacity import retry, retry_if_exception_type, stop_after_attempt
 
 from src.api import (get_song_info, get_song_lyrics, get_album_info, download_song,
-                     get_m3u8_from_api, get_artist_info, get_songs_from_artist, get_albums_from_artist,
-                     get_playlist_info_and_tracks, exist_on_storefront_by_album_id, exist_on_storefront_by_song_id)
+                     get_m3u8_from_api, get_artist_info, get_songs_from_artist, get_artist_albums,
+                     get_playlist_info_and_tracks, exist_on_storefront_by_album_id, exist_on_storefront_by_song_id,
+                     prefetch_storefront_availability)
 from src.config import Config
-from src.adb import Device
-from src.decrypt import decrypt
-from src.exceptions import SongNotPassIntegrityCheckException
+from src.dag import DAG
+from src import hooks, library, scheduler, pipeline, metrics, tracing
+from src.adb import Device, HyperDecryptDevice
+from src.decrypt import decrypt, pick_decrypt_device, start_prewarm, unpin_decrypt_device
+from src.exceptions import CodecNotFoundException, SongNotPassIntegrityCheckException
+from src.journal import Job, SongState
 from src.metadata import SongMetadata
 from src.models import PlaylistInfo
 from src.mp4 import extract_media, extract_song, encapsulate, write_metadata, fix_encapsulate, fix_esds_box, \
     check_song_integrity
-from src.save import save
-from src.types import GlobalAuthParams, Codec
+from src.save import save, save_from_library
+from src.models.song_data import Datum
+from src.types import GlobalAuthParams, Codec, JobPriority, SongInfo
 from src.url import Song, Album, URLType, Artist, Playlist
-from src.utils import check_song_exists, if_raw_atmos, playlist_write_song_index, get_codec_from_codec_id, timeit
+from src.utils import get_song_path, if_raw_atmos, playlist_write_song_index, get_codec_from_codec_id, timeit, \
+    get_library_layout, split_codecs
 
-task_lock = asyncio.Semaphore(16)
+# Albums of an artist whose tracks are being enumerated at the same time
+ARTIST_PARALLEL_ALBUMS = 4
+
+# Songs being decrypted and muxed, by song id, storefront, language, codec and codec id. The same song requested
+# by several jobs, or twice by one, is decrypted once and saved by every requester to its own path. The tags are
+# localized by storefront and language, so a request from another storefront gets its own flight
+song_flights = scheduler.SingleFlight("song_flights")
+
+
+def _in_library(song_id: str, codec: str, layout: str = "") -> bool:
+    return all(library.library_index.contains(song_id, requested_codec, layout)
+               for requested_codec in split_codecs(codec))
+
+
+async def rip_song(song: Song, auth_params: GlobalAuthParams, codec: str, config: Config, device: Device,
+                   force_save: bool = False, specified_m3u8: str = "", playlist: PlaylistInfo = None,
+                   job: Optional[Job] = None):
+    future = await submit_song(song, auth_params, codec, config, device, force_save, specified_m3u8, playlist, job)
+    if future:
+        await future
+
+
+async def submit_song(song: Song, auth_params: GlobalAuthParams, codec: str, config: Config, device: Device,
+                      force_save: bool = False, specified_m3u8: str = "", playlist: PlaylistInfo = None,
+                      job: Optional[Job] = None) -> Optional[asyncio.Future]:
+    """Queue the song on the scheduler, waiting while the job's queue is full. Return None if there is nothing to do"""
+    if job and job.is_song_done(song.id):
+        logger.debug(f"Song id {song.id} was already finished by job {job.id}")
+        return None
+    if not force_save and _in_library(song.id, codec, get_library_layout(playlist)):
+        logger.info(f"Song id {song.id} already exists in library")
+        if job:
+            job.record(song.id, SongState.Skipped)
+        return None
+    if job:
+        job.record(song.id, SongState.Queued)
+    return await scheduler.scheduler.submit(job, lambda: _run_song(song, auth_params, codec, config, device,
+                                                                   force_save, specified_m3u8, playlist, job))
 
 
 @logger.catch
 @timeit
 @retry(retry=retry_if_exception_type(SongNotPassIntegrityCheckException), stop=stop_after_attempt(1))
-async def rip_song(song: Song, auth_params: GlobalAuthParams, codec: str, config: Config, device: Device,
-                   force_save: bool = False, specified_m3u8: str = "", playlist: PlaylistInfo = None):
-    async with task_lock:
-        logger.debug(f"Task of song id {song.id} was created")
-        token = auth_params.anonymousAccessToken
-        song_data = await get_song_info(song.id, token, song.storefront, config.region.language)
+async def _run_song(song: Song, auth_params: GlobalAuthParams, codec: str, config: Config, device: Device,
+                    force_save: bool, specified_m3u8: str, playlist: Optional[PlaylistInfo], job: Optional[Job]):
+    context_token = metrics.current_job.set(job.id if job else None)
+    track_token = tracing.current_track.set(f"song {song.id}")
+    try:
+        with tracing.profile_song(song.id), tracing.span("rip_song", "song", song=song.id):
+            state = await _rip_song(song, auth_params, codec, config, device, force_save, specified_m3u8, playlist,
+                                    job)
+    except Exception:
+        metrics.songs.inc(state=SongState.Failed)
+        if job:
+            job.record(song.id, SongState.Failed)
+        raise
+    finally:
+        metrics.current_job.reset(context_token)
+        tracing.current_track.reset(track_token)
+        if tracing.tracer:
+            tracing.tracer.flush()
+    metrics.songs.inc(state=state)
+    if job:
+        job.record(song.id, state)
+
+
+class _SongFinished(Exception):
+    """Raised by a step of the song graph to stop ripping the song with the given SongState"""
+    state: str
+
+    def __init__(self, state: str):
+        self.state = state
+
+
+async def _fetch_song(song: Song, auth_params: GlobalAuthParams, codecs: list[str], config: Config, device: Device,
+                      force_save: bool, specified_m3u8: str, playlist: Optional[PlaylistInfo], job: Optional[Job]):
+    """
+    Metadata, cover, lyrics, m3u8 and the encrypted song, each fetched as soon as what it needs is known.
+    Everything but the media playlist and the encrypted song is fetched once for all the codecs.
+    Return a SongState if there is nothing left to rip, otherwise the song data, the metadata and,
+    by requested codec, either a SongState or the keys, codec id, bit depth, sample rate,
+    agent to decrypt with (None to pick one when decrypting) and encrypted song
+    """
+    layout = get_library_layout(playlist)
+    logger.debug(f"Task of song id {song.id} was created")
+    token = auth_params.anonymousAccessToken
+    # Agents picked for the codecs of this song, freed here if the song ends before they are handed over
+    pinned = []
+
+    async def check_song(song_data: Datum, available: bool) -> SongMetadata:
         song_metadata = SongMetadata.parse_from_song_data(song_data)
         if playlist:
             song_metadata.set_playlist_index(playlist.songIdIndexMapping.get(song.id))
         logger.info(f"Ripping song: {song_metadata.artist} - {song_metadata.title}")
-        if not await exist_on_storefront_by_song_id(song.id, song.storefront, auth_params.storefront,
-                                                    auth_params.anonymousAccessToken, config.region.language):
+        if not available:
             logger.error(
                 f"Unable to download song {song_metadata.artist} - {song_metadata.title}. "
                 f"This song does not exist in storefront {auth_params.storefront.upper()} "
                 f"and no device is available to decrypt it")
-            return
-        if not force_save and check_song_exists(song_metadata, config.download, codec, playlist):
+            raise _SongFinished(SongState.Failed)
+        if job:
+            job.record(song.id, SongState.Metadata)
+        return song_metadata
+
+    async def check_codec(requested_codec: str, song_metadata: SongMetadata):
+        if not force_save and (song_path := get_song_path(song_metadata, config.download, requested_codec,
+                                                          playlist)).exists():
             logger.info(f"Song: {song_metadata.artist} - {song_metadata.title} already exists")
+            library.library_index.record(song.id, requested_codec, song_path, layout)
+            raise _SongFinished(SongState.Skipped)
+        if playlist and config.download.playlistFromLibrary and not force_save and \
+                (entry := library.library_index.get(song.id, requested_codec)):
+            await link_from_library(requested_codec, song_metadata.model_copy(), entry)
+            raise _SongFinished(SongState.Saved)
+
+    async def check_codecs(song_metadata: SongMetadata) -> dict[str, Optional[str]]:
+        """By requested codec, the SongState if it is already on disk or linked from the library, otherwise None"""
+        states = {}
+        for requested_codec in codecs:
+            try:
+                await check_codec(requested_codec, song_metadata)
+                states[requested_codec] = None
+            except _SongFinished as e:
+                states[requested_codec] = e.state
+        if all(states.values()):
+            # Nothing is left to fetch for this song
+            raise _SongFinished(SongState.Saved if SongState.Saved in states.values() else SongState.Skipped)
+        return states
+
+    async def link_from_library(requested_codec: str, song_metadata: SongMetadata, entry: library.LibraryEntry):
+        # The playlist fields are never embedded, so the album file is already the playlist song
+        if entry.bit_depth and entry.sample_rate:
+            song_metadata.set_bit_depth_and_sample_rate(entry.bit_depth, entry.sample_rate)
+        actual_codec = entry.actual_codec or requested_codec
+        filename = await pipeline.pipeline.disk.run(
+            job.priority if job else JobPriority.Normal,
+            lambda: save_from_library(Path(entry.path), actual_codec, song_metadata, config.download, playlist))
+        library.library_index.record(song.id, requested_codec, filename, layout, actual_codec,
+                                     entry.bit_depth, entry.sample_rate)
+        logger.info(f"Song {song_metadata.artist} - {song_metadata.title} saved from {entry.path}")
+        if config.download.afterDownloaded:
+            hooks.hook_executor.submit(str(filename))
+
+    async def get_lyrics(song_data: Datum, song_metadata: SongMetadata):
+        if not song_data.attributes.hasTimeSyncedLyrics:
             return
-        await song_metadata.get_cover(config.download.coverFormat, config.download.coverSize)
-        if song_data.attributes.hasTimeSyncedLyrics:
-            if song.storefront.upper() != auth_params.storefront.upper():
-                logger.warning(f"No account is available for getting lyrics of storefront {song.storefront.upper()}. "
-                               f"Use storefront {auth_params.storefront.upper()} to get lyrics")
-            lyrics = await get_song_lyrics(song.id, auth_params.storefront, auth_params.accountAccessToken,
-                                           auth_params.dsid, auth_params.accountToken, config.region.language)
-            if lyrics:
-                song_metadata.lyrics = lyrics
-            else:
-                logger.warning(f"Unable to get lyrics of song: {song_metadata.artist} - {song_metadata.title}")
-        if config.m3u8Api.enable and codec == Codec.ALAC and not specified_m3u8:
-            m3u8_url = await get_m3u8_from_api(config.m3u8Api.endpoint, song.id, config.m3u8Api.enable)
-            if m3u8_url:
-                specified_m3u8 = m3u8_url
+        if song.storefront.upper() != auth_params.storefront.upper():
+            logger.warning(f"No account is available for getting lyrics of storefront {song.storefront.upper()}. "
+                           f"Use storefront {auth_params.storefront.upper()} to get lyrics")
+        lyrics = await get_song_lyrics(song.id, auth_params.storefront, auth_params.accountAccessToken,
+                                       auth_params.dsid, auth_params.accountToken, config.region.language)
+        if lyrics:
+            song_metadata.set_lyrics(lyrics)
+        else:
+            logger.warning(f"Unable to get lyrics of song: {song_metadata.artist} - {song_metadata.title}")
+
+    def uses_api_m3u8(codec: str) -> bool:
+        return config.m3u8Api.enable and codec == Codec.ALAC and not specified_m3u8
+
+    async def get_api_m3u8(states: dict[str, Optional[str]]) -> str:
+        if any(uses_api_m3u8(codec) for codec, state in states.items() if not state):
+            return await get_m3u8_from_api(config.m3u8Api.endpoint, song.id, config.m3u8Api.enable)
+        return ""
+
+    async def get_device_m3u8(song_data: Datum, song_metadata: SongMetadata, states: dict[str, Optional[str]],
+                              api_m3u8: str) -> str:
+        """The m3u8 of the device, asked once for all the remaining codecs that don't have another one"""
+        if specified_m3u8 or not config.download.getM3u8FromDevice:
+            return ""
+        if not song_data.attributes.extendedAssetUrls or not song_data.attributes.extendedAssetUrls.enhancedHls:
+            return ""
+        if all(uses_api_m3u8(codec) and api_m3u8 for codec, state in states.items() if not state):
+            return ""
+        device_m3u8 = await device.get_m3u8(song.id)
+        if device_m3u8:
+            logger.info(f"Use m3u8 from device for song: {song_metadata.artist} - {song_metadata.title}")
+        return device_m3u8 or ""
+
+    async def select_media(codec: str, song_data: Datum, song_metadata: SongMetadata, api_m3u8: str,
+                           device_m3u8: str):
+        m3u8_url = specified_m3u8
+        if uses_api_m3u8(codec):
+            if api_m3u8:
+                m3u8_url = api_m3u8
                 logger.info(f"Use m3u8 from API for song: {song_metadata.artist} - {song_metadata.title}")
-            elif not m3u8_url and config.m3u8Api.force:
+            elif config.m3u8Api.force:
                 logger.error(f"Failed to get m3u8 from API for song: {song_metadata.artist} - {song_metadata.title}")
-                return
+                raise _SongFinished(SongState.Failed)
         if not song_data.attributes.extendedAssetUrls:
             logger.error(
                 f"Failed to download song: {song_metadata.artist} - {song_metadata.title}. Audio does not exist")
-            return
-        if not specified_m3u8 and not song_data.attributes.extendedAssetUrls.enhancedHls:
+            raise _SongFinished(SongState.Failed)
+        if not m3u8_url and not song_data.attributes.extendedAssetUrls.enhancedHls:
             logger.error(
                 f"Failed to download song: {song_metadata.artist} - {song_metadata.title}. Lossless audio does not exist")
-            return
-        if not specified_m3u8 and config.download.getM3u8FromDevice:
-            device_m3u8 = await device.get_m3u8(song.id)
-            if device_m3u8:
-                specified_m3u8 = device_m3u8
-                logger.info(f"Use m3u8 from device for song: {song_metadata.artist} - {song_metadata.title}")
-        if specified_m3u8:
-            song_uri, keys, codec_id, bit_depth, sample_rate = await extract_media(
-                specified_m3u8, codec, song_metadata, config.download.codecPriority, config.download.codecAlternative, config.download.alacMax, config.download.alacMax)
-        else:
-            song_uri, keys, codec_id, bit_depth, sample_rate = await extract_media(
-                song_data.attributes.extendedAssetUrls.enhancedHls, codec, song_metadata,
-                config.download.codecPriority, config.download.codecAlternative, config.download.alacMax, config.download.atmosMax)
+            raise _SongFinished(SongState.Failed)
+        if not m3u8_url and device_m3u8:
+            m3u8_url = device_m3u8
+        try:
+            if m3u8_url:
+                song_uri, keys, codec_id, bit_depth, sample_rate = await extract_media(
+                    m3u8_url, codec, song_metadata, config.download.codecPriority, config.download.codecAlternative, config.download.alacMax, config.download.alacMax)
+            else:
+                song_uri, keys, codec_id, bit_depth, sample_rate = await extract_media(
+                    song_data.attributes.extendedAssetUrls.enhancedHls, codec, song_metadata,
+                    config.download.codecPriority, config.download.codecAlternative, config.download.alacMax, config.download.atmosMax)
+        except CodecNotFoundException:
+            logger.error(f"Codec {codec} of song: {song_metadata.artist} - {song_metadata.title} does not exist")
+            raise _SongFinished(SongState.Failed)
         if all([bool(bit_depth), bool(sample_rate)]):
-            song_metadata.set_bit_depth_and_sample_rate(bit_depth, sample_rate)
-            if not force_save and check_song_exists(song_metadata, config.download, codec, playlist):
+            codec_metadata = song_metadata.model_copy()
+            codec_metadata.set_bit_depth_and_sample_rate(bit_depth, sample_rate)
+            if not force_save and (song_path := get_song_path(codec_metadata, config.download, codec,
+                                                              playlist)).exists():
                 logger.info(f"Song: {song_metadata.artist} - {song_metadata.title} already exists")
-                return
-        logger.info(f"Downloading song: {song_metadata.artist} - {song_metadata.title}")
+                library.library_index.record(song.id, codec, song_path, layout,
+                                             get_codec_from_codec_id(codec_id), bit_depth, sample_rate)
+                raise _SongFinished(SongState.Skipped)
+        decrypt_device = None
+        if config.download.prewarmDecryptKeys:
+            # The song is decrypted by the agent its keys were prewarmed on
+            decrypt_device = pick_decrypt_device(device)
+            pinned.append(decrypt_device)
+            start_prewarm(keys, song_data, decrypt_device)
+        return song_uri, keys, codec_id, bit_depth, sample_rate, decrypt_device
+
+    def codec_steps(codec: str):
+        async def media(song_data: Datum, song_metadata: SongMetadata, states: dict[str, Optional[str]], api_m3u8: str,
+                        device_m3u8: str):
+            if states[codec]:
+                return states[codec]
+            # A codec that is finished does not stop the other codecs of the song
+            try:
+                return await select_media(codec, song_data, song_metadata, api_m3u8, device_m3u8)
+            except _SongFinished as e:
+                return e.state
+
+        async def download(song_metadata: SongMetadata, media: str | tuple) -> str | tuple:
+            if isinstance(media, str):
+                return media
+            logger.info(f"Downloading song: {song_metadata.artist} - {song_metadata.title}")
+            raw_song = await download_song(media[0])
+            if job:
+                job.record(song.id, SongState.Downloaded)
+            return *media[1:], raw_song
+
+        return media, download
+
+    graph = DAG()
+    graph.add("song_data", lambda: get_song_info(song.id, token, song.storefront, config.region.language))
+    graph.add("available", lambda: exist_on_storefront_by_song_id(song.id, song.storefront, auth_params.storefront,
+                                                                  auth_params.anonymousAccessToken,
+                                                                  config.region.language))
+    graph.add("metadata", check_song, "song_data", "available")
+    # Songs already on disk or in the library finish here, before anything else is fetched for them
+    graph.add("pending", check_codecs, "metadata")
+    graph.add("api_m3u8", get_api_m3u8, "pending")
+    graph.add("cover", lambda song_metadata, _: song_metadata.get_cover(config.download.coverFormat,
+                                                                        config.download.coverSize),
+              "metadata", "pending")
+    graph.add("lyrics", lambda song_data, song_metadata, _: get_lyrics(song_data, song_metadata),
+              "song_data", "metadata", "pending")
+    graph.add("device_m3u8", get_device_m3u8, "song_data", "metadata", "pending", "api_m3u8")
+    for codec in codecs:
+        media_step, download_step = codec_steps(codec)
+        graph.add(f"media {codec}", media_step, "song_data", "metadata", "pending", "api_m3u8", "device_m3u8")
+        graph.add(f"raw_song {codec}", download_step, "metadata", f"media {codec}")
+    try:
+        results = await graph.run()
+    except BaseException as e:
+        for agent in pinned:
+            unpin_decrypt_device(agent)
+        if isinstance(e, _SongFinished):
+            return e.state
+        raise
+    return results["song_data"], results["metadata"], {codec: results[f"raw_song {codec}"] for codec in codecs}
+
+
+async def _decrypt_song(song_info: SongInfo, keys: list[str], song_data: Datum, device: Device,
+                        decrypt_device: Optional[Device | HyperDecryptDevice] = None) -> bytes:
+    if decrypt_device:
+        idle = [agent for agent in device.hyperDecryptDevices if not agent.decryptLock.locked()]
+        if not decrypt_device.decryptLock.locked() or not idle:
+            return await decrypt(song_info, keys, song_data, decrypt_device)
+        # Setting the keys up on an idle agent is quicker than waiting for the song the prewarmed one is on
+        return await decrypt(song_info, keys, song_data, idle[0])
+    if device.hyperDecryptDevices:
+        if all([hyper_device.decryptLock.locked() for hyper_device in device.hyperDecryptDevices]):
+            return await decrypt(song_info, keys, song_data, random.choice(device.hyperDecryptDevices))
+        for hyperDecryptDevice in device.hyperDecryptDevices:
+            if not hyperDecryptDevice.decryptLock.locked():
+                return await decrypt(song_info, keys, song_data, hyperDecryptDevice)
+    return await decrypt(song_info, keys, song_data, device)
+
+
+async def _mux_song(song_info: SongInfo, decrypted_song: bytes, codec: str, song_metadata: SongMetadata,
+                    config: Config) -> bytes:
+    song_bytes = await encapsulate(song_info, decrypted_song, config.download.atmosConventToM4a)
+    if not if_raw_atmos(codec, config.download.atmosConventToM4a):
+        song_bytes = await write_metadata(song_bytes, song_metadata, config.metadata.embedMetadata,
+                                          config.download.coverFormat, song_info.params)
+        if codec != Codec.EC3 or codec != Codec.EC3:
+            song_bytes = await fix_encapsulate(song_bytes)
+        if codec == Codec.AAC or codec == Codec.AAC_DOWNMIX or codec == Codec.AAC_BINAURAL:
+            song_bytes = await fix_esds_box(song_info.raw, song_bytes)
+    if not await check_song_integrity(song_bytes):
+        logger.warning(f"Song {song_metadata.artist} - {song_metadata.title} did not pass the integrity check!")
+        raise SongNotPassIntegrityCheckException
+    return song_bytes
+
+
+async def _rip_song(song: Song, auth_params: GlobalAuthParams, codec: str, config: Config, device: Device,
+                    force_save: bool, specified_m3u8: str, playlist: Optional[PlaylistInfo], job: Optional[Job]) -> str:
+    layout = get_library_layout(playlist)
+    priority = job.priority if job else JobPriority.Normal
+    stages = pipeline.pipeline
+    fetched = await stages.network.run(priority, lambda: _fetch_song(song, auth_params, split_codecs(codec), config,
+                                                                     device, force_save, specified_m3u8, playlist,
+                                                                     job))
+    if isinstance(fetched, str):
+        return fetched
+    song_data, song_metadata, media = fetched
+
+    async def rip_codec(requested_codec: str, codec_media: str | tuple) -> str:
+        if isinstance(codec_media, str):
+            return codec_media
+        keys, codec_id, bit_depth, sample_rate, decrypt_device, raw_song = codec_media
         codec = get_codec_from_codec_id(codec_id)
-        raw_song = await download_song(song_uri)
-        song_info = await extract_song(raw_song, codec)
-        if device.hyperDecryptDevices:
-            if all([hyper_device.decryptLock.locked() for hyper_device in device.hyperDecryptDevices]):
-                decrypted_song = await decrypt(song_info, keys, song_data, random.choice(device.hyperDecryptDevices))
-            else:
-                for hyperDecryptDevice in device.hyperDecryptDevices:
-                    if not hyperDecryptDevice.decryptLock.locked():
-                        decrypted_song = await decrypt(song_info, keys, song_data, hyperDecryptDevice)
-                        break
-        else:
-            decrypted_song = await decrypt(song_info, keys, song_data, device)
-        song = await encapsulate(song_info, decrypted_song, config.download.atmosConventToM4a)
-        if not if_raw_atmos(codec, config.download.atmosConventToM4a):
-            song = await write_metadata(song, song_metadata, config.metadata.embedMetadata,
-                                        config.download.coverFormat, song_info.params)
-            if codec != Codec.EC3 or codec != Codec.EC3:
-                song = await fix_encapsulate(song)
-            if codec == Codec.AAC or codec == Codec.AAC_DOWNMIX or codec == Codec.AAC_BINAURAL:
-                song = await fix_esds_box(song_info.raw, song)
-        if not await check_song_integrity(song):
-            logger.warning(f"Song {song_metadata.artist} - {song_metadata.title} did not pass the integrity check!")
-            raise SongNotPassIntegrityCheckException
-        filename = await save(song, codec, song_metadata, config.download, playlist)
-        logger.info(f"Song {song_metadata.artist} - {song_metadata.title} saved!")
+        codec_metadata = song_metadata.model_copy()
+        if all([bool(bit_depth), bool(sample_rate)]):
+            codec_metadata.set_bit_depth_and_sample_rate(bit_depth, sample_rate)
+
+        async def decrypt_and_mux() -> bytes:
+            song_info = await stages.cpu.run(priority, lambda: extract_song(raw_song, codec))
+            decrypted_song = await stages.decrypt(device).run(
+                priority, lambda: _decrypt_song(song_info, keys, song_data, device, decrypt_device))
+            return await stages.cpu.run(priority,
+                                        lambda: _mux_song(song_info, decrypted_song, codec, codec_metadata, config))
+
+        # The muxed song does not depend on the requester otherwise: the playlist fields are never embedded
+        try:
+            song_bytes = await song_flights.run((song.id, song.storefront.lower(), config.region.language, codec,
+                                                 codec_id), decrypt_and_mux)
+        finally:
+            if decrypt_device:
+                unpin_decrypt_device(decrypt_device)
+        if job:
+            job.record(song.id, SongState.Decrypted)
+        filename = await stages.disk.run(priority,
+                                         lambda: save(song_bytes, codec, codec_metadata, config.download, playlist))
+        library.library_index.record(song.id, requested_codec, filename, layout, codec,
+                                     codec_metadata.bit_depth, codec_metadata.sample_rate)
+        logger.info(f"Song {codec_metadata.artist} - {codec_metadata.title} saved!")
         if config.download.afterDownloaded:
-            command = config.download.afterDownloaded.format(filename=filename)
-            logger.info(f"Executing command: {command}")
-            subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            hooks.hook_executor.submit(str(filename))
+        return SongState.Saved
+
+    states = await asyncio.gather(*[rip_codec(requested_codec, codec_media)
+                                    for requested_codec, codec_media in media.items()])
+    # The song failed if one of its codecs did
+    for state in (SongState.Failed, SongState.Saved):
+        if state in states:
+            return state
+    return SongState.Skipped
 
 
 @logger.catch
 @timeit
 async def rip_album(album: Album, auth_params: GlobalAuthParams, codec: str, config: Config, device: Device,
-                    force_save: bool = False):
+                    force_save: bool = False, job: Optional[Job] = None):
     album_info = await get_album_info(album.id, auth_params.anonymousAccessToken, album.storefront,
                                       config.region.language)
     logger.info(f"Ripping Album: {album_info.data[0].attributes.artistName} - {album_info.data[0].attributes.name}")
+    tracks = [track for track in album_info.data[0].relationships.tracks.data
+              if force_save or not _in_library(track.id, codec)]
+    if not tracks:
+        logger.info(f"Album: {album_info.data[0].attributes.artistName} - {album_info.data[0].attributes.name} "
+                    f"already exists in library")
+        return
     if not await exist_on_storefront_by_album_id(album.id, album.storefront, auth_params.storefront,
                                                  auth_params.anonymousAccessToken, config.region.language):
         logger.error(
@@ -138,10 +414,12 @@ async def rip_album(album: Album, auth_params: GlobalAuthParams, codec: str, con
             f"This album does not exist in storefront {auth_params.storefront.upper()} "
             f"and no device is available to decrypt it")
         return
-    async with asyncio.TaskGroup() as tg:
-        for track in album_info.data[0].relationships.tracks.data:
-            song = Song(id=track.id, storefront=album.storefront, url="", type=URLType.Song)
-            tg.create_task(rip_song(song, auth_params, codec, config, device, force_save=force_save))
+    futures = []
+    for track in tracks:
+        song = Song(id=track.id, storefront=album.storefront, url="", type=URLType.Song)
+        if future := await submit_song(song, auth_params, codec, config, device, force_save=force_save, job=job):
+            futures.append(future)
+    await asyncio.gather(*futures)
     logger.info(
         f"Album: {album_info.data[0].attributes.artistName} - {album_info.data[0].attributes.name} finished ripping")
 
@@ -149,18 +427,27 @@ async def rip_album(album: Album, auth_params: GlobalAuthParams, codec: str, con
 @logger.catch
 @timeit
 async def rip_playlist(playlist: Playlist, auth_params: GlobalAuthParams, codec: str, config: Config, device: Device,
-                       force_save: bool = False):
+                       force_save: bool = False, job: Optional[Job] = None):
     playlist_info = await get_playlist_info_and_tracks(playlist.id, auth_params.anonymousAccessToken,
                                                        playlist.storefront,
                                                        config.region.language)
     playlist_info = playlist_write_song_index(playlist_info)
     logger.info(
         f"Ripping Playlist: {playlist_info.data[0].attributes.curatorName} - {playlist_info.data[0].attributes.name}")
-    async with asyncio.TaskGroup() as tg:
-        for track in playlist_info.data[0].relationships.tracks.data:
-            song = Song(id=track.id, storefront=playlist.storefront, url="", type=URLType.Song)
-            tg.create_task(
-                rip_song(song, auth_params, codec, config, device, force_save=force_save, playlist=playlist_info))
+    layout = get_library_layout(playlist_info)
+    tracks = [track for track in playlist_info.data[0].relationships.tracks.data
+              if force_save or not _in_library(track.id, codec, layout)]
+    if playlist.storefront.upper() != auth_params.storefront.upper():
+        await prefetch_storefront_availability(auth_params.storefront, auth_params.anonymousAccessToken,
+                                               song_ids=[track.id for track in tracks],
+                                               storefront=playlist.storefront)
+    futures = []
+    for track in tracks:
+        song = Song(id=track.id, storefront=playlist.storefront, url="", type=URLType.Song)
+        if future := await submit_song(song, auth_params, codec, config, device, force_save=force_save,
+                                       playlist=playlist_info, job=job):
+            futures.append(future)
+    await asyncio.gather(*futures)
     logger.info(
         f"Playlist: {playlist_info.data[0].attributes.curatorName} - {playlist_info.data[0].attributes.name} finished ripping")
 
@@ -168,19 +455,35 @@ async def rip_playlist(playlist: Playlist, auth_params: GlobalAuthParams, codec:
 @logger.catch
 @timeit
 async def rip_artist(artist: Artist, auth_params: GlobalAuthParams, codec: str, config: Config, device: Device,
-                     force_save: bool = False, include_participate_in_works: bool = False):
+                     force_save: bool = False, include_participate_in_works: bool = False, job: Optional[Job] = None):
     artist_info = await get_artist_info(artist.id, artist.storefront, auth_params.anonymousAccessToken,
                                         config.region.language)
     logger.info(f"Ripping Artist: {artist_info.data[0].attributes.name}")
-    async with asyncio.TaskGroup() as tg:
-        if include_participate_in_works:
-            songs = await get_songs_from_artist(artist.id, artist.storefront, auth_params.anonymousAccessToken,
-                                                config.region.language)
-            for song_url in songs:
-                tg.create_task(rip_song(Song.parse_url(song_url), auth_params, codec, config, device, force_save))
-        else:
-            albums = await get_albums_from_artist(artist.id, artist.storefront, auth_params.anonymousAccessToken,
-                                                  config.region.language)
-            for album_url in albums:
-                tg.create_task(rip_album(Album.parse_url(album_url), auth_params, codec, config, device, force_save))
+    cross_storefront = artist.storefront.upper() != auth_params.storefront.upper()
+    if include_participate_in_works:
+        songs = [Song.parse_url(song_url) for song_url in
+                 await get_songs_from_artist(artist.id, artist.storefront, auth_params.anonymousAccessToken,
+                                             config.region.language)]
+        if cross_storefront:
+            await prefetch_storefront_availability(auth_params.storefront, auth_params.anonymousAccessToken,
+                                                   song_ids=[song.id for song in songs],
+                                                   storefront=artist.storefront)
+        futures = []
+        for song in songs:
+            if future := await submit_song(song, auth_params, codec, config, device, force_save, job=job):
+                futures.append(future)
+        await asyncio.gather(*futures)
+    else:
+        albums = await get_artist_albums(artist.id, artist.storefront, auth_params.anonymousAccessToken,
+                                         config.region.language)
+        if cross_storefront:
+            await prefetch_storefront_availability(auth_params.storefront, auth_params.anonymousAccessToken,
+                                                   upcs=[album.attributes.upc for album in albums])
+        album_slots = asyncio.Semaphore(ARTIST_PARALLEL_ALBUMS)
+        async with asyncio.TaskGroup() as tg:
+            for album_url in set([album.attributes.url for album in albums]):
+                await album_slots.acquire()
+                task = tg.create_task(rip_album(Album.parse_url(album_url), auth_params, codec, config, device,
+                                                force_save, job=job))
+                task.add_done_callback(lambda _: album_slots.release())
     logger.info(f"Artist: {artist_info.data[0].attributes.name} finished ripping")
@@ -1,25 +1,34 @@
-import os
 from pathlib import Path
 
+from src import api, metrics, output
 from src.config import Download
 from src.metadata import SongMetadata
 from src.models import PlaylistInfo
-from src.utils import ttml_convent_to_lrc, get_song_name_and_dir_path, get_suffix
+from src.utils import get_song_name_and_dir_path, get_suffix
 
 
+@metrics.timed("save")
 async def save(song: bytes, codec: str, metadata: SongMetadata, config: Download, playlist: PlaylistInfo = None):
     song_name, dir_path = get_song_name_and_dir_path(codec.upper(), config, metadata, playlist)
-    if not dir_path.exists() or not dir_path.is_dir():
-        os.makedirs(dir_path.absolute())
     song_path = dir_path / Path(song_name + get_suffix(codec, config.atmosConventToM4a))
-    with open(song_path.absolute(), "wb") as f:
-        f.write(song)
-    if config.saveCover and not playlist:
+    output.output_writer.write(song_path.absolute(), song)
+    if config.saveCover and not playlist and metadata.cover_path:
         cover_path = dir_path / Path(f"cover.{config.coverFormat}")
-        with open(cover_path.absolute(), "wb") as f:
-            f.write(metadata.cover)
+        api.artwork_cache.copy_to(Path(metadata.cover_path), cover_path.absolute(), output.output_writer.copy)
     if config.saveLyrics and metadata.lyrics:
         lrc_path = dir_path / Path(song_name + ".lrc")
-        with open(lrc_path.absolute(), "w", encoding="utf-8") as f:
-            f.write(ttml_convent_to_lrc(metadata.lyrics))
+        output.output_writer.write(lrc_path.absolute(), metadata.get_lrc(config.lyricsWordTiming))
+    return song_path.absolute()
+
+
+@metrics.timed("save")
+async def save_from_library(source: Path, codec: str, metadata: SongMetadata, config: Download,
+                            playlist: PlaylistInfo):
+    """Put a song that was already saved in the album layout into the playlist layout"""
+    song_name, dir_path = get_song_name_and_dir_path(codec.upper(), config, metadata, playlist)
+    song_path = dir_path / Path(song_name + get_suffix(codec, config.atmosConventToM4a))
+    output.output_writer.link(source, song_path.absolute(), config.playlistFromLibrary)
+    if config.saveLyrics and (lrc_source := source.with_suffix(".lrc")).exists():
+        lrc_path = dir_path / Path(song_name + ".lrc")
+        output.output_writer.link(lrc_source, lrc_path.absolute(), config.playlistFromLibrary)
     return song_path.absolute()
@@ -0,0 +1,154 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Hashable, Optional
+
+from src import metrics
+from src.journal import Job
+from src.types import JobPriority
+
+
+class _JobQueue:
+    priority: int
+    items: deque[tuple[Callable[[], Awaitable], asyncio.Future]]
+    slots: asyncio.Semaphore
+    waiting: int
+
+    def __init__(self, priority: int, size: int):
+        self.priority = priority
+        self.items = deque()
+        self.slots = asyncio.Semaphore(size)
+        self.waiting = 0
+
+
+class Scheduler:
+    """
+    Runs the songs of all jobs on a fixed number of workers.
+    The job with the highest priority goes first, jobs with the same priority take turns,
+    and every job has a bounded queue so that enumerating a large artist or playlist waits for the workers.
+    Interactive workers only take interactive jobs, so a single song never waits behind a bulk job.
+    """
+    workers: int
+    interactive_workers: int
+    queue_size: int
+    running: int
+    _queues: dict[str, _JobQueue]
+    _order: deque[str]
+    _condition: asyncio.Condition
+    _worker_tasks: list[asyncio.Task]
+
+    def __init__(self, workers: int, interactive_workers: int, queue_size: int):
+        self.workers = workers
+        self.interactive_workers = interactive_workers
+        self.queue_size = queue_size
+        self.running = 0
+        self._queues = {}
+        self._order = deque()
+        self._condition = asyncio.Condition()
+        self._worker_tasks = []
+
+    def _start(self):
+        if self._worker_tasks:
+            return
+        for _ in range(self.workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker(JobPriority.Bulk)))
+        for _ in range(self.interactive_workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker(JobPriority.Interactive)))
+
+    async def submit(self, job: Optional[Job], factory: Callable[[], Awaitable]) -> asyncio.Future:
+        """Queue a piece of work for the job, waiting while the job's queue is full. Return its future"""
+        self._start()
+        job_id = job.id if job else ""
+        priority = job.priority if job else JobPriority.Normal
+        queue = self._queues.get(job_id)
+        if not queue:
+            queue = self._queues[job_id] = _JobQueue(priority, self.queue_size)
+            self._order.append(job_id)
+        queue.waiting += 1
+        try:
+            await queue.slots.acquire()
+        finally:
+            queue.waiting -= 1
+        future = asyncio.get_running_loop().create_future()
+        queue.items.append((factory, future))
+        async with self._condition:
+            self._condition.notify_all()
+        return future
+
+    def _pop(self, max_priority: int) -> Optional[tuple[Callable[[], Awaitable], asyncio.Future]]:
+        priority = min((queue.priority for queue in self._queues.values()
+                        if queue.items and queue.priority <= max_priority), default=None)
+        if priority is None:
+            return None
+        for _ in range(len(self._order)):
+            job_id = self._order[0]
+            self._order.rotate(-1)
+            queue = self._queues[job_id]
+            if queue.items and queue.priority == priority:
+                item = queue.items.popleft()
+                queue.slots.release()
+                if not queue.items and not queue.waiting:
+                    del self._queues[job_id]
+                    self._order.remove(job_id)
+                return item
+
+    async def _next(self, max_priority: int) -> tuple[Callable[[], Awaitable], asyncio.Future]:
+        async with self._condition:
+            while not (item := self._pop(max_priority)):
+                await self._condition.wait()
+            return item
+
+    async def _worker(self, max_priority: int):
+        while True:
+            factory, future = await self._next(max_priority)
+            if future.cancelled():
+                continue
+            self.running += 1
+            try:
+                result = await factory()
+                if not future.cancelled():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self.running -= 1
+
+    def queued(self) -> dict[str, int]:
+        return {job_id: len(queue.items) for job_id, queue in self._queues.items()}
+
+
+class SingleFlight:
+    """
+    Runs the work for a key once while it is in flight: callers with the same key wait for that run
+    and share its result, or its exception. The work runs in a task of its own, so a caller that is cancelled
+    does not cancel it for the others. Nothing is kept once the run is over.
+    """
+    name: str
+    _flights: dict[Hashable, asyncio.Task]
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable]):
+        task = self._flights.get(key)
+        metrics.cache_lookup(self.name, task is not None)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        return await asyncio.shield(task)
+
+
+scheduler: Scheduler
+
+
+def _collect_metrics():
+    metrics.songs_in_flight.set(scheduler.running)
+    metrics.songs_queued.set(sum(scheduler.queued().values()))
+
+
+def init_scheduler(workers: int, interactive_workers: int, queue_size: int):
+    global scheduler
+    scheduler = Scheduler(workers, interactive_workers, queue_size)
+    metrics.registry.add_collector(_collect_metrics)
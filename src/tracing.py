@@ -0,0 +1,134 @@
+import atexit
+import cProfile
+import contextvars
+import json
+import os
+import subprocess
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, TextIO
+
+from loguru import logger
+
+# Track of the song being ripped, copied into the stage workers and threads that run its steps
+current_track: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_track", default=None)
+
+
+class Tracer:
+    """
+    Writes spans as Chrome trace events (chrome://tracing, ui.perfetto.dev), one track per song and per device.
+    Events are appended as they finish, without the closing bracket, which both viewers accept,
+    so the file stays readable if the process is killed.
+    """
+    path: Path
+    _file: TextIO
+    _lock: threading.Lock
+    _tracks: dict[str, int]
+    _pid: int
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._file.write("[\n")
+        self._lock = threading.Lock()
+        self._tracks = {}
+        self._pid = os.getpid()
+        self._write({"name": "process_name", "ph": "M", "pid": self._pid, "args": {"name": "AppleMusicDecrypt"}})
+
+    def _write(self, event: dict):
+        self._file.write(json.dumps(event, ensure_ascii=False) + ",\n")
+
+    def _tid(self, track: str) -> int:
+        tid = self._tracks.get(track)
+        if tid is None:
+            tid = self._tracks[track] = len(self._tracks) + 1
+            self._write({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": track}})
+        return tid
+
+    def complete(self, name: str, category: str, start: float, end: float, track: str = None, **args):
+        """Record a span between two time.perf_counter() values"""
+        track = track or current_track.get() or threading.current_thread().name
+        with self._lock:
+            self._write({"name": name, "cat": category, "ph": "X", "pid": self._pid, "tid": self._tid(track),
+                         "ts": start * 1_000_000, "dur": (end - start) * 1_000_000, "args": args})
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+tracer: Optional[Tracer] = None
+profile_songs: set[str] = set()
+profile_dir: Path = Path("profiles")
+_profile_lock = threading.Lock()
+
+
+def init_tracing(trace_file: str, songs: list[str], directory: str):
+    global tracer, profile_songs, profile_dir
+    if trace_file:
+        tracer = Tracer(trace_file)
+        atexit.register(tracer.close)
+        logger.info(f"Writing trace to {trace_file}")
+    profile_songs = set(songs)
+    profile_dir = Path(directory)
+
+
+def complete(name: str, category: str, start: float, end: float, track: str = None, **args):
+    if tracer:
+        tracer.complete(name, category, start, end, track, **args)
+
+
+@contextmanager
+def span(name: str, category: str = "", track: str = None, **args):
+    if not tracer:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.complete(name, category, start, time.perf_counter(), track, **args)
+
+
+def run_subprocess(args, **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run with a span named after the program"""
+    program = args.split(" ", 1)[0] if isinstance(args, str) else str(args[0])
+    with span(program, "subprocess"):
+        return subprocess.run(args, **kwargs)
+
+
+@contextmanager
+def profile_song(song_id: str):
+    """
+    Write a cProfile and a tracemalloc snapshot of the selected songs to the profile directory.
+    cProfile only sees the event loop thread, and everything else running on it at the same time,
+    so it is most useful for one song at a time. Only one song is profiled at a time
+    """
+    if song_id not in profile_songs or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    profiler = cProfile.Profile()
+    tracemalloc.start(25)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        _profile_lock.release()
+        profiler.dump_stats(profile_dir / f"{song_id}.prof")
+        with open(profile_dir / f"{song_id}.malloc.txt", "w", encoding="utf-8") as f:
+            for stat in snapshot.statistics("traceback")[:50]:
+                f.write(f"{stat}\n")
+                f.write("\n".join(stat.traceback.format()) + "\n\n")
+        logger.info(f"Profile of song id {song_id} written to {profile_dir}")
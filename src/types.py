@@ -30,6 +30,12 @@ class Codec:
     AAC = "aac"
 
 
+class JobPriority:
+    Interactive = 0
+    Normal = 1
+    Bulk = 2
+
+
 class CodecKeySuffix:
     KeySuffixAtmos = "c24"
     KeySuffixAlac = "c23"
@@ -1,23 +1,24 @@
 import asyncio
+import string
 import subprocess
 import sys
 import time
 from datetime import datetime, timedelta
+from functools import lru_cache
+from io import BytesIO
 from itertools import islice
 from pathlib import Path
 
 import m3u8
 import regex
-from bs4 import BeautifulSoup
 from loguru import logger
+from lxml import etree
 
 from src.config import Download
 from src.exceptions import NotTimeSyncedLyricsException
 from src.models import PlaylistInfo
 from src.types import *
 
-from copy import deepcopy
-
 
 def check_url(url):
     pattern = regex.compile(
@@ -37,27 +38,6 @@ def byte_length(i):
     return (i.bit_length() + 7) // 8
 
 
-def find_best_codec(parsed_m3u8: m3u8.M3U8, codec: str, alacMax, atmosMax) -> Optional[m3u8.Playlist]:
-    available_medias = []
-    for playlist in parsed_m3u8.playlists:
-        if regex.match(CodecRegex.get_pattern_by_codec(codec), playlist.stream_info.audio):
-            split_str = playlist.stream_info.audio.split('-')
-            if "alac" in playlist.stream_info.audio:
-                if int(split_str[3]) <= alacMax:
-                    available_medias.append(playlist)
-            elif "atmos" in playlist.stream_info.audio:
-                if int(split_str[2]) <= atmosMax:
-                    available_medias.append(playlist)
-            else:
-                available_medias.append(playlist)
-
-    if not available_medias:
-        return None
-    available_medias.sort(key=lambda x: x.stream_info.average_bandwidth, reverse=True)
-
-    return available_medias[0]
-
-
 def chunk(it, size):
     it = iter(it)
     return iter(lambda: tuple(islice(it, size)), ())
@@ -79,61 +59,92 @@ def timeit(func):
     return helper
 
 
-def get_digit_from_string(text: str) -> int:
-    return int(''.join(filter(str.isdigit, text)))
+TTML_NAMESPACE = "{http://www.w3.org/ns/ttml}"
+
 
+def ttml_time_to_ms(ttml_time: str) -> int:
+    # Apple Music uses "ss.fff", "mm:ss.fff" and "hh:mm:ss.fff", sometimes with a trailing "s"
+    parts = ttml_time.rstrip("s").split(":")
+    seconds, _, fraction = parts[-1].partition(".")
+    ms = int(seconds) * 1000 + int(fraction.ljust(3, "0")[:3] or 0)
+    if len(parts) >= 2:
+        ms += int(parts[-2]) * 60_000
+    if len(parts) == 3:
+        ms += int(parts[0]) * 3_600_000
+    return ms
+
+
+def lrc_timestamp(ms: int) -> str:
+    return f"{ms // 60_000:02d}:{ms // 1000 % 60:02d}.{ms % 1000 // 10:02d}"
+
+
+def _ttml_words(element: etree._Element) -> list[str]:
+    words = []
+    for span in element:
+        if any(child.get("begin") is not None for child in span.iterdescendants()):
+            # Containers such as background vocals (ttm:role="x-bg") hold their own timed words
+            words.append(span.text or "")
+            words.extend(_ttml_words(span))
+        elif span.get("begin") is not None:
+            words.append(f"<{lrc_timestamp(ttml_time_to_ms(span.get('begin')))}>{''.join(span.itertext())}")
+        else:
+            words.append("".join(span.itertext()))
+        if span.tail:
+            words.append(span.tail)
+    return words
 
-def ttml_convent_to_lrc(ttml: str) -> str:
-    b = BeautifulSoup(ttml, features="xml")
+
+def ttml_convent_to_lrc(ttml: str, word_timing: bool = False) -> str:
     lrc_lines = []
-    for item in b.tt.body.children:
-        for lyric in item.children:
-            h, m, s, ms = 0, 0, 0, 0
-            lyric_time: str = lyric.get("begin")
-            if not lyric_time:
-                raise NotTimeSyncedLyricsException
-            if lyric_time.find('.') == -1:
-                lyric_time += '.000'
-            match lyric_time.count(":"):
-                case 0:
-                    split_time = lyric_time.split(".")
-                    s, ms = get_digit_from_string(split_time[0]), get_digit_from_string(split_time[1])
-                case 1:
-                    split_time = lyric_time.split(":")
-                    s_ms = split_time[-1]
-                    del split_time[-1]
-                    split_time.extend(s_ms.split("."))
-                    m, s, ms = (get_digit_from_string(split_time[0]), get_digit_from_string(split_time[1]),
-                                get_digit_from_string(split_time[2]))
-                case 2:
-                    split_time = lyric_time.split(":")
-                    s_ms = split_time[-1]
-                    del split_time[-1]
-                    split_time.extend(s_ms.split("."))
-                    h, m, s, ms = (get_digit_from_string(split_time[0]), get_digit_from_string(split_time[1]),
-                                   get_digit_from_string(split_time[2]), get_digit_from_string(split_time[3]))
-            lrc_lines.append(
-                f"[{str(m + h * 60).rjust(2, '0')}:{str(s).rjust(2, '0')}.{str(int(ms / 10)).rjust(2, '0')}]{lyric.text}")
+    for _, lyric in etree.iterparse(BytesIO(ttml.encode("utf-8")), events=("end",), tag=f"{TTML_NAMESPACE}p"):
+        lyric_time = lyric.get("begin")
+        if not lyric_time:
+            raise NotTimeSyncedLyricsException
+        line_time = f"[{lrc_timestamp(ttml_time_to_ms(lyric_time))}]"
+        if word_timing and any(span.get("begin") is not None for span in lyric.iter(f"{TTML_NAMESPACE}span")):
+            lrc_lines.append(line_time + (lyric.text or "") + "".join(_ttml_words(lyric)))
+        else:
+            lrc_lines.append(line_time + "".join(lyric.itertext()))
+        lyric.clear(keep_tail=True)
     return "\n".join(lrc_lines)
 
 
-def check_song_exists(metadata, config: Download, codec: str, playlist: PlaylistInfo = None):
+def get_song_path(metadata, config: Download, codec: str, playlist: PlaylistInfo = None) -> Path:
     song_name, dir_path = get_song_name_and_dir_path(codec, config, metadata, playlist)
-    return (Path(dir_path) / Path(song_name + get_suffix(codec, config.atmosConventToM4a))).exists()
+    return Path(dir_path) / Path(song_name + get_suffix(codec, config.atmosConventToM4a))
+
+
+def check_song_exists(metadata, config: Download, codec: str, playlist: PlaylistInfo = None):
+    return get_song_path(metadata, config, codec, playlist).exists()
+
+
+def split_codecs(codec: str) -> list[str]:
+    """The codecs of a job, given as a comma separated list such as alac,ec3,aac"""
+    return list(dict.fromkeys(codec.split(",")))
+
+
+def get_library_layout(playlist: PlaylistInfo = None) -> str:
+    return playlist.data[0].id if playlist else ""
+
+
+PATH_UNSAFE_CHARACTERS = str.maketrans("", "", "<>:\"/\\|?*")
 
 
 def get_valid_filename(filename: str):
-    return "".join(i for i in filename if i not in ["<", ">", ":", "\"", "/", "\\", "|", "?", "*"])
+    return filename.translate(PATH_UNSAFE_CHARACTERS)
 
 
 def get_valid_dir_name(dirname: str):
     return regex.sub(r"\.+$", "", get_valid_filename(dirname))
 
 
+CODEC_PATTERNS = [(codec, regex.compile(CodecRegex.get_pattern_by_codec(codec)))
+                  for codec in [Codec.AC3, Codec.EC3, Codec.AAC, Codec.ALAC, Codec.AAC_BINAURAL, Codec.AAC_DOWNMIX]]
+
+
 def get_codec_from_codec_id(codec_id: str) -> str:
-    codecs = [Codec.AC3, Codec.EC3, Codec.AAC, Codec.ALAC, Codec.AAC_BINAURAL, Codec.AAC_DOWNMIX]
-    for codec in codecs:
-        if regex.match(CodecRegex.get_pattern_by_codec(codec), codec_id):
+    for codec, pattern in CODEC_PATTERNS:
+        if pattern.match(codec_id):
             return codec
     return ""
 
@@ -172,32 +183,75 @@ def get_audio_info_str(metadata, codec: str, config: Download):
 
 
 def get_path_safe_dict(param: dict):
-    new_param = deepcopy(param)
-    for key, val in new_param.items():
-        if isinstance(val, str):
-            new_param[key] = get_valid_filename(str(val))
-    return new_param
+    return {key: get_valid_filename(val) if isinstance(val, str) else val for key, val in param.items()}
 
 
-def get_song_name_and_dir_path(codec: str, config: Download, metadata, playlist: PlaylistInfo = None):
-    if playlist:
-        safe_meta = get_path_safe_dict(metadata.model_dump())
-        safe_pl_meta = get_path_safe_dict(playlist_metadata_to_params(playlist))
-        song_name = config.playlistSongNameFormat.format(codec=codec, playlistSongIndex=metadata.playlistIndex,
-                                                         audio_info=get_audio_info_str(metadata, codec, config),
-                                                         **safe_meta, **safe_pl_meta)
-        dir_path = Path(config.playlistDirPathFormat.format(codec=codec, **safe_meta, **safe_pl_meta))
-    else:
-        safe_meta = get_path_safe_dict(metadata.model_dump())
-        song_name = config.songNameFormat.format(codec=codec, audio_info=get_audio_info_str(metadata, codec, config),
-                                                 **safe_meta)
-        dir_path = Path(config.dirPathFormat.format(codec=codec, **safe_meta))
+class PathTemplate:
+    """A name or path format of the config, parsed once along with the fields it references"""
+    template: str
+    fields: tuple[str, ...]
+
+    def __init__(self, template: str):
+        self.template = template
+        self.fields = tuple(dict.fromkeys(regex.match(r"\w*", field)[0]
+                                          for _, field, _, _ in string.Formatter().parse(template) if field))
+
+
+@lru_cache
+def compile_path_template(template: str) -> PathTemplate:
+    return PathTemplate(template)
+
+
+@lru_cache(maxsize=4096)
+def _render_song_name_and_dir_path(name_template: PathTemplate, dir_template: PathTemplate,
+                                   params: tuple[tuple[str, object], ...]) -> tuple[str, Path]:
+    params = dict(params)
+    song_name = name_template.template.format(**params)
+    dir_path = Path(dir_template.template.format(**params))
     if sys.platform == "win32":
         song_name = get_valid_filename(song_name)
         dir_path = Path(*[get_valid_dir_name(part) if ":\\" not in part else part for part in dir_path.parts])
     return song_name, dir_path
 
 
+def get_output_roots(config: Download) -> list[Path]:
+    """The directories that every song and playlist directory is under: the fixed start of their path formats"""
+    roots = []
+    for path_format in (config.dirPathFormat, config.playlistDirPathFormat):
+        prefix = path_format.split("{", 1)[0]
+        root = Path(prefix) if prefix.endswith(("/", "\\")) else Path(prefix).parent
+        roots.append(root.absolute())
+    roots = list(dict.fromkeys(roots))
+    # A root inside another one is walked with it
+    return [root for root in roots if not any(other != root and root.is_relative_to(other) for other in roots)]
+
+
+def get_song_name_and_dir_path(codec: str, config: Download, metadata, playlist: PlaylistInfo = None):
+    if playlist:
+        name_template = compile_path_template(config.playlistSongNameFormat)
+        dir_template = compile_path_template(config.playlistDirPathFormat)
+        known = {"codec": codec, "playlistSongIndex": metadata.playlistIndex,
+                 **get_path_safe_dict(playlist_metadata_to_params(playlist))}
+    else:
+        name_template = compile_path_template(config.songNameFormat)
+        dir_template = compile_path_template(config.dirPathFormat)
+        known = {"codec": codec}
+    # Only the referenced fields are sanitized, and their values are the key of the rendered paths,
+    # so the existence check and the save of a song share one rendering
+    params = []
+    for field in dict.fromkeys(name_template.fields + dir_template.fields):
+        if field in known:
+            value = known[field]
+        elif field == "audio_info":
+            value = get_audio_info_str(metadata, codec, config)
+        else:
+            value = vars(metadata)[field]
+            if isinstance(value, str):
+                value = get_valid_filename(value)
+        params.append((field, value))
+    return _render_song_name_and_dir_path(name_template, dir_template, tuple(params))
+
+
 def playlist_write_song_index(playlist: PlaylistInfo):
     for track_index, track in enumerate(playlist.data[0].relationships.tracks.data):
         playlist.songIdIndexMapping[track.id] = track_index + 1
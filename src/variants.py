@@ -0,0 +1,84 @@
+from typing import Optional
+
+import m3u8
+from async_lru import alru_cache
+from pydantic import BaseModel
+
+from src import metrics
+from src.api import download_m3u8
+from src.utils import get_codec_from_codec_id
+
+
+class Variant(BaseModel):
+    codec_id: str
+    codec: str
+    uri: str
+    bitrate: int
+    average_bitrate: int
+    channels: Optional[str] = None
+    sample_rate: Optional[int] = None
+    bit_depth: Optional[int] = None
+
+    def within(self, alac_max: Optional[int], atmos_max: Optional[int]) -> bool:
+        split_str = self.codec_id.split("-")
+        if "alac" in self.codec_id:
+            return int(split_str[3]) <= alac_max
+        if "atmos" in self.codec_id:
+            return int(split_str[2]) <= atmos_max
+        return True
+
+
+class VariantIndex:
+    """
+    The audio variants of a master playlist, parsed once and shared by codec selection, quality reports
+    and extraction. Variants of every codec are kept sorted by average bitrate, highest first
+    """
+    url: str
+    variants: list[Variant]
+    _by_codec: dict[str, list[Variant]]
+
+    def __init__(self, url: str, variants: list[Variant]):
+        self.url = url
+        self.variants = variants
+        self._by_codec = {}
+        for variant in sorted(variants, key=lambda v: v.average_bitrate, reverse=True):
+            if variant.codec:
+                self._by_codec.setdefault(variant.codec, []).append(variant)
+
+    @classmethod
+    def parse(cls, content: str, url: str) -> "VariantIndex":
+        parsed_m3u8 = m3u8.loads(content, uri=url)
+        variants = []
+        for playlist in parsed_m3u8.playlists:
+            media = playlist.media[0] if playlist.media else None
+            extras = media.extras if media else {}
+            variants.append(Variant(codec_id=playlist.stream_info.audio,
+                                    codec=get_codec_from_codec_id(playlist.stream_info.audio),
+                                    uri=playlist.absolute_uri, bitrate=playlist.stream_info.bandwidth,
+                                    average_bitrate=playlist.stream_info.average_bandwidth or 0,
+                                    channels=media.channels if media else None,
+                                    sample_rate=extras.get("sample_rate"), bit_depth=extras.get("bit_depth")))
+        return cls(url, variants)
+
+    def by_codec(self, codec: str) -> list[Variant]:
+        return self._by_codec.get(codec, [])
+
+    def best(self, codec: str, alac_max: Optional[int], atmos_max: Optional[int]) -> Optional[Variant]:
+        for variant in self.by_codec(codec):
+            if variant.within(alac_max, atmos_max):
+                return variant
+        return None
+
+
+@alru_cache
+async def get_variant_index(m3u8_url: str) -> VariantIndex:
+    return VariantIndex.parse(await download_m3u8(m3u8_url), m3u8_url)
+
+
+def _collect_cache_metrics():
+    info = get_variant_index.cache_info()
+    metrics.cache_lookups.set(info.hits, cache=get_variant_index.__name__, result="hit")
+    metrics.cache_lookups.set(info.misses, cache=get_variant_index.__name__, result="miss")
+
+
+metrics.registry.add_collector(_collect_cache_metrics)
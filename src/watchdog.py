@@ -0,0 +1,119 @@
+import asyncio
+import atexit
+import sys
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+from src import metrics
+
+PROJECT_DIR = Path(__file__).parent.parent.absolute()
+
+
+class StallSite:
+    count: int
+    total: float
+    longest: float
+    stack: list[str]
+
+    def __init__(self, stack: list[str]):
+        self.count = 0
+        self.total = 0.0
+        self.longest = 0.0
+        self.stack = stack
+
+
+class Watchdog:
+    """
+    Reports every time the event loop is blocked for longer than the threshold.
+    A callback on the loop beats every quarter of the threshold, and a thread that sees the beat stop
+    takes the stack of the loop thread, which is what was blocking it. Stalls are aggregated by the
+    innermost frame in this project and reported at exit.
+    """
+    threshold: float
+    interval: float
+    sites: dict[str, StallSite]
+    _loop: Optional[asyncio.AbstractEventLoop]
+    _loop_thread_id: int
+    _last_beat: float
+    _sampled_beat: float
+    _sampled_stack: Optional[traceback.StackSummary]
+    _thread: Optional[threading.Thread]
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.sites = {}
+        self._loop = None
+        self._thread = None
+        self._sampled_beat = 0.0
+        self._sampled_stack = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        loop.call_soon(self._beat)
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        atexit.register(self.report)
+
+    def _beat(self):
+        now = time.monotonic()
+        stalled = now - self._last_beat - self.interval
+        if stalled > self.threshold:
+            stack = self._sampled_stack if self._sampled_beat == self._last_beat else None
+            self._record(stalled, stack)
+        self._last_beat = now
+        self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            last_beat = self._last_beat
+            if time.monotonic() - last_beat > self.threshold + self.interval and self._sampled_beat != last_beat:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame:
+                    self._sampled_stack = traceback.extract_stack(frame)
+                    self._sampled_beat = last_beat
+
+    @staticmethod
+    def _call_site(stack: traceback.StackSummary) -> str:
+        for frame in reversed(stack):
+            if Path(frame.filename).absolute().is_relative_to(PROJECT_DIR) and frame.filename != __file__:
+                return f"{Path(frame.filename).absolute().relative_to(PROJECT_DIR)}:{frame.lineno} in {frame.name}"
+        frame = stack[-1]
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+    def _record(self, stalled: float, stack: Optional[traceback.StackSummary]):
+        site = self._call_site(stack) if stack else "unknown (the stall ended before it was sampled)"
+        formatted = stack.format()[-8:] if stack else []
+        if site not in self.sites:
+            self.sites[site] = StallSite(formatted)
+        stall_site = self.sites[site]
+        stall_site.count += 1
+        stall_site.total += stalled
+        stall_site.longest = max(stall_site.longest, stalled)
+        metrics.loop_stall_seconds.observe(stalled)
+        logger.warning(f"Event loop was blocked for {stalled:.3f}s at {site}\n" + "".join(formatted))
+
+    def report(self):
+        if not self.sites:
+            return
+        lines = [f"Event loop stalls longer than {self.threshold}s, by call site:"]
+        for site, stall_site in sorted(self.sites.items(), key=lambda item: item[1].total, reverse=True):
+            lines.append(f"{stall_site.total:8.3f}s total {stall_site.count:6d}x max {stall_site.longest:.3f}s  {site}")
+        logger.info("\n".join(lines))
+
+
+watchdog: Optional[Watchdog] = None
+
+
+def init_watchdog(loop: asyncio.AbstractEventLoop, threshold: float):
+    global watchdog
+    watchdog = Watchdog(threshold)
+    watchdog.start(loop)